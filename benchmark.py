@@ -0,0 +1,386 @@
+#!/bin/python3
+#
+# benchmark.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" BENCHMARK.PY - Offline benchmarks of the hooks, run against the local mock APIs and nameserver in mock_apis.py.
+
+    Usage: benchmark.py [--providers godaddy,cloudflare] [--scenarios worker,main,scripts,concurrent]
+                        [--issuances N] [--names N] [--concurrency N] [--zones N]
+                        [--latency SECONDS] [--rate-429 P] [--rate-5xx P] [--propagation-delay SECONDS]
+                        [--save-baseline | --compare] [--baseline FILE] [--tolerance FRACTION]
+                        [--import-runs N] [--import-budget MS] [--imports-only]
+
+    Scenarios (each simulates certbot issuing certificates, running every auth hook and then every cleanup hook):
+      worker      CertbotWorker driven in-process (no interpreter start-up).
+      main        'python3 main.py' run once per hook, as the hook scripts do.
+      scripts     The cb-auth.sh and cb-cleanup.sh hook scripts themselves.
+      concurrent  Several issuances at once through main.py, for throughput.
+    Every run also times the hook's imports ('python3 -X importtime', importing main.py in fresh interpreters), and
+     fails with exit code 3 if their p50 is over IMPORT_BUDGET (or --import-budget; 0 turns the check off). With
+     --imports-only, that check is all that runs.
+    The hooks run from a sandbox copy of this directory whose settings.py points them at the mocks, so no credentials
+     (and nothing outside the sandbox) are touched. Results can be saved as a baseline and later compared against it.
+"""
+import os, sys, io, json, time, glob, shutil, tempfile, argparse, subprocess, contextlib
+from concurrent.futures import ThreadPoolExecutor
+import mock_apis
+
+
+# The directory holding this script and the rest of the project.
+PROJDIR = os.path.dirname(os.path.abspath(__file__))
+# Where --save-baseline writes (and --compare reads) the baseline results by default.
+BASELINE_FILE = os.path.join(PROJDIR, 'benchmark-baseline.json')
+# The zones the mock accounts hold besides the filler zones, and the domain each issuance is for.
+BENCHMARK_ZONES = ['example.com', 'example.co.uk']
+ISSUANCE_DOMAIN = 'host{index}.{provider}.example.co.uk'
+# The settings.py written into the sandbox: the project's own settings, with everything external redirected.
+SANDBOX_SETTINGS = '''
+exec(compile(open({original!r}).read(), {original!r}, 'exec'))
+DNS_API_KEYCHAIN = {keychain!r}
+LOGGING_DIR = {logs!r}
+STATE_DIR = {state!r}
+DEBUG = False
+DNS_PROPAGATION_NAMESERVERS = [('127.0.0.1', {dns_port})]
+DNS_API_RATE_LIMITS = {{}}
+HTTP_BACKOFF_BASE = 0.05
+HOOK_DAEMON_SOCKET = {socket!r}
+METRICS_EVENT_LOG = {events!r}
+METRICS_TEXTFILE = {textfile!r}
+'''
+# The metrics compared against the baseline, and whether a higher value is the better one.
+COMPARED_METRICS = {
+    'auth.p50': False, 'auth.p90': False, 'cleanup.p50': False, 'cleanup.p90': False,
+    'requests_per_issuance': False, 'cold_start.p50': False, 'throughput': True, 'imports.p50': False,
+}
+# The import statement timed by the import-time measurement: everything a hook process imports before main() runs.
+IMPORT_STATEMENT = 'import main'
+# The most the hook's imports may take (p50, in milliseconds, with bytecode cached) before the run fails.
+IMPORT_BUDGET = 50.0
+
+
+""" A scratch copy of the project whose settings point at the mocks. """
+class Sandbox:
+    def __init__(self, api_server, nameserver):
+        self.root = tempfile.mkdtemp(prefix='certbot-hooks-bench-')
+        self.logs = os.path.join(self.root, 'logs')
+        self.state = os.path.join(self.root, 'state')
+        self.events = os.path.join(self.logs, 'hook-events.jsonl')
+        os.makedirs(self.logs)
+        os.makedirs(self.state)
+        for path in glob.glob(os.path.join(PROJDIR, '*.py')) + glob.glob(os.path.join(PROJDIR, '*.sh')):
+            if os.path.basename(path) != 'settings.py':
+                shutil.copy2(path, self.root)
+        bases = mock_apis.api_bases(api_server)
+        keychain = {
+            'godaddy': {'API_KEY': 'benchmark', 'API_SECRET': 'benchmark', 'API_BASE': bases['godaddy']},
+            'cloudflare': {'API_EMAIL': 'benchmark@example.com', 'API_KEY': 'benchmark', 'API_BASE': bases['cloudflare']},
+        }
+        with open(os.path.join(self.root, 'settings.py'), 'w') as settings_file:
+            settings_file.write(SANDBOX_SETTINGS.format(original=os.path.join(PROJDIR, 'settings.py'), keychain=keychain,
+                logs=self.logs, state=self.state, dns_port=nameserver.port, socket=os.path.join(self.root, 'none.sock'),
+                events=self.events, textfile=os.path.join(self.state, 'certbot_hooks.prom')))
+
+    # Forget all shared state (caches, handoffs, zone lists), so each scenario starts cold.
+    def reset_state(self):
+        shutil.rmtree(self.state)
+        os.makedirs(self.state)
+
+    # Read the 'process_start' span of every hook run logged since the given offset into the event log.
+    def process_starts(self, offset):
+        try:
+            with open(self.events, 'r') as event_log:
+                event_log.seek(offset)
+                events = [json.loads(line) for line in event_log if line.strip()]
+        except OSError:
+            return []
+        return [span['duration'] for event in events for span in event['spans'] if span['name'] == 'process_start']
+
+    # The current size of the event log.
+    def events_offset(self):
+        return os.path.getsize(self.events) if os.path.exists(self.events) else 0
+
+    # Remove the sandbox.
+    def remove(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+""" One simulated certificate: its names, and the (CERTBOT_DOMAIN, validation) pair of each challenge. """
+class Issuance:
+    def __init__(self, provider, index, names):
+        base = ISSUANCE_DOMAIN.format(index=index, provider=provider)
+        self.provider = provider
+        self.domains = ([base, '*.' + base] + ['www{}.{}'.format(n, base) for n in range(max(names - 2, 0))])[:max(names, 1)]
+        # Certbot passes a wildcard's challenge with the '*.' removed.
+        self.challenges = [(domain[2:] if domain.startswith('*.') else domain, 'token-{}-{}-{}'.format(provider, index, n))
+            for n, domain in enumerate(self.domains)]
+
+    # The hooks certbot runs, in order: (hook, CERTBOT_DOMAIN, validation, CERTBOT_REMAINING_CHALLENGES).
+    def hooks(self):
+        count = len(self.challenges)
+        return [(hook, domain, token, count - 1 - n) for hook in ('auth', 'cleanup')
+            for n, (domain, token) in enumerate(self.challenges)]
+
+    # The CERTBOT_* environment of one hook.
+    def environment(self, domain, token, remaining):
+        return {'CERTBOT_DOMAIN': domain, 'CERTBOT_VALIDATION': token, 'CERTBOT_REMAINING_CHALLENGES': str(remaining),
+            'CERTBOT_ALL_DOMAINS': ','.join(self.domains), 'CERTBOT_HOOK_PROVIDER': self.provider}
+
+
+""" HOOK DRIVERS: each runs one hook and returns whether it succeeded. """
+# Run a hook through CertbotWorker in this process (the sandbox is first on sys.path, so its settings apply).
+def run_worker_hook(sandbox, issuance, hook, domain, token, remaining):
+    from certbot_worker import CertbotWorker
+    worker = CertbotWorker(domain, token, hook, 'dns', None, remaining, ','.join(issuance.domains), issuance.provider)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            return worker.dns_validation() is True
+    finally:
+        worker.close()
+
+# Run a hook as its own 'python3 main.py' process.
+def run_main_hook(sandbox, issuance, hook, domain, token, remaining):
+    env = dict(os.environ, **issuance.environment(domain, token, remaining))
+    completed = subprocess.run([sys.executable, os.path.join(sandbox.root, 'main.py'), "{} {} {}".format(domain, token, hook)],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return completed.returncode == 0 and '[SUCCESS]' in completed.stdout
+
+# Run a hook through its cb-*.sh script (with no hook daemon, so the script falls back to main.py).
+def run_script_hook(sandbox, issuance, hook, domain, token, remaining):
+    env = dict(os.environ, CERTBOT_HOOK_SOCKET=os.path.join(sandbox.root, 'none.sock'),
+        **issuance.environment(domain, token, remaining))
+    script = os.path.join(sandbox.root, 'cb-auth.sh' if hook == 'auth' else 'cb-cleanup.sh')
+    completed = subprocess.run(['bash', script], env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        universal_newlines=True)
+    return completed.returncode == 0 and '[SUCCESS]' in completed.stdout
+
+
+""" MEASUREMENT """
+# Nearest-rank percentiles (and the mean) of a list of durations, in milliseconds.
+def summarize(durations):
+    if not durations:
+        return {}
+    ordered = sorted(durations)
+    rank = lambda p: ordered[min(max(int(round(p / 100.0 * len(ordered) + 0.5)) - 1, 0), len(ordered) - 1)]
+    return dict([('p{}'.format(p), round(rank(p) * 1000, 2)) for p in (50, 90, 99)] +
+        [('max', round(ordered[-1] * 1000, 2)), ('mean', round(sum(ordered) / len(ordered) * 1000, 2)), ('n', len(ordered))])
+
+# Run every hook of every issuance with the given driver, 'concurrency' issuances at a time. Returns the results dict.
+def run_scenario(sandbox, state, driver, issuances, concurrency=1):
+    sandbox.reset_state()
+    state.take_counts()
+    offset = sandbox.events_offset()
+    durations = {'auth': [], 'cleanup': []}
+    failures = []
+    def run_issuance(issuance):
+        for hook, domain, token, remaining in issuance.hooks():
+            started = time.monotonic()
+            if driver(sandbox, issuance, hook, domain, token, remaining) is not True:
+                failures.append((hook, domain))
+            durations[hook].append(time.monotonic() - started)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_issuance, issuances))
+    elapsed = time.monotonic() - started
+    counts = state.take_counts()
+    hooks = len(durations['auth']) + len(durations['cleanup'])
+    results = {
+        'auth': summarize(durations['auth']),
+        'cleanup': summarize(durations['cleanup']),
+        'requests_per_issuance': round(sum(count for label, count in counts.items() if 'injected' not in label) / len(issuances), 2),
+        'injected_failures': sum(count for label, count in counts.items() if 'injected' in label),
+        'requests': counts,
+        'throughput': round(hooks / elapsed, 2) if elapsed > 0 else 0.0,
+        'failures': len(failures),
+    }
+    starts = sandbox.process_starts(offset)
+    if starts:
+        results['cold_start'] = summarize(starts)
+    return results
+
+# Time IMPORT_STATEMENT in 'runs' fresh interpreters started in the sandbox. Each run's time is the sum of the
+#  top-level rows of the -X importtime report after 'site' (the interpreter's own start-up imports). The first run
+#  is a warm-up, which writes the bytecode caches, so the budget doesn't depend on PYTHONDONTWRITEBYTECODE.
+def measure_imports(sandbox, runs):
+    durations = []
+    env = dict((key, value) for key, value in os.environ.items() if key != 'PYTHONDONTWRITEBYTECODE')
+    for run in range(runs + 1):
+        completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', IMPORT_STATEMENT], cwd=sandbox.root,
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, universal_newlines=True)
+        if completed.returncode != 0:
+            raise RuntimeError("Importing the hook failed:\n" + completed.stderr)
+        total, after_site = 0, False
+        for line in completed.stderr.splitlines():
+            if not line.startswith('import time:') or '|' not in line:
+                continue
+            _, cumulative, name = [field for field in line[len('import time:'):].split('|')]
+            if name.startswith('  ') or not cumulative.strip().isdigit():
+                continue
+            if after_site:
+                total += int(cumulative)
+            after_site = after_site or name.strip() == 'site'
+        if run > 0:
+            durations.append(total / 1000000.0)
+    return summarize(durations)
+
+
+""" REPORTING """
+# Get a dotted metric ('auth.p50') out of a scenario's results, or None.
+def metric_value(results, metric):
+    value = results
+    for part in metric.split('.'):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+# Print one scenario's results as a few readable lines.
+def print_results(name, results):
+    print("\n== {} ==".format(name))
+    for hook in ('auth', 'cleanup'):
+        stats = results[hook]
+        if stats:
+            print("  {:<8} p50 {:>8.1f}ms  p90 {:>8.1f}ms  p99 {:>8.1f}ms  max {:>8.1f}ms  (n={})".format(
+                hook, stats['p50'], stats['p90'], stats['p99'], stats['max'], stats['n']))
+    if 'cold_start' in results:
+        print("  cold start (interpreter start to main()) p50 {:.1f}ms, p90 {:.1f}ms".format(
+            results['cold_start']['p50'], results['cold_start']['p90']))
+    print("  {} API requests per issuance, {} injected failures, {} hooks/s, {} failed hooks".format(
+        results['requests_per_issuance'], results['injected_failures'], results['throughput'], results['failures']))
+    print("  requests: " + ', '.join("{}={}".format(label, count) for label, count in sorted(results['requests'].items())))
+
+# Print the import-time summary, and how it stands against the budget (in milliseconds) if one was given.
+def print_imports(imports, budget):
+    print("\n== imports ==")
+    print("  '{}' p50 {:.1f}ms  p90 {:.1f}ms  max {:.1f}ms  (n={}){}".format(IMPORT_STATEMENT, imports['p50'], imports['p90'],
+        imports['max'], imports['n'], '' if not budget else '  budget {:.1f}ms: {}'.format(budget,
+        'OVER BUDGET' if imports['p50'] > budget else 'ok')))
+
+# Compare results with a baseline. Returns the list of regressions, as printable strings.
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, scenario in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for metric, higher_is_better in sorted(COMPARED_METRICS.items()):
+            current, previous = metric_value(scenario, metric), metric_value(baseline[name], metric)
+            if current is None or not previous:
+                continue
+            change = (current - previous) / previous
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            print("  {:<28} {:<24} {:>10} -> {:>10} ({:+.0%}){}".format(name, metric, previous, current, change,
+                '  REGRESSION' if regressed else ''))
+            if regressed:
+                regressions.append("{} {}".format(name, metric))
+    return regressions
+
+
+
+""" Parse the options, start the mocks and sandbox, and run the scenarios. """
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the hooks offline, against mock DNS provider APIs.")
+    parser.add_argument('--providers', default='godaddy,cloudflare', help="Comma-separated providers to benchmark.")
+    parser.add_argument('--scenarios', default='worker,main,scripts,concurrent', help="Comma-separated scenarios to run.")
+    parser.add_argument('--issuances', type=int, default=10, help="Certificates issued per scenario and provider.")
+    parser.add_argument('--names', type=int, default=2, help="Names per certificate (apex, wildcard, then www names).")
+    parser.add_argument('--concurrency', type=int, default=8, help="Issuances run at once in the 'concurrent' scenario.")
+    parser.add_argument('--zones', type=int, default=2500, help="Zones in each mock account (to exercise pagination).")
+    parser.add_argument('--latency', type=float, default=0.02, help="Seconds added to every mock API response.")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of API requests answered with a 429.")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="Fraction of API requests answered with a 503.")
+    parser.add_argument('--propagation-delay', type=float, default=0.0, help="Seconds before the mock nameserver serves new values.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed for the injected failures.")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="The baseline results file.")
+    parser.add_argument('--save-baseline', action='store_true', help="Write the results to the baseline file.")
+    parser.add_argument('--compare', action='store_true', help="Compare the results with the baseline file.")
+    parser.add_argument('--tolerance', type=float, default=0.5, help="Allowed relative change before a metric regresses.")
+    parser.add_argument('--json', action='store_true', help="Print the full results as JSON at the end.")
+    parser.add_argument('--import-runs', type=int, default=20, help="Interpreters started to time the hook's imports.")
+    parser.add_argument('--import-budget', type=float, default=IMPORT_BUDGET, help="Fail if the imports' p50 exceeds this many ms.")
+    parser.add_argument('--imports-only', action='store_true', help="Only time the hook's imports against the budget.")
+    args = parser.parse_args()
+
+    state = mock_apis.MockDNSState(mock_apis.mock_zones(BENCHMARK_ZONES, args.zones), latency=args.latency,
+        rate_429=args.rate_429, rate_5xx=args.rate_5xx, propagation_delay=args.propagation_delay, seed=args.seed)
+    api_server, nameserver = mock_apis.start_mocks(state)
+    sandbox = Sandbox(api_server, nameserver)
+    # The in-process driver imports the project from the sandbox, so its settings are the redirected ones.
+    sys.path.insert(0, sandbox.root)
+    drivers = {
+        'worker': (run_worker_hook, 1),
+        'main': (run_main_hook, 1),
+        'scripts': (run_script_hook, 1),
+        'concurrent': (run_main_hook, max(args.concurrency, 1)),
+    }
+    results = {}
+    try:
+        for provider in [p.strip() for p in args.providers.split(',') if p.strip()]:
+            for scenario in [s.strip() for s in args.scenarios.split(',') if s.strip() and not args.imports_only]:
+                driver, concurrency = drivers[scenario]
+                issuances = [Issuance(provider, index, args.names) for index in range(args.issuances)]
+                name = "{}/{}".format(scenario, provider)
+                results[name] = run_scenario(sandbox, state, driver, issuances, concurrency)
+                print_results(name, results[name])
+        imports = measure_imports(sandbox, max(args.import_runs, 1))
+        print_imports(imports, args.import_budget)
+    finally:
+        api_server.shutdown()
+        nameserver.close()
+        sandbox.remove()
+
+    parameters = dict((key, value) for key, value in vars(args).items()
+        if key not in ('baseline', 'save_baseline', 'compare', 'tolerance', 'json', 'import_runs', 'import_budget',
+            'imports_only'))
+    exit_code = 0
+    if args.compare:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('parameters') != parameters:
+            print("\nNOTE: the baseline was recorded with different parameters: {}".format(baseline.get('parameters')))
+        print("\n== Comparison with {} (tolerance {:.0%}) ==".format(args.baseline, args.tolerance))
+        regressions = compare(results, baseline['results'], args.tolerance)
+        regressions += compare({'imports': {'imports': imports}}, {'imports': baseline.get('imports', {})}, args.tolerance)
+        print("\n{} regression(s){}".format(len(regressions), ': ' + ', '.join(regressions) if regressions else '.'))
+        exit_code = 1 if regressions else 0
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({'recorded': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+                'parameters': parameters, 'results': results, 'imports': imports}, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write('\n')
+        print("\nBaseline written to {}".format(args.baseline))
+    if args.json:
+        print(json.dumps(results, indent=2, sort_keys=True))
+    if any(result['failures'] for result in results.values()):
+        exit_code = exit_code or 2
+    if args.import_budget and imports['p50'] > args.import_budget:
+        exit_code = exit_code or 3
+    sys.exit(exit_code)
+
+
+
+""" Only run the benchmarks if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+#!/bin/python3
+#
+# build_zipapp.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" BUILD_ZIPAPP.PY - Packs the hooks into a single precompiled archive, certbot-hooks.pyz, for fast hook start-up.
+
+    Usage: build_zipapp.py [--output FILE] [--check]
+      Validates settings.py, then writes an archive holding the bytecode of every module the hooks import, plus
+      settings.py frozen into plain literals. The cb-*.sh hooks run the archive instead of main.py whenever it exists,
+      so no hook process compiles the project's modules, even where Python can't cache bytecode (a read-only install,
+      or PYTHONDONTWRITEBYTECODE). If a source file (settings.py included) changes after the build, or the archive is
+      run by a different Python version than built it, the archive notices and runs from the source tree instead until
+      it's rebuilt. With --check, the settings are only validated.
+"""
+import os, sys, ast, time, shutil, zipfile, argparse, tempfile, py_compile, modulefinder, importlib.util
+
+
+# The directory holding this script and the rest of the project.
+PROJDIR = os.path.dirname(os.path.abspath(__file__))
+# Where the archive is written by default. It holds the API keys from settings.py, so only its owner may read it.
+ARCHIVE_FILE = os.path.join(PROJDIR, 'certbot-hooks.pyz')
+# The archive's entry point, kept as source so that any interpreter can run it. It checks that the interpreter can
+#  load the archive's bytecode and that the sources haven't changed since the build, then runs main.py's main().
+#  Otherwise it runs main.py from the source tree instead.
+ARCHIVE_MAIN = '''""" __MAIN__.PY - The entry point of the hook archive written by build_zipapp.py. """
+import os, sys, importlib.util
+
+# The project the archive was built from, and the [mtime, size] of each of its source files at the time.
+PROJDIR = {projdir!r}
+SOURCES = {sources!r}
+# The bytecode version of the interpreter that built the archive. Other versions can't load its .pyc files.
+MAGIC_NUMBER = {magic!r}
+
+# The first source file which has changed since the build, or None. Missing files don't count (the archive may have
+#  been moved away from its sources).
+def changed_source():
+    for name, signature in SOURCES.items():
+        try:
+            stat = os.stat(os.path.join(PROJDIR, name))
+        except OSError:
+            continue
+        if [stat.st_mtime_ns, stat.st_size] != signature:
+            return name
+    return None
+
+if importlib.util.MAGIC_NUMBER != MAGIC_NUMBER:
+    reason = "the hook archive was built by a different Python version"
+else:
+    changed = changed_source()
+    reason = None if changed is None else "{{}} has changed since the hook archive was built".format(changed)
+if reason is not None:
+    if not os.path.isfile(os.path.join(PROJDIR, 'main.py')):
+        sys.exit("ERROR: {{}}, and its sources aren't in {{}}. Rebuild the archive with build_zipapp.py.".format(
+            reason, PROJDIR))
+    sys.stderr.write("NOTE: {{}}; running from the source tree. Rebuild the archive with build_zipapp.py.\\n".format(reason))
+    sys.path[0] = PROJDIR
+import main
+main.main()
+'''
+
+# Settings the hooks test with 'is True', where a 1 (say) would quietly count as False.
+BOOLEAN_SETTINGS = ['DEBUG', 'DNS_PROPAGATION_CHECK', 'DNS_COALESCE_WAIT', 'METRICS_ENABLED', 'LOG_COMPRESS']
+# Numeric settings, with their (lowest, highest) allowed values (None for no bound).
+NUMERIC_SETTINGS = {
+    'DNS_UPDATE_TIMER': (30, 600),
+    'DNS_PROPAGATION_INTERVAL': (0.1, None),
+    'DNS_PROPAGATION_BACKOFF': (1, None),
+    'DNS_PROPAGATION_MAX_INTERVAL': (0.1, None),
+    'DNS_PROPAGATION_PORT': (1, 65535),
+    'HTTP_RESPONDER_PORT': (1, 65535),
+    'HTTP_RESPONDER_TOKEN_TTL': (1, None),
+    'CLOUDFLARE_CACHE_TTL': (0, None),
+    'HANDOFF_TTL': (1, None),
+    'HTTP_CONNECT_TIMEOUT': (0.1, None),
+    'HTTP_READ_TIMEOUT': (0.1, None),
+    'HTTP_MAX_RETRIES': (0, None),
+    'HTTP_BACKOFF_BASE': (0, None),
+    'HTTP_BACKOFF_MAX': (0, None),
+    'HTTP_RETRY_BUDGET': (0, None),
+    'HTTP_POOL_SIZE': (1, None),
+    'DNS_BULK_CONCURRENCY': (1, None),
+    'GODADDY_TXT_TTL': (600, None),
+    'RFC2136_TXT_TTL': (0, None),
+    'ZONE_LIST_TTL': (0, None),
+    'LOG_MAX_BYTES': (0, None),
+    'LOG_BACKUP_COUNT': (0, None),
+}
+# Settings limited to a set of values.
+CHOICE_SETTINGS = {
+    'LOG_FORMAT': ('text', 'json'),
+}
+
+
+# Check the settings module's values. Returns a list of problems, as printable strings (empty if there are none).
+def validate_settings(settings):
+    from dns_apis import DNS_API_CLIENT
+    problems = []
+    values = dict((name, getattr(settings, name)) for name in dir(settings) if name.isupper())
+    for name, value in values.items():
+        # The archive's settings are written out as literals, so every value must survive that.
+        try:
+            if ast.literal_eval(repr(value)) != value:
+                raise ValueError
+        except (ValueError, SyntaxError):
+            problems.append("{} can't be frozen: {!r} isn't a plain literal.".format(name, value))
+    for name in BOOLEAN_SETTINGS:
+        if name in values and not isinstance(values[name], bool):
+            problems.append("{} must be True or False, not {!r}.".format(name, values[name]))
+    for name, (lowest, highest) in NUMERIC_SETTINGS.items():
+        value = values.get(name)
+        if name not in values:
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            problems.append("{} must be a number, not {!r}.".format(name, value))
+        elif (lowest is not None and value < lowest) or (highest is not None and value > highest):
+            problems.append("{} is {}, outside its range of {} to {}.".format(name, value, lowest, highest if highest is not None else 'any'))
+    for name, choices in CHOICE_SETTINGS.items():
+        if name in values and values[name] not in choices:
+            problems.append("{} must be one of {}, not {!r}.".format(name, ', '.join(choices), values[name]))
+    for provider in values.get('DNS_API_KEYCHAIN', {}):
+        if provider not in DNS_API_CLIENT:
+            problems.append("DNS_API_KEYCHAIN has an entry for '{}', which isn't a known provider ({}).".format(
+                provider, ', '.join(sorted(DNS_API_CLIENT))))
+    target = values.get('DNS_API_TARGET')
+    if target and (target not in DNS_API_CLIENT or target not in values.get('DNS_API_KEYCHAIN', {})):
+        problems.append("DNS_API_TARGET is '{}', which has no client or no DNS_API_KEYCHAIN entry.".format(target))
+    for provider, limit in values.get('DNS_API_RATE_LIMITS', {}).items():
+        if not (isinstance(limit, (list, tuple)) and len(limit) == 2 and all(
+                isinstance(n, (int, float)) and not isinstance(n, bool) and n > 0 for n in limit)):
+            problems.append("DNS_API_RATE_LIMITS['{}'] must be a (requests, seconds) pair of positive numbers, not {!r}.".format(
+                provider, limit))
+    return problems
+
+
+# Write the settings module's values out as a module of literals, in their original order.
+def freeze_settings(settings, source_path):
+    lines = ['""" SETTINGS.PY - {}, frozen by build_zipapp.py on {}. Rebuild the archive to change them. """'.format(
+        source_path, time.strftime('%Y-%m-%d %H:%M:%S'))]
+    for name, value in vars(settings).items():
+        if name.isupper():
+            lines.append("{} = {!r}".format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+# The project modules the hooks can import (including those imported inside functions), by module name.
+def hook_modules():
+    finder = modulefinder.ModuleFinder(path=[PROJDIR])
+    finder.run_script(os.path.join(PROJDIR, 'main.py'))
+    return sorted(name for name, module in finder.modules.items()
+        if module.__file__ and os.path.dirname(os.path.abspath(module.__file__)) == PROJDIR and name != '__main__') + ['main']
+
+
+# Compile a module's source into an unchecked hash-based .pyc (one which is used without looking for its source).
+def compile_module(source_path, pyc_path, display_name):
+    py_compile.compile(source_path, cfile=pyc_path, dfile=display_name, doraise=True,
+        invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+
+# Build the archive. Returns the list of settings problems (no archive is written if there are any).
+def build(output):
+    sys.path.insert(0, PROJDIR)
+    import settings
+    problems = validate_settings(settings)
+    if problems:
+        return problems
+    modules = hook_modules()
+    staging = tempfile.mkdtemp(prefix='certbot-hooks-pyz-')
+    try:
+        sources = {}
+        for name in modules:
+            source_path = os.path.join(PROJDIR, name + '.py')
+            stat = os.stat(source_path)
+            sources[name + '.py'] = [stat.st_mtime_ns, stat.st_size]
+            if name == 'settings':
+                frozen_path = os.path.join(staging, 'settings-frozen.py')
+                with open(frozen_path, 'w') as frozen_file:
+                    frozen_file.write(freeze_settings(settings, source_path))
+                source_path = frozen_path
+            compile_module(source_path, os.path.join(staging, 'archive', name + '.pyc'), name + '.py')
+        with open(os.path.join(staging, 'archive', '__main__.py'), 'w') as main_file:
+            main_file.write(ARCHIVE_MAIN.format(projdir=PROJDIR, sources=sources, magic=importlib.util.MAGIC_NUMBER))
+        # Laid out like a zipapp (a shebang line, then the zip), though with bytecode for everything but __main__.py,
+        #  which the zipapp module won't pack. Written next to the target and renamed into place, so a hook never runs a half-written archive.
+        partial = output + '.partial'
+        with open(partial, 'wb') as archive_file:
+            os.chmod(partial, 0o700)
+            archive_file.write(b'#!/usr/bin/env python3\n')
+            with zipfile.ZipFile(archive_file, 'w') as archive:
+                for name in sorted(os.listdir(os.path.join(staging, 'archive'))):
+                    archive.write(os.path.join(staging, 'archive', name), name)
+        os.replace(partial, output)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    print("Wrote {} ({} modules, {} bytes).".format(output, len(modules), os.path.getsize(output)))
+    return []
+
+
+""" Validate the settings and, unless only checking, build the archive. """
+def main():
+    parser = argparse.ArgumentParser(description="Build the precompiled hook archive (certbot-hooks.pyz).")
+    parser.add_argument('--output', default=ARCHIVE_FILE, help="Where to write the archive.")
+    parser.add_argument('--check', action='store_true', help="Only validate settings.py.")
+    args = parser.parse_args()
+    if args.check:
+        sys.path.insert(0, PROJDIR)
+        import settings
+        problems = validate_settings(settings)
+    else:
+        problems = build(os.path.abspath(args.output))
+    for problem in problems:
+        print("SETTINGS: " + problem)
+    if args.check and not problems:
+        print("settings.py is valid.")
+    sys.exit(1 if problems else 0)
+
+
+
+""" Only build the archive if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
@@ -13,11 +13,23 @@ echo "Token (http-only): $CERTBOT_TOKEN"
 ##########
 
 
-# Call the "main.py" python module with the 'auth' hook parameters.
-python3 "${PROJDIR}/main.py" "$CERTBOT_DOMAIN $CERTBOT_VALIDATION auth $CERTBOT_TOKEN"
+# Hand the hook to the long-lived daemon if it's running; otherwise run the hook directly, from the precompiled
+#   archive when build_zipapp.py has built one, or from "main.py" in the project directory.
+HOOK_ENTRY="${PROJDIR}/main.py"
+[[ -f "${PROJDIR}/certbot-hooks.pyz" ]] && HOOK_ENTRY="${PROJDIR}/certbot-hooks.pyz"
+source "${PROJDIR}/cb-daemon-client.sh"
+cb_daemon_call auth
+HOOK_STATUS=$?
+if [[ $HOOK_STATUS -eq 255 ]]; then
+    python3 "$HOOK_ENTRY" "$CERTBOT_DOMAIN $CERTBOT_VALIDATION auth $CERTBOT_TOKEN"
+    HOOK_STATUS=$?
+fi
 
 
 # Any tasks needed AFTER running the validation, do here...
 
 ##########
 
+
+# Pass the hook's status on to certbot, which aborts the issuance if the auth hook failed.
+exit $HOOK_STATUS
@@ -13,25 +13,21 @@ echo "Token (http-only): $CERTBOT_TOKEN"
 ##########
 
 
-# Run the python 'cleanup' hook from "main.py" in the current directory.
-python3 "${PROJDIR}/main.py" "$CERTBOT_DOMAIN $CERTBOT_VALIDATION cleanup $CERTBOT_TOKEN"
+# Hand the hook to the long-lived daemon if it's running; otherwise run the hook directly, from the precompiled
+#   archive when build_zipapp.py has built one, or from "main.py" in the project directory.
+HOOK_ENTRY="${PROJDIR}/main.py"
+[[ -f "${PROJDIR}/certbot-hooks.pyz" ]] && HOOK_ENTRY="${PROJDIR}/certbot-hooks.pyz"
+source "${PROJDIR}/cb-daemon-client.sh"
+cb_daemon_call cleanup
+[[ $? -eq 255 ]] && python3 "$HOOK_ENTRY" "$CERTBOT_DOMAIN $CERTBOT_VALIDATION cleanup $CERTBOT_TOKEN"
 
 
 # Any tasks to run AFTER the cleanup hook, do here...
 
-# Sample code, as an example of what can be scripted after the new certificates
-#   have been pulled and go live.
-#   The following code is specifically for a very hacky way to allow an IMAP server to use
-#    a new LE certificate without needing to do much to the original file.
-if [[ "${CERTBOT_DOMAIN^^}" == "IMAP.SAMPLEDOMAIN.NET" ]]; then
-    sleep 2
-    ln -s /etc/letsencrypt/live/IMAP.SAMPLEDOMAIN.NET/fullchain.pem /etc/dovecot/fullchain.pem
-    ln -s /etc/letsencrypt/live/IMAP.SAMPLEDOMAIN.NET/privkey.pem /etc/dovecot/privkey.pem
-    chown root.dovecot /etc/letsencrypt/live/IMAP.SAMPLEDOMAIN.NET/fullchain.pem
-    chown root.dovecot /etc/letsencrypt/live/IMAP.SAMPLEDOMAIN.NET/privkey.pem
-    chmod 640 /etc/letsencrypt/live/IMAP.SAMPLEDOMAIN.NET/privkey.pem
-    systemctl restart dovecot postfix
-fi
+# Installing renewed certificates and reloading the services using them is done by deploy.py (see DEPLOY_RULES in
+#   settings.py), not here: certbot runs this hook before the new certificate is saved, and once per challenge.
+#   renew.py deploys everything it renewed at the end of its run; for certificates issued by hand, pass
+#   --deploy-hook "python3 /path/to/deploy.py" to certbot.
 
 ##########
 
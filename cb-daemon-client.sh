@@ -0,0 +1,25 @@
+#!/bin/bash
+# Thin client for the optional hook daemon (hook_daemon.py). Sourced by cb-auth.sh and cb-cleanup.sh.
+#   Usage: cb_daemon_call {auth|cleanup}
+#   Returns 255 if the daemon isn't reachable (so the caller should run main.py directly);
+#    otherwise the hook's output is printed and the hook's exit code is returned.
+CERTBOT_HOOK_SOCKET="${CERTBOT_HOOK_SOCKET:-/run/certbot-hooks/daemon.sock}"
+
+function cb_daemon_call() {
+    [[ -S "$CERTBOT_HOOK_SOCKET" ]] || return 255
+    command -v socat &>/dev/null || return 255
+    local REQUEST="HOOK=${1}\n"
+    local VAR
+    # Pass every CERTBOT_* variable along (domain, validation, token, remaining challenges, ...).
+    for VAR in $(compgen -v CERTBOT_); do
+        [[ "$VAR" == "CERTBOT_HOOK_SOCKET" ]] && continue
+        REQUEST+="${VAR}=${!VAR}\n"
+    done
+    local REPLY
+    REPLY="$(printf '%b\n' "$REQUEST" | socat -t 900 - UNIX-CONNECT:"$CERTBOT_HOOK_SOCKET" 2>/dev/null)"
+    # A reply without the trailing EXIT line means the daemon never handled the request.
+    local STATUS="$(echo "$REPLY" | tail -n1 | grep -Po '^EXIT \K[0-9]+$')"
+    [[ -z "$STATUS" ]] && return 255
+    echo "$REPLY" | sed '$d'
+    return $STATUS
+}
@@ -0,0 +1,189 @@
+#!/bin/python3
+#
+# cert_inventory.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" CERT_INVENTORY.PY - An on-disk index of the certificates in certbot's live directories.
+
+    Usage: cert_inventory.py [list | due <days> | covers <name>] [live-dir ...]
+      Refreshes the index from the live directories (CERT_INVENTORY_LIVE_DIRS unless given), then prints the matching
+      certificates, earliest expiry first.
+"""
+import os, sys, time, datetime
+from cert_parser import load_pem_certificates, parse_certificate
+from state_store import StateStore
+from settings import *
+
+
+# The state-store key holding the index: {fullchain path: entry}.
+INVENTORY_KEY = 'certificates'
+
+
+""" One indexed certificate: the leaf of a live lineage's fullchain.pem. """
+class CertificateRecord:
+    def __init__(self, path, entry):
+        self.path = path
+        self.lineage = os.path.basename(os.path.dirname(path))
+        self.not_before = entry.get('not_before')
+        self.not_after = entry.get('not_after')
+        self.subject = entry.get('subject', '')
+        self.names = entry.get('names', [])
+        self.issuer = entry.get('issuer', '')
+        self.key_type = entry.get('key_type', '')
+    # The certificate's notAfter as an aware UTC datetime, or None if it couldn't be parsed.
+    @property
+    def expiry(self):
+        if self.not_after is None:
+            return None
+        return datetime.datetime.fromtimestamp(self.not_after, datetime.timezone.utc)
+    # Whether the certificate is valid for the given host name, directly or through a wildcard.
+    def covers(self, name):
+        name = name.lower().rstrip('.')
+        if name in self.names:
+            return True
+        parent = name.partition('.')[2]
+        return bool(parent) and ('*.' + parent) in self.names
+
+
+""" The index of every certificate under one or more certbot 'live' directories.
+     Each entry remembers the inode, size and mtime of the file it was parsed from, so a refresh only re-reads the
+     fullchain.pem files certbot has replaced since. The index is kept in STATE_DIR as a single StateStore entry. """
+class CertificateInventory:
+    def __init__(self, index_path=None):
+        self.store = StateStore(index_path or os.path.join(STATE_DIR, 'cert-inventory.json'))
+        self.entries = self.store.get(INVENTORY_KEY, {})
+        self.last_refresh = {'scanned': 0, 'parsed': 0, 'removed': 0}
+
+    # Parse one fullchain.pem into an index entry. Unreadable certificates are indexed without dates, so they're
+    #  treated as due (and not re-read until the file changes).
+    def _parse(self, path, stat):
+        entry = {'inode': stat.st_ino, 'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        try:
+            certificates = load_pem_certificates(path)
+            fields = parse_certificate(certificates[0])
+        except (OSError, ValueError, IndexError):
+            entry['not_after'] = None
+            return entry
+        entry.update({
+            'not_before': fields['not_before'].timestamp(),
+            'not_after': fields['not_after'].timestamp(),
+            'subject': fields['subject'],
+            'names': fields['names'],
+            'issuer': fields['issuer'],
+            'key_type': fields['key_type'],
+        })
+        return entry
+
+    # Bring the index up to date with the given live directories. Only new or changed certificates are parsed, and
+    #  lineages that disappeared from a scanned directory are dropped. The index is only rewritten if anything changed.
+    def refresh(self, live_dirs=None):
+        live_dirs = [os.path.abspath(live_dir) for live_dir in (live_dirs or CERT_INVENTORY_LIVE_DIRS)]
+        seen = set()
+        changed = False
+        self.last_refresh = {'scanned': 0, 'parsed': 0, 'removed': 0}
+        for live_dir in live_dirs:
+            try:
+                lineages = [entry.name for entry in os.scandir(live_dir) if entry.is_dir()]
+            except OSError:
+                continue
+            for lineage in lineages:
+                path = os.path.join(live_dir, lineage, 'fullchain.pem')
+                try:
+                    # Follows the live symlink, so a renewal (a new file in certbot's archive) shows up as a new inode.
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                self.last_refresh['scanned'] += 1
+                entry = self.entries.get(path)
+                if entry is not None and entry.get('inode') == stat.st_ino and entry.get('size') == stat.st_size \
+                        and entry.get('mtime') == stat.st_mtime_ns:
+                    continue
+                self.entries[path] = self._parse(path, stat)
+                self.last_refresh['parsed'] += 1
+                changed = True
+        for path in list(self.entries.keys()):
+            if path not in seen and os.path.dirname(os.path.dirname(path)) in live_dirs:
+                del self.entries[path]
+                self.last_refresh['removed'] += 1
+                changed = True
+        if changed:
+            self.store.set(INVENTORY_KEY, self.entries, ttl=None)
+        return self
+
+    # Get the record for a fullchain.pem path, or None if it isn't indexed.
+    def get(self, path):
+        entry = self.entries.get(os.path.abspath(path))
+        return CertificateRecord(os.path.abspath(path), entry) if entry is not None else None
+
+    # Get every indexed certificate, earliest expiry first (unparseable certificates come first of all).
+    def by_expiry(self):
+        records = [CertificateRecord(path, entry) for path, entry in self.entries.items()]
+        return sorted(records, key=lambda record: (record.not_after is not None, record.not_after or 0, record.path))
+
+    # Get the certificates which expire within the given number of days, earliest first.
+    def due_within(self, days):
+        cutoff = time.time() + days * 86400
+        return [record for record in self.by_expiry() if record.not_after is None or record.not_after <= cutoff]
+
+    # Get the certificates valid for the given host name, latest expiry first.
+    def covering(self, name):
+        return [record for record in reversed(self.by_expiry()) if record.covers(name)]
+
+
+
+""" Refresh the index and print the certificates that match the query. """
+def main():
+    arguments = sys.argv[1:] or ['list']
+    query = arguments.pop(0)
+    if query not in ('list', 'due', 'covers') or (query != 'list' and not arguments) \
+            or (query == 'due' and not arguments[0].isdigit()):
+        sys.exit("Usage: cert_inventory.py [list | due <days> | covers <name>] [live-dir ...]")
+    parameter = arguments.pop(0) if query != 'list' else None
+
+    started = time.monotonic()
+    inventory = CertificateInventory().refresh(arguments or None)
+    if query == 'due':
+        records = inventory.due_within(int(parameter))
+    elif query == 'covers':
+        records = inventory.covering(parameter)
+    else:
+        records = inventory.by_expiry()
+    for record in records:
+        expiry = record.expiry.strftime('%Y-%m-%d %H:%M') if record.expiry is not None else 'UNREADABLE'
+        print("{:<16} {:<30} {:<10} {:<24} {}".format(expiry, record.lineage, record.key_type, record.issuer,
+            ','.join(record.names)))
+    print("# {} certificates scanned, {} parsed, {} removed in {:.1f}ms".format(inventory.last_refresh['scanned'],
+        inventory.last_refresh['parsed'], inventory.last_refresh['removed'], (time.monotonic() - started) * 1000),
+        file=sys.stderr)
+
+
+
+""" Only run the query if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+#!/bin/python3
+#
+# cert_parser.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" CERT_PARSER.PY - Reads the fields the renewal tooling needs straight out of PEM certificates, without openssl. """
+import base64, datetime, re, ipaddress
+
+
+# Matches each PEM-armored certificate in a file (a fullchain.pem holds the leaf first, then the intermediates).
+PEM_CERTIFICATE_PATTERN = re.compile(rb'-----BEGIN CERTIFICATE-----(.+?)-----END CERTIFICATE-----', flags=re.DOTALL)
+# DER tags used while walking a certificate.
+TAG_SEQUENCE = 0x30
+TAG_UTC_TIME = 0x17
+TAG_GENERALIZED_TIME = 0x18
+TAG_EXPLICIT_VERSION = 0xA0
+TAG_EXPLICIT_EXTENSIONS = 0xA3
+TAG_BOOLEAN = 0x01
+TAG_INTEGER = 0x02
+TAG_OID = 0x06
+TAG_GENERAL_NAME_DNS = 0x82
+TAG_GENERAL_NAME_IP = 0x87
+# Object identifiers of the name attributes, extensions and key algorithms the parser understands.
+OID_COMMON_NAME = '2.5.4.3'
+OID_ORGANIZATION = '2.5.4.10'
+OID_SUBJECT_ALT_NAME = '2.5.29.17'
+OID_RSA_ENCRYPTION = '1.2.840.113549.1.1.1'
+OID_EC_PUBLIC_KEY = '1.2.840.10045.2.1'
+KEY_ALGORITHM_NAMES = {
+    '1.3.101.112': 'Ed25519',
+    '1.3.101.113': 'Ed448',
+}
+EC_CURVE_NAMES = {
+    '1.2.840.10045.3.1.7': 'P256',
+    '1.3.132.0.34': 'P384',
+    '1.3.132.0.35': 'P521',
+}
+
+
+""" DER HELPERS """
+# Read the tag/length header at the given offset. Returns (tag, content_start, content_end).
+def read_tlv(data, offset):
+    tag = data[offset]
+    length = data[offset + 1]
+    offset += 2
+    if length & 0x80:
+        # Long-form length: the low bits say how many following octets hold the length.
+        octets = length & 0x7F
+        length = int.from_bytes(data[offset:offset+octets], 'big')
+        offset += octets
+    if offset + length > len(data):
+        raise ValueError("DER element runs past the end of the data.")
+    return tag, offset, offset + length
+
+# Split the contents of a constructed element into a list of (tag, content_start, content_end) children.
+def read_children(data, start, end):
+    children = []
+    while start < end:
+        tag, content_start, content_end = read_tlv(data, start)
+        children.append((tag, content_start, content_end))
+        start = content_end
+    return children
+
+# Decode a UTCTime or GeneralizedTime into an aware UTC datetime.
+def decode_time(tag, raw):
+    text = raw.decode('ascii').rstrip('Z')
+    if tag == TAG_UTC_TIME:
+        # RFC 5280: two-digit years 50-99 are 19xx, 00-49 are 20xx.
+        year = int(text[:2])
+        text = ('19' if year >= 50 else '20') + text
+    return datetime.datetime.strptime(text[:14], '%Y%m%d%H%M%S').replace(tzinfo=datetime.timezone.utc)
+
+# Decode an OBJECT IDENTIFIER's contents into its dotted form.
+def decode_oid(raw):
+    first = raw[0]
+    arcs = [min(first // 40, 2), first - 40 * min(first // 40, 2)]
+    value = 0
+    for octet in raw[1:]:
+        value = (value << 7) | (octet & 0x7F)
+        if not octet & 0x80:
+            arcs.append(value)
+            value = 0
+    return '.'.join(str(arc) for arc in arcs)
+
+
+
+""" CERTIFICATE HELPERS """
+# Read every certificate from a PEM file, returning a list of DER byte strings.
+def load_pem_certificates(path):
+    with open(path, 'rb') as pem_file:
+        contents = pem_file.read()
+    return [base64.b64decode(b''.join(match.split())) for match in PEM_CERTIFICATE_PATTERN.findall(contents)]
+
+# Get the (tag, start, end) children of a DER certificate's TBSCertificate, with the optional version field skipped.
+def tbs_fields(der):
+    _, cert_start, cert_end = read_tlv(der, 0)
+    _, tbs_start, tbs_end = read_children(der, cert_start, cert_end)[0]
+    fields = read_children(der, tbs_start, tbs_end)
+    if fields and fields[0][0] == TAG_EXPLICIT_VERSION:
+        fields = fields[1:]
+    return fields
+
+# Read a Name (a sequence of sets of attribute/value pairs) into a {oid: value} dict. Repeated attributes keep the first.
+def read_name(der, start, end):
+    attributes = {}
+    for _, set_start, set_end in read_children(der, start, end):
+        for _, pair_start, pair_end in read_children(der, set_start, set_end):
+            (_, oid_start, oid_end), (_, value_start, value_end) = read_children(der, pair_start, pair_end)[:2]
+            attributes.setdefault(decode_oid(der[oid_start:oid_end]), der[value_start:value_end].decode('utf-8', 'replace'))
+    return attributes
+
+# Describe a SubjectPublicKeyInfo's key as e.g. 'RSA-2048', 'EC-P256' or 'Ed25519'.
+def describe_key(der, start, end):
+    (_, algorithm_start, algorithm_end), (_, key_start, key_end) = read_children(der, start, end)
+    algorithm = read_children(der, algorithm_start, algorithm_end)
+    oid = decode_oid(der[algorithm[0][1]:algorithm[0][2]])
+    if oid == OID_RSA_ENCRYPTION:
+        # The BIT STRING (after its unused-bits octet) holds SEQUENCE { modulus, publicExponent }.
+        _, sequence_start, sequence_end = read_tlv(der, key_start + 1)
+        _, modulus_start, modulus_end = read_children(der, sequence_start, sequence_end)[0]
+        return 'RSA-{}'.format(int.from_bytes(der[modulus_start:modulus_end], 'big').bit_length())
+    if oid == OID_EC_PUBLIC_KEY and len(algorithm) > 1 and algorithm[1][0] == TAG_OID:
+        curve = decode_oid(der[algorithm[1][1]:algorithm[1][2]])
+        return 'EC-{}'.format(EC_CURVE_NAMES.get(curve, curve))
+    return KEY_ALGORITHM_NAMES.get(oid, oid)
+
+# Get the DNS names and IP addresses from a certificate's subjectAltName extension, if it has one.
+def read_subject_alt_names(der, fields):
+    extensions = [field for field in fields if field[0] == TAG_EXPLICIT_EXTENSIONS]
+    if not extensions:
+        return []
+    _, sequence_start, sequence_end = read_tlv(der, extensions[0][1])
+    for _, extension_start, extension_end in read_children(der, sequence_start, sequence_end):
+        # Extension: extnID, optional critical flag, then the extnValue OCTET STRING wrapping the DER value.
+        parts = read_children(der, extension_start, extension_end)
+        if decode_oid(der[parts[0][1]:parts[0][2]]) != OID_SUBJECT_ALT_NAME:
+            continue
+        _, names_start, names_end = read_tlv(der, parts[-1][1])
+        names = []
+        for tag, name_start, name_end in read_children(der, names_start, names_end):
+            if tag == TAG_GENERAL_NAME_DNS:
+                names.append(der[name_start:name_end].decode('ascii').lower())
+            elif tag == TAG_GENERAL_NAME_IP:
+                names.append(str(ipaddress.ip_address(der[name_start:name_end])))
+        return names
+    return []
+
+# Parse a DER certificate into a dict of its validity window, names, issuer and key type.
+def parse_certificate(der):
+    # TBSCertificate (after the version): serial, signature, issuer, validity, subject, subjectPublicKeyInfo, ...
+    fields = tbs_fields(der)
+    validity = read_children(der, fields[3][1], fields[3][2])
+    issuer = read_name(der, fields[2][1], fields[2][2])
+    subject = read_name(der, fields[4][1], fields[4][2])
+    names = read_subject_alt_names(der, fields)
+    if not names and OID_COMMON_NAME in subject:
+        names = [subject[OID_COMMON_NAME].lower()]
+    return {
+        'not_before': decode_time(validity[0][0], der[validity[0][1]:validity[0][2]]),
+        'not_after': decode_time(validity[1][0], der[validity[1][1]:validity[1][2]]),
+        'subject': subject.get(OID_COMMON_NAME, ''),
+        'names': names,
+        'issuer': issuer.get(OID_COMMON_NAME) or issuer.get(OID_ORGANIZATION, ''),
+        'key_type': describe_key(der, fields[5][1], fields[5][2]),
+    }
+
+# Get the notAfter time of the first (leaf) certificate in a PEM file, or None if the file can't be read.
+def certificate_expiry(path):
+    try:
+        certificates = load_pem_certificates(path)
+        return parse_certificate(certificates[0])['not_after'] if certificates else None
+    except (OSError, ValueError, IndexError):
+        return None
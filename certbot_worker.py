@@ -29,49 +29,114 @@
 #
 #
 """ CERTBOT_WORKER.PY - Defines a class (and related methods) for interactions with certbot. """
-import datetime, time
-from dns_apis import DNS_API_CLIENT
+import datetime, time, os
+from dns_apis import DNS_API_CLIENT, CERTBOT_PREFIX
+from state_store import StateStore, MISSING
+from dns_propagation import PropagationChecker
+from log_writer import HookLog
+import metrics
 from settings import *
 
 
 # Define a certbot class to hold methods and information about certbot validation attempts.
 class CertbotWorker:
     # Define a constructor that initializes instance fields based on the information provided.
-    def __init__(self, fqdn, validation_code, hook_type=None, auth_type=None, http_token=None):
+    #  remaining_challenges and all_domains come from certbot's CERTBOT_REMAINING_CHALLENGES and CERTBOT_ALL_DOMAINS.
+    #  provider overrides DNS_API_TARGET (renew.py sets it per domain through CERTBOT_HOOK_PROVIDER).
+    def __init__(self, fqdn, validation_code, hook_type=None, auth_type=None, http_token=None,
+            remaining_challenges=None, all_domains=None, provider=None):
         self.is_cleanup = (hook_type == 'cleanup')
         self.hook_type = hook_type
         self.type = auth_type
         self.token = http_token
-        self.api = DNS_API_CLIENT[DNS_API_TARGET](
-            DNS_API_KEYCHAIN[DNS_API_TARGET],
-            fqdn, validation_code, self._write_to_log
-        )
-        self.log_file = open(LOGGING_DIR + ('/certbot-{}.log'.format(self.api.base_domain)), 'a+')
+        self.remaining_challenges = remaining_challenges
+        self.all_domains = all_domains
+        self.provider = provider or DNS_API_TARGET
+        self.domain = fqdn
+        self.validation_code = validation_code
+        # Tokens whose deferred (batched) write failed, so the propagation wait can skip them.
+        self.failed_tokens = set()
+        # The logfile is named after the base domain, which the API client works out (possibly listing the account's
+        #  zones) while it's constructed. Anything logged before the file is open is held until it is.
+        self.log = None
+        self.early_messages = []
+        # HTTP-01 challenges are served by http_responder.py and need no DNS provider at all.
+        if self.type == 'http':
+            self.api = None
+            self.base_domain = fqdn.lower()
+            metrics.set_labels(provider='http-01')
+        else:
+            metrics.set_labels(provider=self.provider)
+            with metrics.span('client_construction'):
+                self.api = DNS_API_CLIENT[self.provider](
+                    DNS_API_KEYCHAIN[self.provider],
+                    fqdn, validation_code, self._write_to_log
+                )
+            self.base_domain = self.api.base_domain
+        # A wildcard and its apex are validated through the same _acme-challenge name.
+        if self.api is not None and self.all_domains:
+            names = set(d.strip().lower() for d in self.all_domains.split(','))
+            base_name = fqdn.lower()[2:] if fqdn.startswith('*.') else fqdn.lower()
+            self.api.shared_record_name = base_name in names and ('*.' + base_name) in names
+        self.log = HookLog(LOGGING_DIR + ('/certbot-{}.log'.format(self.base_domain)),
+            domain=fqdn, hook=hook_type)
+        for timestamp, message in self.early_messages:
+            self.log.write(message, timestamp)
         # Take note of the request and worker object instantiation.
         self._write_to_log("CertbotWorker constructed [%s]: %s (%s): %s, %s, %s" %
-            (hook_type, fqdn, self.api.base_domain, validation_code, auth_type, http_token if http_token is not None else '{no-http-token}'))
-    # A wrapper/helper method to output information to the domain's logfile.
+            (hook_type, fqdn, self.base_domain, validation_code, auth_type, http_token if http_token is not None else '{no-http-token}'))
+    # A wrapper/helper method to output information to the domain's logfile (through the background log writer).
     def _write_to_log(self, message, debug_only=False):
-        if DEBUG is False and debug_only is False:
-            print("{} ::: {}".format(datetime.datetime.now(), message), file=self.log_file)
+        if DEBUG is False and debug_only is False and self.log is None:
+            self.early_messages.append((datetime.datetime.now(), message))
+        elif DEBUG is False and debug_only is False:
+            self.log.write(message)
         elif DEBUG is True:
             print("[DEBUG] {} ::: {}".format(datetime.datetime.now(), message))
+    # Wait for the worker's log records to reach its logfile. Long-lived processes (like the hook daemon) call this
+    #  after each hook; short-lived ones are flushed on exit anyway.
+    def close(self):
+        if self.log is not None:
+            self.log.flush()
     # DNS validation calls (wrapper method for the worker).
     def dns_validation(self):
         # Write the type of validation request (auth/cleanup).
         self._write_to_log("=== New validation request (type: {}) ===".format(self.hook_type))
-        # Create the record, or clean it up.
-        dns_success = self.api.add_or_update_record(set_null=self.is_cleanup)
-        # Sleep/Wait at least 30 seconds for record propagation (when it's an AUTH hook type).
-        if self.is_cleanup == False and dns_success == True:
-            if DEBUG == False:
-                # Set the wait time to 30 seconds if the settings.py configuration is out of range.
-                wait_seconds = DNS_UPDATE_TIMER if DNS_UPDATE_TIMER >= 30 or DNS_UPDATE_TIMER <= 600 else 30
-                print("Waiting {} seconds for the DNS changes to propagate. Please be patient.".format(wait_seconds))
-                time.sleep(wait_seconds)
+        # For a cleanup, pick up whatever the auth hook recorded about the record it created.
+        handoff_store = StateStore(os.path.join(STATE_DIR, 'handoff.json'), default_ttl=HANDOFF_TTL)
+        handoff_key = self._handoff_key()
+        if self.is_cleanup is True:
+            handoff = handoff_store.pop(handoff_key)
+            if handoff is not MISSING and handoff.get('provider') == self.provider:
+                self._write_to_log("Using handoff state from the auth hook: {}".format(handoff))
+                self.api.handoff = handoff
             else:
-                time.sleep(2)
-        elif dns_success == False:
+                self._write_to_log("No handoff state from the auth hook; the record will be looked up.")
+        # An auth hook's value is kept with the pending writes until its handoff state is saved, so that it's never
+        #  missing from every state store while its record exists (sweeper.py deletes the values it finds in none).
+        pending_store = StateStore(os.path.join(STATE_DIR, 'pending-writes.json'), default_ttl=3600)
+        writing_key = 'writing|' + handoff_key
+        if self.is_cleanup is False:
+            pending_store.set(writing_key, [[self.api.domain, self.api.certbot_token]])
+        try:
+            # Create the record, or clean it up.
+            if self.is_cleanup is False and self.api.BATCHED_WRITES is True and self._batch_key() is not None:
+                dns_success = self._batched_write(handoff_store, pending_store)
+            else:
+                dns_success = self.api.add_or_update_record(set_null=self.is_cleanup)
+            # After a successful auth, save exactly what was created so the cleanup hook can go straight to the delete.
+            if self.is_cleanup is False and dns_success is True and self.api.handoff is not None:
+                handoff_store.set(handoff_key, self.api.handoff)
+        finally:
+            if self.is_cleanup is False:
+                pending_store.delete(writing_key)
+        # Wait for record propagation (when it's an AUTH hook type).
+        if self.is_cleanup == False:
+            records = self._propagation_batch(dns_success)
+            if len(records) > 0:
+                with metrics.span('propagation_wait', records=len(records)) as span:
+                    span['propagated'] = self._wait_for_propagation(records)
+        if dns_success == False:
             # If the DNS validation failed in any way, let the user know about it.
             failure_notification = "DNS validation has failed for domain '{}'".format(self.api.domain)
             self._write_to_log(failure_notification)
@@ -81,6 +146,113 @@ class CertbotWorker:
         if dns_success is True:
             print("[SUCCESS] The DNS changes were made for domain '{}'".format(self.api.domain))
         return dns_success
-    # HTTP validation calls (not yet implemented).
-    def http_validation(self):
+    # The handoff state store key for a challenge (this one by default): the (domain, validation token) pair.
+    def _handoff_key(self, fqdn=None, token=None):
+        return "{}|{}".format((fqdn or self.api.domain).lower(), token or self.api.certbot_token)
+    # The key shared by every hook of this certificate (its full, order-independent list of names), or None when
+    #  certbot didn't say how many challenges remain or DNS_COALESCE_WAIT is off.
+    def _batch_key(self):
+        if DNS_COALESCE_WAIT is False or self.remaining_challenges is None or not self.all_domains:
+            return None
+        return ','.join(sorted(set(d.strip().lower() for d in self.all_domains.split(',') if d.strip())))
+    # For providers with batched writes (GoDaddy), defer the write itself: every auth hook but the certificate's last
+    #  one just queues its value, and the last hook writes them all at once, with one request per record name.
+    #  The queued values stay in the pending store until their handoff state has been saved.
+    def _batched_write(self, handoff_store, pending_store):
+        batch_key = self._batch_key()
+        own = (self.api.domain, self.api.certbot_token)
+        if self.remaining_challenges > 0:
+            pending_store.update(batch_key, lambda pending: (pending if pending is not MISSING else []) + [list(own)])
+            self._write_to_log("Queued the record write for the certificate's last challenge.")
+            return True
+        challenges = [tuple(c) for c in pending_store.get(batch_key, default=[])] + [own]
+        self._write_to_log("Last challenge for '{}': writing {} queued value(s).".format(batch_key, len(challenges)))
+        try:
+            results = self.api.write_challenges(challenges)
+            # Save the handoff state of every value written here, not just this hook's own.
+            for (fqdn, token), handoff in self.api.batch_handoffs.items():
+                handoff_store.set(self._handoff_key(fqdn, token), handoff)
+        finally:
+            pending_store.delete(batch_key)
+        self.failed_tokens = set(token for (fqdn, token), success in results.items() if success is not True)
+        for fqdn, token in challenges:
+            if token in self.failed_tokens:
+                self._write_to_log("The queued record write for '{}' has failed.".format(fqdn))
+        return results.get(own) is True
+    # Work out which records this auth hook should wait on, as (zone, record_name, token) tuples.
+    #  Normally that's just this hook's own record. When certbot tells us about the rest of the certificate's challenges
+    #  (and DNS_COALESCE_WAIT is on), every hook but the last one parks its record in a shared batch and returns right
+    #  away; the last hook then waits once for the whole batch.
+    def _propagation_batch(self, dns_success):
+        own = []
+        if dns_success is True:
+            own.append((self.api.base_domain, "{}.{}".format(CERTBOT_PREFIX, self.api.domain), self.api.certbot_token))
+        batch_key = self._batch_key()
+        if batch_key is None:
+            return own
+        batch_store = StateStore(os.path.join(STATE_DIR, 'propagation-batches.json'), default_ttl=3600)
+        if self.remaining_challenges > 0:
+            if len(own) > 0:
+                batch_store.update(batch_key, lambda batch: (batch if batch is not MISSING else []) + [list(r) for r in own])
+            self._write_to_log("Deferring the propagation wait to the last challenge ({} remaining).".format(
+                self.remaining_challenges))
+            print("Deferring the propagation wait to the certificate's last challenge.")
+            return []
+        records = [tuple(r) for r in batch_store.pop(batch_key, default=[]) if r[2] not in self.failed_tokens] + own
+        self._write_to_log("Last challenge for '{}': waiting on {} record(s).".format(batch_key, len(records)))
+        return records
+    # Wait for the new TXT record(s) to propagate. Polls the authoritative nameservers when DNS_PROPAGATION_CHECK is
+    #  enabled, returning as soon as all of them serve the token(s); DNS_UPDATE_TIMER is kept as the upper bound.
+    #  Records are given as (zone, record_name, token) tuples, and each zone is checked in parallel.
+    def _wait_for_propagation(self, records):
+        # Set the wait time to 30 seconds if the settings.py configuration is out of range.
+        wait_seconds = DNS_UPDATE_TIMER if DNS_UPDATE_TIMER >= 30 and DNS_UPDATE_TIMER <= 600 else 30
+        started = time.monotonic()
+        if DNS_PROPAGATION_CHECK is True:
+            print("Waiting up to {} seconds for the authoritative nameservers to serve {} record(s).".format(
+                wait_seconds, len(records)))
+            zones = {}
+            for zone, record_name, token in records:
+                zones.setdefault(zone, []).append((record_name, token))
+            checkers = [PropagationChecker(zone, zone_records, self._write_to_log, nameservers=DNS_PROPAGATION_NAMESERVERS,
+                resolvers=DNS_PROPAGATION_RESOLVERS, port=DNS_PROPAGATION_PORT) for zone, zone_records in zones.items()]
+            # Imported here, as cleanup hooks never wait and concurrent.futures is slow to import.
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=len(checkers)) as pool:
+                results = list(pool.map(lambda checker: checker.wait(wait_seconds, interval=DNS_PROPAGATION_INTERVAL,
+                    backoff=DNS_PROPAGATION_BACKOFF, max_interval=DNS_PROPAGATION_MAX_INTERVAL), checkers))
+            if None not in results:
+                propagated = all(results)
+                self._write_to_log("Propagation check finished after {:.1f}s (propagated: {}).".format(
+                    time.monotonic() - started, propagated))
+                return propagated
+            # The nameservers couldn't be found; fall back to the fixed timer below.
+            self._write_to_log("No authoritative nameservers found; falling back to the fixed propagation timer.")
+        if DEBUG == False:
+            wait_seconds = max(wait_seconds - (time.monotonic() - started), 0)
+            print("Waiting {:.0f} seconds for the DNS changes to propagate. Please be patient.".format(wait_seconds))
+            time.sleep(wait_seconds)
+        else:
+            time.sleep(2)
         return None
+    # HTTP validation calls: hand the token to the HTTP-01 responder (auth), or take it back (cleanup).
+    def http_validation(self):
+        # Imported here so the DNS hooks don't load asyncio.
+        import http_responder
+        self._write_to_log("=== New HTTP-01 validation request (type: {}) ===".format(self.hook_type))
+        try:
+            if self.is_cleanup is True:
+                http_responder.remove_token(self.token)
+            else:
+                http_responder.add_token(self.token, self.validation_code)
+        except (OSError, ValueError) as e:
+            failure_notification = "HTTP validation has failed for domain '{}': {}".format(self.domain, e)
+            self._write_to_log(failure_notification)
+            if isinstance(e, OSError):
+                self._write_to_log("Is the HTTP-01 responder (http_responder.py) running?")
+            print("[FAILURE] " + failure_notification)
+            return False
+        self._write_to_log("HTTP-01 token '{}' {} the responder.".format(self.token,
+            'removed from' if self.is_cleanup is True else 'added to'))
+        print("[SUCCESS] The HTTP-01 responder was updated for domain '{}'".format(self.domain))
+        return True
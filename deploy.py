@@ -0,0 +1,244 @@
+#!/bin/python3
+#
+# deploy.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" DEPLOY.PY - Installs renewed certificates and reloads the services using them, per the DEPLOY_RULES setting.
+
+    Usage: deploy.py [--dry-run] [lineage-dir ...]
+      Deploys the given certbot lineages (e.g. /etc/letsencrypt/live/example.com). Without any, the RENEWED_LINEAGE and
+      RENEWED_DOMAINS variables are used, so this can be certbot's '--deploy-hook' for certificates issued by hand.
+
+    The work of every renewed certificate is collected first and run once: files are installed for each certificate
+     (different certificates in parallel), then each service is reloaded a single time, however many of its
+     certificates were renewed. Services run in parallel, except where DEPLOY_SERVICE_DEPENDENCIES orders them.
+"""
+import os, sys, grp, pwd, stat, shutil, fnmatch, argparse, tempfile, threading, subprocess
+from concurrent.futures import ThreadPoolExecutor
+from cert_parser import load_pem_certificates, parse_certificate
+from settings import *
+
+
+# Service actions, weakest first. A service asked for several actions gets the strongest one.
+SERVICE_ACTIONS = ('reload', 'restart')
+
+
+""" The outcome of one deployment step, for the caller's summary. """
+class DeployResult:
+    def __init__(self, step, success, detail=''):
+        self.step = step
+        self.success = success
+        self.detail = detail
+
+
+""" One entry of DEPLOY_RULES: the certificates it applies to, its files and its services.
+     Rules are dicts with these keys (all but 'domains' optional):
+       'domains':  fnmatch patterns matched against the certificate's names and its lineage name ('*.example.com').
+       'files':    a list of {'source', 'target', 'link', 'owner', 'group', 'mode'}. 'source' is a file of the lineage
+                   (fullchain.pem, privkey.pem, ...). With a 'target', the file is copied there (or symlinked, with
+                   'link': True), replacing any previous file atomically. Ownership and mode are applied to the copy,
+                   or to the certificate file itself when it's linked or has no target.
+       'services': {service: 'reload' | 'restart'}.
+     Targets may use '{lineage}' for the lineage name. """
+class DeployRule:
+    def __init__(self, spec):
+        self.patterns = [pattern.lower() for pattern in spec.get('domains', [])]
+        self.files = spec.get('files', [])
+        self.services = spec.get('services', {})
+        for service, action in self.services.items():
+            if action not in SERVICE_ACTIONS:
+                raise ValueError("Unknown action '{}' for service '{}' in DEPLOY_RULES.".format(action, service))
+    # Whether the rule applies to a certificate with the given names.
+    def matches(self, names):
+        return any(fnmatch.fnmatchcase(name.lower(), pattern) for name in names for pattern in self.patterns)
+
+
+# Set the ownership and mode of a file (following symlinks), as given in a file spec.
+def _apply_permissions(path, spec):
+    if spec.get('owner') is not None or spec.get('group') is not None:
+        uid = pwd.getpwnam(spec['owner']).pw_uid if spec.get('owner') is not None else -1
+        gid = grp.getgrnam(spec['group']).gr_gid if spec.get('group') is not None else -1
+        os.chown(path, uid, gid)
+    if spec.get('mode') is not None:
+        os.chmod(path, spec['mode'])
+
+# Install one file spec of a rule for a lineage. Returns a description of what was done.
+def install_file(lineage_dir, spec):
+    source = os.path.join(lineage_dir, spec['source'])
+    if not os.path.exists(source):
+        raise OSError("'{}' does not exist".format(source))
+    target = spec.get('target')
+    if not target:
+        _apply_permissions(source, spec)
+        return "set permissions on {}".format(source)
+    target = target.format(lineage=os.path.basename(lineage_dir.rstrip('/')))
+    # Build the new file (or link) next to the target, then swap it in, so nothing ever reads a partial file.
+    temp_path = os.path.join(os.path.dirname(target) or '.', ".{}.deploy-{}".format(os.path.basename(target), os.getpid()))
+    try:
+        if spec.get('link') is True:
+            os.symlink(source, temp_path)
+            _apply_permissions(source, spec)
+        else:
+            # Private to root until the copy has the source's mode (or the rule's), since it may be a private key.
+            with open(source, 'rb') as source_file, \
+                    os.fdopen(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as temp_file:
+                shutil.copyfileobj(source_file, temp_file)
+            os.chmod(temp_path, stat.S_IMODE(os.stat(source).st_mode))
+            _apply_permissions(temp_path, spec)
+        os.replace(temp_path, target)
+    except:
+        if os.path.lexists(temp_path):
+            os.unlink(temp_path)
+        raise
+    return "{} {} -> {}".format('linked' if spec.get('link') is True else 'copied', source, target)
+
+# Get the names a lineage's certificate is valid for, or just the lineage name if the certificate can't be read.
+def certificate_names(lineage_dir):
+    try:
+        return parse_certificate(load_pem_certificates(os.path.join(lineage_dir, 'fullchain.pem'))[0])['names']
+    except (OSError, ValueError, IndexError):
+        return [os.path.basename(lineage_dir.rstrip('/'))]
+
+
+""" Collects the deployments of a renewal run and then runs them all at once. """
+class DeployEngine:
+    def __init__(self, rules=None):
+        self.rules = [DeployRule(spec) for spec in (DEPLOY_RULES if rules is None else rules)]
+        # {lineage_dir: [DeployRule]}, in the order certificates were added.
+        self.lineages = {}
+        self.lock = threading.Lock()
+
+    # Queue the deployment of a renewed certificate. The names default to those in its certificate.
+    #  Returns the number of rules which apply to it.
+    def add(self, lineage_dir, names=None):
+        names = list(names or certificate_names(lineage_dir)) + [os.path.basename(lineage_dir.rstrip('/'))]
+        rules = [rule for rule in self.rules if rule.matches(names)]
+        if rules:
+            with self.lock:
+                self.lineages.setdefault(lineage_dir, [])
+                self.lineages[lineage_dir] += [rule for rule in rules if rule not in self.lineages[lineage_dir]]
+        return len(rules)
+
+    # Work out the (debounced) service actions of the given {lineage_dir: rules} (everything queued by default):
+    #  {service: action}, with the strongest action winning.
+    def service_actions(self, lineages=None):
+        actions = {}
+        for rules in (self.lineages if lineages is None else lineages).values():
+            for rule in rules:
+                for service, action in rule.services.items():
+                    if SERVICE_ACTIONS.index(action) >= SERVICE_ACTIONS.index(actions.get(service, action)):
+                        actions[service] = action
+        return actions
+
+    # Group the services into waves: each wave only holds services whose dependencies ran in an earlier wave.
+    #  Dependencies on services with nothing to do are ignored, and so is any dependency cycle (broken at the end).
+    def service_waves(self, actions):
+        remaining, waves = sorted(actions.keys()), []
+        while remaining:
+            wave = [service for service in remaining if not any(dependency in remaining
+                for dependency in DEPLOY_SERVICE_DEPENDENCIES.get(service, []))]
+            waves.append(wave or remaining)
+            remaining = [service for service in remaining if service not in waves[-1]]
+        return waves
+
+    # Install the files of one lineage, rule by rule.
+    def _install(self, lineage_dir, rules, dry_run):
+        results = []
+        for rule in rules:
+            for spec in rule.files:
+                step = "{}: {}".format(os.path.basename(lineage_dir.rstrip('/')), spec.get('source'))
+                if dry_run is True:
+                    results.append(DeployResult(step, True, "would install to {}".format(spec.get('target') or '(in place)')))
+                    continue
+                try:
+                    results.append(DeployResult(step, True, install_file(lineage_dir, spec)))
+                except (OSError, KeyError, ValueError) as e:
+                    results.append(DeployResult(step, False, str(e)))
+        return results
+
+    # Run one service action.
+    def _run_service(self, service, action, dry_run):
+        command = [part.format(service=service) for part in DEPLOY_SERVICE_COMMANDS[action]]
+        step = "{} {}".format(action, service)
+        if dry_run is True:
+            return DeployResult(step, True, "would run: {}".format(' '.join(command)))
+        try:
+            completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+        except OSError as e:
+            return DeployResult(step, False, str(e))
+        return DeployResult(step, completed.returncode == 0, completed.stdout.strip())
+
+    # Run everything queued: first every file install (lineages in parallel), then each service's action once.
+    #  Returns a list of DeployResults, and empties the queue.
+    def run(self, dry_run=False):
+        with self.lock:
+            lineages, self.lineages = self.lineages, {}
+        if not lineages:
+            return []
+        actions = self.service_actions(lineages)
+        results = []
+        with ThreadPoolExecutor(max_workers=min(len(lineages), DEPLOY_CONCURRENCY)) as pool:
+            for lineage_results in pool.map(lambda item: self._install(item[0], item[1], dry_run), lineages.items()):
+                results += lineage_results
+        for wave in self.service_waves(actions):
+            with ThreadPoolExecutor(max_workers=min(len(wave), DEPLOY_CONCURRENCY)) as pool:
+                results += list(pool.map(lambda service: self._run_service(service, actions[service], dry_run), wave))
+        return results
+
+
+# Print deployment results, one line each.
+def print_results(results):
+    for result in results:
+        print("{:<8} {:<40} {}".format('OK' if result.success else 'FAILED', result.step, result.detail))
+
+
+""" Deploy the given lineages (or the one certbot just renewed, as a --deploy-hook). """
+def main():
+    parser = argparse.ArgumentParser(description="Install renewed certificates and reload their services.")
+    parser.add_argument('--dry-run', action='store_true', help="Only print what would be done.")
+    parser.add_argument('lineages', nargs='*', help="Certbot lineage directories (default: $RENEWED_LINEAGE).")
+    args = parser.parse_args()
+    engine = DeployEngine()
+    if args.lineages:
+        for lineage_dir in args.lineages:
+            engine.add(os.path.abspath(lineage_dir))
+    elif os.environ.get('RENEWED_LINEAGE'):
+        engine.add(os.environ['RENEWED_LINEAGE'], os.environ.get('RENEWED_DOMAINS', '').split() or None)
+    else:
+        parser.error("no lineage given, and RENEWED_LINEAGE is not set")
+    results = engine.run(dry_run=args.dry_run)
+    if not results:
+        print("No deploy rules apply.")
+    print_results(results)
+    sys.exit(1 if any(not result.success for result in results) else 0)
+
+
+
+""" Only deploy if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
@@ -29,7 +29,16 @@
 #
 #
 """ DNS_APIS.PY - A 'library' file that defines all API clients used by the CertbotWorker in main.py. """
-import json, requests, re
+import json, re, os, hashlib, time, random, base64, socket, struct, datetime
+# NOTE: 'requests' (and 'email.utils') are imported where they're first needed rather than here. Importing requests
+#  takes most of a hook's start-up time, and the hooks which never make an HTTP request (RFC 2136 updates, HTTP-01
+#  challenges) shouldn't pay for it.
+import dns_wire
+from state_store import StateStore, MISSING
+from rate_limiter import limiter_for
+from zone_resolver import resolver_for
+import metrics
+from settings import *
 
 
 # These extra variables here are not intended to be configured as a "setting".
@@ -40,8 +49,76 @@ OBSCURED_HEADERS = [
     'Authorization', 'X-Auth-Key',
 ]
 
+# HTTP status codes worth retrying: rate limiting and transient server-side failures.
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# Methods which are safe to repeat after a server error. Anything else (POST) is only retried on a 429 or a failed
+#  connection, since a 5xx can arrive after the server already created the record.
+IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE', 'PATCH', 'HEAD')
+
+# HTTP sessions shared by every API client of the same provider within this process. Each one pools keep-alive
+#  connections, so consecutive requests (and, in the hook daemon, consecutive hooks) reuse the provider's TLS sessions.
+_SHARED_SESSIONS = {}
+
+# Get (or create) the shared HTTP session for the given provider name.
+def get_shared_session(provider):
+    if provider not in _SHARED_SESSIONS:
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _SHARED_SESSIONS[provider] = session
+    return _SHARED_SESSIONS[provider]
+
+# The base class of the errors requests raises. Only called from 'except' clauses, which are evaluated once an
+#  exception is on its way: by then, anything that could have raised one has imported requests already.
+def request_error():
+    import requests
+    return requests.RequestException
+
+# Get the number of seconds a response's Retry-After header asks for (either delta-seconds or an HTTP-date), or None.
+def parse_retry_after(response):
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        import email.utils
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+# Split an FQDN into its base domain (the root domain without any subdomain information) and its subdomain (or None).
+#  This guesses that the base domain is the last two labels, which is wrong under multi-label public suffixes (co.uk);
+#  the API clients only fall back to it when their provider's zone list isn't available.
+def split_domain(fqdn):
+    try:
+        base_domain = re.search(r'([^\.]+\.[a-zA-Z0-9]{2,})$', fqdn).groups()[0]
+    except:
+        base_domain = fqdn
+    subdomains = re.match(r'^(([-\w]+\.)+)(?:[a-z0-9\-]+\.[a-z0-9]{2,})$', fqdn, flags=re.IGNORECASE)
+    try:
+        # If there is a subdomain captured, get the first item from the tuple, and cut off the trailing '.' character.
+        subdomain = subdomains.groups()[0][:-1]
+    except:
+        subdomain = None
+    return base_domain, subdomain
+
+# Get the _acme-challenge record name for a subdomain (None at the apex), relative to its zone.
+def relative_challenge_name(subdomain):
+    return CERTBOT_PREFIX if subdomain is None else "{}.{}".format(CERTBOT_PREFIX, subdomain)
+
+
 """ A Base Class for all DNS API implementations. """
 class BaseAPIClient:
+    # The key of the client in the DNS_API_CLIENT mapping (and DNS_API_KEYCHAIN). Set by each subclass.
+    PROVIDER = None
+    # Whether the client implements write_challenges, writing many challenge values in as few requests as possible.
+    BATCHED_WRITES = False
     """ Construct a base class. This method should be called in all child classes via a super() call. """
     # Object instantiation.
     def __init__(self, base_url, base_headers, api_keychain, fqdn, certbot_token, logger):
@@ -51,23 +128,40 @@ class BaseAPIClient:
         self.certbot_token = certbot_token
         self.domain = fqdn
         self.logger = logger
-        try:
-            # Get the base fqdn: the root domain without any subdomain information.
-            self.base_domain = re.search(r'([^\.]+\.[a-zA-Z0-9]{2,})$', fqdn).groups()[0]
-        except:
-            self.base_domain = fqdn
-        subdomains = re.match(r'^(([-\w]+\.)+)(?:[a-z0-9\-]+\.[a-z0-9]{2,})$', fqdn, flags=re.IGNORECASE)
-        try:
-            # If there is a subdomain captured, get the first item from the tuple, and cut off the trailing '.' character.
-            self.subdomain = subdomains.groups()[0][:-1]
-        except:
-            self.subdomain = None
+        # A short, non-reversible identifier for the account behind the keychain, for keying shared on-disk state.
+        self.account_key = hashlib.sha256(json.dumps(api_keychain, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        # The cross-process rate limiter shared by every client of this provider account (None when unlimited).
+        self.rate_limiter = limiter_for(self.PROVIDER, self.account_key)
+        # How many retries the most recent _request call needed.
+        self.last_retry_count = 0
+        # State handed from the auth hook to the cleanup hook (see CertbotWorker). After a successful auth write this is
+        #  a dict describing exactly what was created; for a cleanup, a previously saved dict lets the client skip lookups.
+        self.handoff = None
+        # Whether other challenges of the same certificate use the same record name (a wildcard plus its apex), so an
+        #  auth write has to add its value alongside the existing ones rather than replace them. Set by CertbotWorker.
+        self.shared_record_name = False
+        # The zone list of the account, shared by every client (and, through STATE_DIR, every process) using it.
+        self.zone_resolver = resolver_for(self.PROVIDER, self.account_key)
+
+    # Work out the target's zone (base_domain), subdomain and zone ID. Child classes call this at the end of their
+    #  constructor, once the authentication headers a zone listing needs are in place. A client built without an FQDN
+    #  (for account-wide work, like the sweeper's) has no target.
+    def _resolve_target(self):
+        if self.domain is None:
+            self.base_domain, self.subdomain, self.resolved_zone_id = None, None, None
+            return
+        self.base_domain, self.subdomain, self.resolved_zone_id = self.resolve_zone(self.domain)
+
+    # The provider's shared HTTP session, created (importing requests) the first time the client makes a request.
+    @property
+    def session(self):
+        return get_shared_session(type(self).__name__)
 
     # Check a requests object for things that might be awry, like a bad HTTP status code indicating error.
     def _check_request_response(self, response, api_response_table):
         # Log a message based on the status code.
         self._write_to_log("[REQUEST STATUS (CODE {})] ".format(response.status_code) +
-            api_response_table.get(response.status_code, 0))
+            api_response_table.get(response.status_code, api_response_table[0]))
         # The Requests model for status code interpretation has a __bool__() override for this truthy which
         #  returns a True in a conditional, provided the HTTP status code in the response is between 200 and 400.
         if response:
@@ -77,24 +171,69 @@ class BaseAPIClient:
             # There's trouble afoot. Send back a notification that the status code indicates failure.
            return False
 
+    # Send an HTTP request through the shared session, with connect/read timeouts, rate limiting and retries.
+    #  Retries use exponential backoff with full jitter, but a Retry-After header on a 429 or 5xx response takes
+    #  precedence. No retry is started that would run past HTTP_RETRY_BUDGET seconds from the first attempt; the last
+    #  response is then returned as-is (or the last connection error re-raised).
+    def _request(self, method, url, **kwargs):
+        import requests
+        kwargs.setdefault('headers', self.base_headers)
+        kwargs.setdefault('timeout', (HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT))
+        started = time.monotonic()
+        self.last_retry_count = 0
+        while True:
+            response, error = None, None
+            # Every attempt (retries included) spends a token from the account's shared budget.
+            if self.rate_limiter is not None:
+                waited = self.rate_limiter.acquire()
+                if waited > 0.001:
+                    self._write_to_log("[RATE LIMIT] Waited {:.2f}s for the {} request budget.".format(waited, self.PROVIDER))
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            # Decide whether this outcome is worth another attempt.
+            if error is not None:
+                retryable = method in IDEMPOTENT_METHODS or isinstance(error, requests.ConnectTimeout)
+            else:
+                retryable = response.status_code == 429 or (
+                    response.status_code in RETRYABLE_STATUS_CODES and method in IDEMPOTENT_METHODS)
+            if not retryable or self.last_retry_count >= HTTP_MAX_RETRIES:
+                break
+            delay = parse_retry_after(response)
+            if delay is None:
+                delay = random.uniform(0, min(HTTP_BACKOFF_BASE * (2 ** self.last_retry_count), HTTP_BACKOFF_MAX))
+            if time.monotonic() - started + delay > HTTP_RETRY_BUDGET:
+                self._write_to_log("Not retrying {} {}: a {:.1f}s wait would exceed the retry budget.".format(method, url, delay))
+                break
+            self.last_retry_count += 1
+            self._write_to_log("[RETRY {}/{}] {} {} failed ({}); retrying in {:.1f}s.".format(self.last_retry_count,
+                HTTP_MAX_RETRIES, method, url, error if error is not None else "HTTP {}".format(response.status_code), delay))
+            time.sleep(delay)
+        metrics.note_request(response.status_code if response is not None else None, self.last_retry_count)
+        if error is not None:
+            raise error
+        return response
+
     # Dump the contents of the given response, if DEBUG is True (meaning it's never logged in the file; only STDOUT).
     def _dump_response_data(self, response):
         if response is not None:
             self._write_to_log("[RESPONSE DATA (plain-text)] " + response, debug_only=True)
 
-    # Dump request data to STDOUT for logging and debugging.
+    # Dump request data to STDOUT for logging and debugging, as a single (multi-line) log record.
     def _dump_request_data(self, action, url_path, req_data=None):
-        self._write_to_log("{} at: {}".format(action, url_path))
+        lines = ["{} at: {}".format(action, url_path)]
         # Output the headers (but hide the key).
-        self._write_to_log("HEADERS:")
+        lines.append("HEADERS:")
         for key in self.base_headers.keys():
             if key in OBSCURED_HEADERS:
-                self._write_to_log("-- " + key + ": *****************************")
+                lines.append("-- " + key + ": *****************************")
             else:
-                self._write_to_log("-- " + key + ": " + self.base_headers.get(key))
+                lines.append("-- " + key + ": " + self.base_headers.get(key))
         # If defined, write out the payload information.
         if req_data is not None:
-            self._write_to_log("PAYLOAD:" + req_data)
+            lines.append("PAYLOAD:" + req_data)
+        self._write_to_log("\n".join(lines))
 
 
     """ SIMPLE WRAPPER METHODS """
@@ -110,20 +249,68 @@ class BaseAPIClient:
     def get_base_headers(self):
         return self.base_headers
 
+    # Build the handoff dict describing a record this client just created. Subclasses add their provider-specific IDs.
+    def _build_handoff(self, record_name, **extra):
+        handoff = {
+            'provider': self.PROVIDER,
+            'zone': self.base_domain,
+            'record_name': record_name,
+            'token': self.certbot_token,
+        }
+        handoff.update(extra)
+        return handoff
+
+    # Split an FQDN into (zone, subdomain, zone_id) using the account's zone list, so the zone is the one the provider
+    #  actually holds (e.g. 'example.co.uk' for 'www.example.co.uk'). The zone_id is None if the provider has no IDs.
+    #  If the zones can't be listed, or none of them contains the FQDN, the two-label guess of split_domain is used.
+    def resolve_zone(self, fqdn):
+        try:
+            with metrics.span('zone_lookup'):
+                resolved = self.zone_resolver.resolve(fqdn, self.list_zones)
+        except request_error() as e:
+            self._write_to_log("Could not list the {} account's zones: {}".format(self.PROVIDER, e))
+            resolved = None
+        if resolved is not None:
+            return resolved
+        self._write_to_log("No zone in the {} account contains '{}'; guessing its base domain.".format(self.PROVIDER, fqdn))
+        return split_domain(fqdn) + (None,)
+
     """ OVERRIDDEN METHODS """
+    # List every zone in the account as {zone_name: zone_id}, following pagination to the end. Returns None on failure,
+    #  or if the provider can't list zones (then resolve_zone falls back to guessing).
+    def list_zones(self):
+        return None
+    # Resolve (and cache) whatever zone-level information later record writes will need. Bulk operations call this once
+    #  per zone before fanning out the per-record writes. Returns False if the zone can't be resolved.
+    def prepare_zone(self):
+        return True
     # Update or create a DNS record based on the instance extension of the base API client. Requires override to use.
     def add_or_update_record(self, set_null=False):
         raise NotImplementedError
+    # List every challenge TXT value (on any '_acme-challenge' name) in a zone, following pagination to the end, as
+    #  dicts of 'name' (fully qualified), 'value', 'id' (the provider's record ID, or None) and 'age' (seconds since
+    #  the record last changed, or None if the provider doesn't say). Returns None on failure. Used by sweeper.py.
+    def list_challenge_records(self, zone, zone_id=None):
+        raise NotImplementedError
+    # Delete the given challenge records (from list_challenge_records) in as few requests as the provider allows.
+    #  'listed' is everything list_challenge_records found in the zone, and 'in_flight' (if given) returns the values
+    #  currently in use, which are never deleted. Returns how many records were deleted.
+    def delete_challenge_records(self, zone, zone_id, records, listed, in_flight=None):
+        raise NotImplementedError
 
 
 
 """ Define BaseAPIClient subclasses for specific DNS APIs. """
 # GoDaddy: COMPLETE (deletion methods in progress, however)
 # CloudFlare: COMPLETE
+# RFC 2136 dynamic updates (BIND, Knot, PowerDNS, ...): COMPLETE
 # NetworkSolutions: lol
 
 # Define the GoDaddy API Client class as an extension of the base model.
 class GoDaddyAPIClient(BaseAPIClient):
+    # The key of this client in the DNS_API_CLIENT mapping (and DNS_API_KEYCHAIN).
+    PROVIDER = 'godaddy'
+    BATCHED_WRITES = True
     # GoDaddy base settings, which remain consistent despite changing environments.
     __GODADDY_API_BASE = 'https://api.godaddy.com/'
     __GODADDY_AUTH_HEADERS_BASE = {
@@ -146,40 +333,215 @@ class GoDaddyAPIClient(BaseAPIClient):
         500 : 'Internal server error: GoDaddy could not process the request.',
         504 : 'The gateway timed out.',
     }
+    # How many domains to ask for per page when listing the account's domains.
+    __GODADDY_DOMAINS_PAGE_SIZE = 1000
+    # How many records to ask for per page when listing a domain's records.
+    __GODADDY_RECORDS_PAGE_SIZE = 500
 
     def __init__(self, api_keychain, fqdn, certbot_token, logger):
         # Flesh out the base class.
-        super().__init__(self.__GODADDY_API_BASE, self.__GODADDY_AUTH_HEADERS_BASE,
+        #  The keychain may point the client elsewhere with 'API_BASE' (e.g. at the mock API of the benchmark harness).
+        super().__init__(api_keychain.get('API_BASE', self.__GODADDY_API_BASE), self.__GODADDY_AUTH_HEADERS_BASE,
             api_keychain, fqdn, certbot_token, logger)
         # Define GoDaddy-specific headers based on the given information.
         self.base_headers['Authorization'] = 'sso-key {}:{}'.format(api_keychain.get('API_KEY'), api_keychain.get('API_SECRET'))
+        self._resolve_target()
+
+
+    # OVERRIDE.
+    # List the account's active domains, a page (of up to 1000) at a time. GoDaddy pages with a 'marker': the last
+    #  domain of the previous page.
+    def list_zones(self):
+        zones, marker = {}, None
+        while True:
+            url_path = self.base_url + "v1/domains?statuses=ACTIVE&limit={}".format(self.__GODADDY_DOMAINS_PAGE_SIZE)
+            if marker is not None:
+                url_path += "&marker={}".format(marker)
+            self._dump_request_data("Listing the account's domains", url_path)
+            r = self._request('GET', url_path)
+            if self._check_request_response(r, self.__GODADDY_RESPONSE_TABLE) is not True:
+                return None
+            try:
+                page = json.loads(r.text)
+                for domain in page:
+                    zones[domain['domain'].lower()] = domain.get('domainId')
+            except (ValueError, TypeError, KeyError):
+                return None
+            if len(page) < self.__GODADDY_DOMAINS_PAGE_SIZE:
+                self._write_to_log("Listed {} GoDaddy domain(s).".format(len(zones)))
+                return zones
+            marker = page[-1]['domain']
 
+    # Get the current TXT values of the given record names in a zone, as {name: [values]}.
+    #  A single name is read directly; several names are read from all of the zone's TXT records, a page at a time.
+    #  Returns None if the lookup failed.
+    def _get_txt_values(self, zone, names):
+        values = dict((name, []) for name in names)
+        offset = 0
+        while True:
+            url_path = self.base_url + "v1/domains/{}/records/TXT".format(zone)
+            if len(names) == 1:
+                url_path += "/{}".format(names[0])
+            else:
+                url_path += "?offset={}&limit={}".format(offset, self.__GODADDY_RECORDS_PAGE_SIZE)
+            self._dump_request_data("Reading existing TXT values", url_path)
+            with metrics.span('record_lookup'):
+                r = self._request('GET', url_path)
+            self._dump_response_data(r.text)
+            if r.status_code == 404:
+                return values
+            if self._check_request_response(r, self.__GODADDY_RESPONSE_TABLE) is not True:
+                return None
+            try:
+                page = json.loads(r.text)
+                for record in page:
+                    # Single-name reads may leave out the name; it can only be the one that was asked for.
+                    name = record.get('name', names[0] if len(names) == 1 else None)
+                    if name in values:
+                        values[name].append(record.get('data'))
+            except (ValueError, TypeError, AttributeError):
+                return None
+            if len(names) == 1 or len(page) < self.__GODADDY_RECORDS_PAGE_SIZE:
+                return values
+            offset += len(page)
+
+    # Write (or, with set_null, remove) many challenge values with as few requests as possible: one read per zone and
+    #  one PUT per record name, merging every pending value for a name. 'challenges' is a list of
+    #  (zone, record_name, token) tuples. Returns {(zone, record_name, token): success}.
+    #  GoDaddy replaces every value of a name on PUT, so the existing values are read first and kept; a name left with
+    #  no values gets the 'null' placeholder, since this client doesn't delete GoDaddy records.
+    #  If a zone's values can't be read, nothing is written to it and its challenges all fail.
+    def _write_values(self, challenges, set_null=False):
+        zones = {}
+        for zone, record_name, token in challenges:
+            zones.setdefault(zone, {}).setdefault(record_name, []).append(token)
+        results = {}
+        for zone, names in zones.items():
+            existing = self._get_txt_values(zone, list(names.keys()))
+            if existing is None:
+                # The read failed. A PUT now would wipe out the values it couldn't see (another challenge's token, or
+                #  a concurrent issuance's), so every value in the zone fails instead.
+                self._write_to_log("Could not read the existing TXT values in '{}'; not writing them.".format(zone))
+                for record_name, tokens in names.items():
+                    for token in tokens:
+                        results[(zone, record_name, token)] = False
+                continue
+            for record_name, tokens in names.items():
+                values = [value for value in existing.get(record_name, []) if value != 'null']
+                if set_null is True:
+                    values = [value for value in values if value not in tokens]
+                else:
+                    values += [token for token in tokens if token not in values]
+                url_path = self.base_url + "v1/domains/{}/records/TXT/{}".format(zone, record_name)
+                # Build it.
+                request_data = json.dumps([{'data': value, 'ttl': GODADDY_TXT_TTL} for value in (values or ['null'])])
+                # Log it.
+                self._dump_request_data("Writing DNS record", url_path, request_data)
+                # Request it.
+                with metrics.span('record_delete' if set_null is True else 'record_write', values=len(values)):
+                    r = self._request('PUT', url_path, data=request_data)
+                # Interpret it.
+                success = self._check_request_response(r, self.__GODADDY_RESPONSE_TABLE)
+                for token in tokens:
+                    results[(zone, record_name, token)] = success
+        return results
+
+    # Write (or remove) the challenge values of many (fqdn, token) pairs at once. Returns {(fqdn, token): success},
+    #  and leaves the handoff state of each successfully written pair in self.batch_handoffs.
+    def write_challenges(self, challenges, set_null=False):
+        keyed = {}
+        for fqdn, token in challenges:
+            zone, subdomain = self.resolve_zone(fqdn)[:2]
+            keyed[(zone, relative_challenge_name(subdomain), token)] = (fqdn, token)
+        results = self._write_values(list(keyed.keys()), set_null)
+        self.batch_handoffs = {}
+        for key, success in results.items():
+            if success is True and set_null is False:
+                self.batch_handoffs[keyed[key]] = self._build_handoff(key[1], zone=key[0], token=key[2])
+        return dict((keyed[key], success) for key, success in results.items())
+
+    # OVERRIDE.
+    # List the zone's challenge values, a page of TXT records at a time ('offset' being the records to skip).
+    #  GoDaddy gives no record ages, and names are relative to the zone ('@' at the apex).
+    def list_challenge_records(self, zone, zone_id=None):
+        records, offset = [], 0
+        while True:
+            url_path = self.base_url + "v1/domains/{}/records/TXT?offset={}&limit={}".format(zone, offset,
+                self.__GODADDY_RECORDS_PAGE_SIZE)
+            self._dump_request_data("Listing TXT records", url_path)
+            r = self._request('GET', url_path)
+            if self._check_request_response(r, self.__GODADDY_RESPONSE_TABLE) is not True:
+                return None
+            try:
+                page = json.loads(r.text)
+                for record in page:
+                    name = record['name']
+                    if name == CERTBOT_PREFIX or name.startswith(CERTBOT_PREFIX + '.'):
+                        records.append({'name': "{}.{}".format(name, zone).lower(), 'value': record.get('data'),
+                            'id': None, 'age': None})
+            except (ValueError, TypeError, KeyError):
+                return None
+            if len(page) < self.__GODADDY_RECORDS_PAGE_SIZE:
+                return records
+            offset += len(page)
+
+    # OVERRIDE.
+    # Delete stale challenge values with one request per record name: the name itself is deleted when none of its values
+    #  are kept, and otherwise rewritten with just the kept ones. GoDaddy rewrites a name's values as a whole and gives
+    #  no record ages, so each name is read again right before its rewrite: a name whose values changed since the
+    #  listing (an auth hook has just added one, say) is left alone, and values now in flight are never removed.
+    def delete_challenge_records(self, zone, zone_id, records, listed, in_flight=None):
+        stale = {}
+        for record in records:
+            stale.setdefault(record['name'], set()).add(record['value'])
+        deleted = 0
+        for name, values in stale.items():
+            relative = name[:-len(zone) - 1]
+            current = self._get_txt_values(zone, [relative])
+            if current is None:
+                self._write_to_log("Could not read '{}' again before deleting from it; skipped.".format(name))
+                continue
+            if sorted(current[relative]) != sorted(record['value'] for record in listed if record['name'] == name):
+                self._write_to_log("'{}' has changed since it was listed; skipped.".format(name))
+                continue
+            values = values - (in_flight() if in_flight is not None else set())
+            if not values:
+                continue
+            kept = [value for value in current[relative] if value not in values]
+            url_path = self.base_url + "v1/domains/{}/records/TXT/{}".format(zone, relative)
+            if kept:
+                request_data = json.dumps([{'data': value, 'ttl': GODADDY_TXT_TTL} for value in kept])
+                self._dump_request_data("Rewriting DNS record without its stale values", url_path, request_data)
+                r = self._request('PUT', url_path, data=request_data)
+            else:
+                self._dump_request_data("Deleting DNS record", url_path)
+                r = self._request('DELETE', url_path)
+            if r.status_code == 404 or self._check_request_response(r, self.__GODADDY_RESPONSE_TABLE) is True:
+                deleted += len(values)
+        return deleted
 
     # OVERRIDE.
     # Updates (or creates) a DNS record with a request via the GoDaddy API.
-    #  If the set_null variable is True, then for now this will update the ACME record to 'null' text.
-    #  This is because a method to directly delete GoDaddy DNS records via the API has not yet been implemented in this script.
+    #  Other values already on the name (e.g. the second challenge of a wildcard plus apex certificate) are kept.
+    #  If the set_null variable is True, then only this hook's value is removed. A name left with no values gets 'null'
+    #  text, because a method to directly delete GoDaddy DNS records via the API has not yet been implemented in this script.
+    #  A cleanup with handoff state from the auth hook targets the exact zone and record name that were written.
     def add_or_update_record(self, set_null=False):
-        url_path = self.base_url + "v1/domains/{}/records/TXT/{}".format(self.base_domain, CERTBOT_PREFIX)
-        if self.subdomain is not None:
-            url_path += '.' + self.subdomain
-        # Build it.
-        payload = {
-            'data': self.certbot_token if set_null == False else 'null',
-            'ttl': 3600
-        }
-        request_data = json.dumps([payload])
-        # Log it.
-        self._dump_request_data("Writing DNS record", url_path, request_data)
-        # Request it.
-        r = requests.put(url=url_path, data=request_data, headers=self.base_headers)
-        # Interpret it. Return the value of the request's success.
-        return self._check_request_response(r, self.__GODADDY_RESPONSE_TABLE)
+        if set_null is True and self.handoff is not None:
+            zone, record_name = self.handoff['zone'], self.handoff['record_name']
+        else:
+            zone, record_name = self.base_domain, relative_challenge_name(self.subdomain)
+        success = self._write_values([(zone, record_name, self.certbot_token)], set_null)[(zone, record_name, self.certbot_token)]
+        if success is True and set_null is False:
+            self.handoff = self._build_handoff(record_name)
+        return success
 
 
 
 # Define the CloudFlare API Client class as an extension of the base model.
 class CloudFlareAPIClient(BaseAPIClient):
+    # The key of this client in the DNS_API_CLIENT mapping (and DNS_API_KEYCHAIN).
+    PROVIDER = 'cloudflare'
     # CloudFlare base settings for API Client instantiation.
     __CLOUDFLARE_API_BASE = "https://api.cloudflare.com/client/v4/"
     __CLOUDFLARE_AUTH_HEADERS_BASE = {
@@ -201,25 +563,36 @@ class CloudFlareAPIClient(BaseAPIClient):
         415 : 'The response is not a valid JSON object.',
         429 : 'Too many requests at this time. Please try again later.',
     }
+    # How many zones to ask for per page when listing the account's zones (CloudFlare allows up to 50).
+    __CLOUDFLARE_ZONES_PAGE_SIZE = 50
+    # How many records to ask for per page when listing a zone's records, and to delete per batch request.
+    __CLOUDFLARE_RECORDS_PAGE_SIZE = 100
+    __CLOUDFLARE_DELETE_BATCH_SIZE = 100
     # Define base parameters for CloudFlare that are sent with GET requests.
     __CLOUDFLARE_BASE_REQUEST_PARAMS = "status=active&page=1&per_page=20&order=status&direction=desc&match=all"
 
     # Initialization.
     def __init__(self, api_keychain, fqdn, certbot_token, logger):
         # Flesh out the base class.
-        super().__init__(self.__CLOUDFLARE_API_BASE, self.__CLOUDFLARE_AUTH_HEADERS_BASE,
+        #  The keychain may point the client elsewhere with 'API_BASE' (e.g. at the mock API of the benchmark harness).
+        super().__init__(api_keychain.get('API_BASE', self.__CLOUDFLARE_API_BASE), self.__CLOUDFLARE_AUTH_HEADERS_BASE,
             api_keychain, fqdn, certbot_token, logger)
         # Define CloudFlare-specific authentication headers based on the given information in SETTINGS.PY.
         self.base_headers['X-Auth-Email'] = api_keychain.get('API_EMAIL')
         self.base_headers['X-Auth-Key'] = api_keychain.get('API_KEY')
+        # The on-disk cache of zone and record IDs, shared by every hook process. Entries are keyed by a hash of the
+        #  account credentials (so the key itself is never written to disk) and the zone/record name.
+        self.id_cache = StateStore(os.path.join(STATE_DIR, 'cloudflare-ids.json'), default_ttl=CLOUDFLARE_CACHE_TTL)
+        self._resolve_target()
 
 
-    # Generic method to run a query for CloudFlare-specific items (like zone or record IDs).
-    def _get_object_id(self, message, url):
+    # Generic method to run a query for CloudFlare-specific items (like zone or record IDs), timed as the given phase.
+    def _get_object_id(self, message, url, phase):
         # Log the requested URL.
         self._dump_request_data(message, url)
         # Run the request.
-        r = requests.get(url=url, headers=self.base_headers)
+        with metrics.span(phase):
+            r = self._request('GET', url)
         # Log the response (if DEBUG is enabled).
         self._dump_response_data(r.text)
         # Interpret the response. Return the first object's ID-key value from the response, if defined.
@@ -236,12 +609,15 @@ class CloudFlareAPIClient(BaseAPIClient):
 
 
     # Get the record_id associated with the TXT record for the (sub)domain being targeted (if it's defined).
-    def get_target_record_id(self):
+    #  When content is given, only a record holding exactly that value matches (needed on multi-value names).
+    def get_target_record_id(self, content=None):
         # Build the GET request.
         #  NOTE: Not including the base params. The ZoneID is already defined if this point is reached.
         url_path = self.base_url + 'zones/{}/dns_records?name={}&type=TXT'.format(
             self.zone_id, "{}.{}".format(CERTBOT_PREFIX, self.domain))
-        return self._get_object_id("Requesting record ID for the target (sub)domain", url_path)
+        if content is not None:
+            url_path += '&content={}'.format(content)
+        return self._get_object_id("Requesting record ID for the target (sub)domain", url_path, 'record_lookup')
 
 
     # Get the CloudFlare ZoneID for the target domain.
@@ -249,26 +625,228 @@ class CloudFlareAPIClient(BaseAPIClient):
         # Build the GET request.
         #  NOTE: Not including the base params to the GET request at this time. It was breaking many requests in testing.
         url_path = self.base_url + 'zones?name={}'.format(self.base_domain, "&" + self.__CLOUDFLARE_BASE_REQUEST_PARAMS)
-        return self._get_object_id("Requesting zone data", url_path)
+        return self._get_object_id("Requesting zone data", url_path, 'zone_lookup')
+
+
+    # OVERRIDE.
+    # List the account's zones (with their IDs), following the pages reported in 'result_info'.
+    def list_zones(self):
+        zones, page, total_pages = {}, 1, 1
+        while page <= total_pages:
+            url_path = self.base_url + "zones?page={}&per_page={}".format(page, self.__CLOUDFLARE_ZONES_PAGE_SIZE)
+            self._dump_request_data("Listing the account's zones", url_path)
+            r = self._request('GET', url_path)
+            if self._check_request_response(r, self.__CLOUDFLARE_RESPONSE_TABLE) is not True:
+                return None
+            try:
+                response = json.loads(r.text)
+                for zone in response['result']:
+                    zones[zone['name'].lower()] = zone['id']
+                total_pages = response.get('result_info', {}).get('total_pages', 1)
+            except (ValueError, TypeError, KeyError):
+                return None
+            page += 1
+        self._write_to_log("Listed {} CloudFlare zone(s).".format(len(zones)))
+        return zones
+
+    # OVERRIDE.
+    # List the zone's challenge values, filtered by name on CloudFlare's side, following 'result_info' to the last page.
+    #  Ages come from each record's 'modified_on'.
+    def list_challenge_records(self, zone, zone_id=None):
+        zone_id = zone_id or self.get_zone_id_for(zone)
+        if zone_id is None:
+            return None
+        records, page, total_pages = [], 1, 1
+        while page <= total_pages:
+            url_path = self.base_url + "zones/{}/dns_records?type=TXT&name.startswith={}&page={}&per_page={}".format(
+                zone_id, CERTBOT_PREFIX, page, self.__CLOUDFLARE_RECORDS_PAGE_SIZE)
+            self._dump_request_data("Listing TXT records", url_path)
+            r = self._request('GET', url_path)
+            if self._check_request_response(r, self.__CLOUDFLARE_RESPONSE_TABLE) is not True:
+                return None
+            try:
+                response = json.loads(r.text)
+                for record in response['result']:
+                    if not record['name'].lower().startswith(CERTBOT_PREFIX):
+                        continue
+                    records.append({'name': record['name'].lower(), 'value': record['content'], 'id': record['id'],
+                        'age': self._record_age(record.get('modified_on') or record.get('created_on'))})
+                total_pages = response.get('result_info', {}).get('total_pages', 1)
+            except (ValueError, TypeError, KeyError):
+                return None
+            page += 1
+        return records
+
+    # The age (in seconds) of a CloudFlare timestamp like '2021-06-01T12:00:00.123456Z', or None if there isn't one.
+    def _record_age(self, timestamp):
+        try:
+            changed = datetime.datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+            return max(time.time() - changed.timestamp(), 0.0)
+        except (AttributeError, ValueError):
+            return None
+
+    # Get the zone ID of any zone in the account (not just the target's), or None.
+    def get_zone_id_for(self, zone):
+        return self._get_object_id("Requesting zone data", self.base_url + 'zones?name={}'.format(zone), 'zone_lookup')
+
+    # OVERRIDE.
+    # Delete stale records a batch at a time (CloudFlare's dns_records/batch endpoint). A batch that fails as a whole
+    #  (say, one of its records is already gone) is retried one DELETE per record. Cached record IDs of the swept
+    #  names are dropped. Each record is its own object here, so a value written since the listing is never touched;
+    #  listed values that have since come into flight are left out.
+    def delete_challenge_records(self, zone, zone_id, records, listed, in_flight=None):
+        keep = in_flight() if in_flight is not None else set()
+        records = [record for record in records if record['value'] not in keep]
+        zone_id = zone_id or self.get_zone_id_for(zone)
+        if zone_id is None:
+            return 0
+        deleted = 0
+        for start in range(0, len(records), self.__CLOUDFLARE_DELETE_BATCH_SIZE):
+            batch = records[start:start + self.__CLOUDFLARE_DELETE_BATCH_SIZE]
+            url_path = self.base_url + "zones/{}/dns_records/batch".format(zone_id)
+            request_data = json.dumps({'deletes': [{'id': record['id']} for record in batch]})
+            self._dump_request_data("Deleting {} DNS record(s)".format(len(batch)), url_path, request_data)
+            r = self._request('POST', url_path, data=request_data)
+            if self._check_request_response(r, self.__CLOUDFLARE_RESPONSE_TABLE) is True:
+                deleted += len(batch)
+                continue
+            for record in batch:
+                url_path = self.base_url + "zones/{}/dns_records/{}".format(zone_id, record['id'])
+                self._dump_request_data("Deleting DNS record", url_path)
+                r = self._request('DELETE', url_path)
+                if r.status_code == 404 or self._check_request_response(r, self.__CLOUDFLARE_RESPONSE_TABLE) is True:
+                    deleted += 1
+        self.id_cache.delete(*set("{}/record/{}/{}".format(self.account_key, zone.lower(), record['name'])
+            for record in records))
+        return deleted
+
+    # OVERRIDE.
+    # Look up (and cache on disk) the zone ID, so the per-record writes that follow all get cache hits.
+    def prepare_zone(self):
+        self.zone_id = self._cached_zone_id()
+        return self.zone_id is not None
+
+
+    """ ID CACHE METHODS """
+    # Cache keys for the zone ID of the base domain, and the record ID of the target's _acme-challenge record.
+    def _zone_cache_key(self):
+        return "{}/zone/{}".format(self.account_key, self.base_domain.lower())
+    def _record_cache_key(self):
+        return "{}/record/{}/{}.{}".format(self.account_key, self.base_domain.lower(), CERTBOT_PREFIX, self.domain.lower())
+
+    # Get the zone ID from the account's zone list or the cache, falling back to (and caching the result of) get_zone_id.
+    def _cached_zone_id(self):
+        if self.resolved_zone_id is not None:
+            self._used_cached_ids = True
+            return self.resolved_zone_id
+        zone_id = self.id_cache.get(self._zone_cache_key())
+        if zone_id is not MISSING:
+            self._write_to_log("[CACHE HIT] ZoneID for '{}'.".format(self.base_domain))
+            self._used_cached_ids = True
+            return zone_id
+        self._write_to_log("[CACHE MISS] ZoneID for '{}'.".format(self.base_domain))
+        zone_id = self.get_zone_id()
+        if zone_id is not None:
+            self.id_cache.set(self._zone_cache_key(), zone_id)
+        return zone_id
+
+    # Get the record ID from the cache, falling back to get_target_record_id. A cached None means the record is known
+    #  not to exist (it was deleted by a previous cleanup), which saves the lookup on the next auth hook.
+    def _cached_record_id(self):
+        record_id = self.id_cache.get(self._record_cache_key())
+        if record_id is not MISSING:
+            self._write_to_log("[CACHE HIT] Record ID for '{}.{}': {}".format(CERTBOT_PREFIX, self.domain, record_id))
+            self._used_cached_ids = True
+            return record_id
+        self._write_to_log("[CACHE MISS] Record ID for '{}.{}'.".format(CERTBOT_PREFIX, self.domain))
+        record_id = self.get_target_record_id()
+        self.id_cache.set(self._record_cache_key(), record_id)
+        return record_id
+
+    # Drop the cached IDs for this target (after a write says they're stale).
+    def _invalidate_cached_ids(self):
+        self._write_to_log("[CACHE INVALIDATE] Dropping cached IDs for '{}'.".format(self.domain))
+        self.id_cache.delete(self._zone_cache_key(), self._record_cache_key())
+        # A zone ID from the zone list is stale too. Look the zone up directly from here on.
+        self.resolved_zone_id = None
 
 
     # OVERRIDE.
     # Updates (or creates) a DNS record with the CloudFlare API.
     #  If the set_null variable is True, then the _acme-challenge TXT record for the (sub)domain will be targeted and removed.
+    #  Zone and record IDs come from the on-disk cache when possible. If a write using cached IDs is rejected with a
+    #  400 or 404, the cache entries are dropped and the write is retried once with freshly looked-up IDs.
+    #  A cleanup with handoff state from the auth hook deletes the exact record that was created, with no lookups at all.
     def add_or_update_record(self, set_null=False):
+        if set_null is True and self.handoff is not None:
+            r = self._delete_handed_off_record()
+            if r is not None and r.status_code != 404:
+                success = self._check_request_response(r, self.__CLOUDFLARE_RESPONSE_TABLE)
+                if success is True:
+                    self.id_cache.set(self._record_cache_key(), None)
+                return success
+            # The record isn't where the auth hook left it. Fall back to looking it up.
+            self._write_to_log("Handed-off record was not found; falling back to a record lookup.")
+        r = self._write_record(set_null)
+        if r is not None and r.status_code in (400, 404) and self._used_cached_ids:
+            self._invalidate_cached_ids()
+            r = self._write_record(set_null)
+        if r is None:
+            return False
+        # Interpret it.
+        success = self._check_request_response(r, self.__CLOUDFLARE_RESPONSE_TABLE)
+        if success is True:
+            # Remember the record's new ID after a creation, or that it's gone after a deletion.
+            if set_null is False:
+                try:
+                    self.record_id = json.loads(r.text)['result']['id']
+                except:
+                    self.record_id = None
+                if self.record_id is not None:
+                    self.id_cache.set(self._record_cache_key(), self.record_id)
+                    self.handoff = self._build_handoff("{}.{}".format(CERTBOT_PREFIX, self.domain),
+                        zone_id=self.zone_id, record_id=self.record_id)
+                else:
+                    self.id_cache.delete(self._record_cache_key())
+            else:
+                self.id_cache.set(self._record_cache_key(), None)
+        return success
+
+    # Delete the record described by the handoff state in a single request. Returns the response.
+    def _delete_handed_off_record(self):
+        self.zone_id, self.record_id = self.handoff.get('zone_id'), self.handoff.get('record_id')
+        if self.zone_id is None or self.record_id is None:
+            return None
+        target_url = self.base_url + "zones/{}/dns_records/{}".format(self.zone_id, self.record_id)
+        self._dump_request_data("Deleting handed-off DNS record", target_url)
+        with metrics.span('record_delete'):
+            return self._request('DELETE', target_url)
+
+    # A single attempt at the write (or delete). Returns the response, or None if it couldn't be attempted.
+    def _write_record(self, set_null):
+        # Note whether any ID used in this attempt came from the cache, so a rejection can invalidate it.
+        self._used_cached_ids = False
         # Firstly, get the ZoneID and check that it could be captured.
-        self.zone_id = self.get_zone_id()
+        self.zone_id = self._cached_zone_id()
         if self.zone_id is None:
             # There was a problem retrieving the ZoneID from CloudFlare. Error out.
             self._write_to_log("There was an error retrieving the ZoneID for the target domain.")
-            return False
+            return None
         else:
             # Log the zone_id and continue.
             self._write_to_log("CloudFlare ZoneID for the target: " + self.zone_id)
         # Set the target record's ID within the client object.
         #  This is a requirement to delete the record for the given FQDN.
         #  BUT it's also a requirement to check if there's already one in the way for 'auth' hooks.
-        self.record_id = self.get_target_record_id()
+        #  Deletions look the record up by its value rather than trusting the per-name cache, because a multi-value name
+        #  (e.g. a wildcard plus apex certificate) holds several records and only this hook's token should be removed.
+        #  An existing record is only reused (overwritten) when no other challenge of this certificate needs its value.
+        if set_null is False and self.shared_record_name is True:
+            self.record_id = None
+        elif set_null is False:
+            self.record_id = self._cached_record_id()
+        else:
+            self.record_id = self.get_target_record_id(content=self.certbot_token)
         # Take an add or delete route based on whether or not set_null is set to True.
         if set_null is False:
             ##### RECORD CREATION SECTION #####
@@ -287,27 +865,168 @@ class CloudFlareAPIClient(BaseAPIClient):
             self._dump_request_data("Writing DNS record", target_url, request_data)
             # Request it.
             # If a record ID is already defined for the (sub)domain, set the request type to UPDATE instead of POST.
-            if self.record_id is None:
-                r = requests.post(url=target_url, data=request_data, headers=self.base_headers)
-            else:
-                r = requests.put(url="{}/{}".format(target_url, self.record_id), data=request_data, headers=self.base_headers)
-            # Interpret it.
-            return self._check_request_response(r, self.__CLOUDFLARE_RESPONSE_TABLE)
+            with metrics.span('record_write'):
+                if self.record_id is None:
+                    return self._request('POST', target_url, data=request_data)
+                else:
+                    return self._request('PUT', "{}/{}".format(target_url, self.record_id), data=request_data)
         else:
             ##### RECORD DELETION SECTION #####
             # If the record_id isn't defined for the target domain, there's no way we can safely delete it.
             #  It's better to fail here than to try and find the record ID and deleting a bunch of the wrong records.
             if self.record_id is None:
-                return False
+                return None
             # Set up the request.
             target_url = self.base_url + "zones/{}/dns_records/{}".format(self.zone_id, self.record_id)
             # No need to configure a payload.
             # Log the request though.
             self._dump_request_data("Deleting DNS record", target_url)
             # Request it.
-            r = requests.delete(url=target_url, headers=self.base_headers)
-            # Interpret it.
-            return self._check_request_response(r, self.__CLOUDFLARE_RESPONSE_TABLE)
+            with metrics.span('record_delete'):
+                return self._request('DELETE', target_url)
+
+
+
+# Define the RFC 2136 client class, for zones on self-hosted authoritative nameservers. Records are changed with
+#  TSIG-signed DNS UPDATE messages sent straight to the primary server, rather than through an HTTP API.
+class RFC2136APIClient(BaseAPIClient):
+    # The key of this client in the DNS_API_CLIENT mapping (and DNS_API_KEYCHAIN).
+    PROVIDER = 'rfc2136'
+    BATCHED_WRITES = True
+    # Index a message based on the response code of the UPDATE (None is the fallback for anything else).
+    #  See: https://www.rfc-editor.org/rfc/rfc2136#section-2.2
+    __RFC2136_RESPONSE_TABLE = {
+        None : 'The response code was not understood. Failure is assumed.',
+        0    : 'NOERROR: The update was applied.',
+        1    : 'FORMERR: The server could not interpret the update.',
+        2    : 'SERVFAIL: The server failed to apply the update.',
+        4    : 'NOTIMP: The server does not support dynamic updates.',
+        5    : 'REFUSED: The server refused the update. Check its update policy for the key.',
+        9    : 'NOTAUTH: The server is not authoritative for the zone, or did not accept the TSIG key.',
+        10   : 'NOTZONE: A record of the update is outside of the zone.',
+    }
+    # How long (in seconds) to wait on the nameserver for each message.
+    __RFC2136_TIMEOUT = 5.0
+    # The zones found for FQDNs so far, shared by every client in the process: {(server, port, fqdn): (zone, subdomain)}.
+    __ZONE_CACHE = {}
+
+    # Initialization.
+    def __init__(self, api_keychain, fqdn, certbot_token, logger):
+        self.server = api_keychain.get('SERVER')
+        self.port = int(api_keychain.get('PORT', 53))
+        self.key_name = api_keychain.get('KEY_NAME')
+        self.key_algorithm = api_keychain.get('KEY_ALGORITHM', 'hmac-sha256')
+        self.key_secret = base64.b64decode(api_keychain.get('KEY_SECRET', ''))
+        # There are no URLs or headers here; the base URL only names the server in logs.
+        super().__init__("dns://{}:{}/".format(self.server, self.port), {}, api_keychain, fqdn, certbot_token, logger)
+        self._resolve_target()
+
+
+    # OVERRIDE.
+    # Find the zone of an FQDN by asking the server for its SOA record: the SOA comes back in the answer at a zone apex,
+    #  and in the authority section for any name below one. Falls back to the two-label guess if the server doesn't say.
+    def resolve_zone(self, fqdn):
+        fqdn = fqdn.lower().rstrip('.')
+        cache_key = (self.server, self.port, fqdn)
+        if cache_key in self.__ZONE_CACHE:
+            return self.__ZONE_CACHE[cache_key] + (None,)
+        try:
+            with metrics.span('zone_lookup'):
+                response = dns_wire.query(self.server, fqdn, dns_wire.TYPE_SOA, port=self.port,
+                    timeout=self.__RFC2136_TIMEOUT, recursion_desired=False)
+            for record in response.answers + response.authority:
+                zone = record.name.lower().rstrip('.')
+                if record.rtype == dns_wire.TYPE_SOA and (fqdn == zone or fqdn.endswith('.' + zone)):
+                    self.__ZONE_CACHE[cache_key] = (zone, fqdn[:-len(zone) - 1] or None)
+                    return self.__ZONE_CACHE[cache_key] + (None,)
+        except (OSError, ValueError, struct.error) as e:
+            self._write_to_log("Could not ask {}:{} for the zone of '{}': {}".format(self.server, self.port, fqdn, e))
+        self._write_to_log("The server did not name a zone for '{}'; guessing its base domain.".format(fqdn))
+        return split_domain(fqdn) + (None,)
+
+    # Send one signed UPDATE over an open TCP connection, adding (or, with set_null, removing) the given challenge
+    #  values. 'records' is a list of (record_name, token), with names relative to the zone. Returns True on NOERROR.
+    def _send_update(self, sock, zone, records, set_null):
+        changes = [("{}.{}".format(record_name, zone), dns_wire.TYPE_TXT, RFC2136_TXT_TTL, dns_wire.encode_txt(token))
+            for record_name, token in records]
+        msg_id, packet = dns_wire.build_update(zone, deletions=changes) if set_null is True \
+            else dns_wire.build_update(zone, additions=changes)
+        signed, request_mac = dns_wire.sign_tsig(packet, self.key_name, self.key_algorithm, self.key_secret)
+        self._write_to_log("Sending a DNS UPDATE for zone '{}' to {}:{}, {} {} value(s): {}".format(zone, self.server,
+            self.port, 'removing' if set_null is True else 'adding', len(records), ', '.join(r[0] for r in records)))
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        with metrics.span('record_delete' if set_null is True else 'record_write', values=len(records)) as span:
+            response = dns_wire.send_tcp(signed, self.server, self.port, self.__RFC2136_TIMEOUT, sock=sock)
+            message = dns_wire.parse_message(response)
+            span['status'] = message.rcode
+        if message.id != msg_id:
+            raise ValueError("The response does not belong to the update.")
+        self._write_to_log("[UPDATE STATUS (RCODE {})] ".format(message.rcode) +
+            self.__RFC2136_RESPONSE_TABLE.get(message.rcode, self.__RFC2136_RESPONSE_TABLE[None]))
+        if message.rcode != dns_wire.RCODE_NOERROR:
+            tsig = dns_wire.parse_tsig(message)
+            if tsig is not None and tsig['error'] != 0:
+                self._write_to_log("TSIG error: {}".format(dns_wire.TSIG_ERRORS.get(tsig['error'], tsig['error'])))
+            return False
+        # Only trust a success that's signed by the same key.
+        dns_wire.verify_tsig(response, self.key_name, self.key_algorithm, self.key_secret, request_mac)
+        return True
+
+    # Send one UPDATE per zone, all over a single TCP connection. 'updates' is a list of (zone, records) as taken by
+    #  _send_update. A failed exchange leaves the connection in an unknown state, so the next zone gets a new one.
+    #  Returns a list of booleans, one per update.
+    def _send_updates(self, updates, set_null=False):
+        results = []
+        sock = None
+        try:
+            for zone, records in updates:
+                success = False
+                try:
+                    if sock is None:
+                        sock = socket.create_connection((self.server, self.port), timeout=self.__RFC2136_TIMEOUT)
+                    success = self._send_update(sock, zone, records, set_null)
+                except (OSError, ValueError, struct.error) as e:
+                    self._write_to_log("The DNS UPDATE for zone '{}' has failed: {}".format(zone, e))
+                    if sock is not None:
+                        sock.close()
+                        sock = None
+                results.append(success)
+        finally:
+            if sock is not None:
+                sock.close()
+        return results
+
+    # Write (or remove) the challenge values of many (fqdn, token) pairs at once, with a single UPDATE per zone.
+    #  Returns {(fqdn, token): success}, and leaves the handoff state of each written pair in self.batch_handoffs.
+    def write_challenges(self, challenges, set_null=False):
+        zones = {}
+        for fqdn, token in challenges:
+            zone, subdomain = self.resolve_zone(fqdn)[:2]
+            zones.setdefault(zone, []).append((relative_challenge_name(subdomain), token, fqdn))
+        updates = list(zones.items())
+        results = self._send_updates([(zone, [(name, token) for name, token, fqdn in records])
+            for zone, records in updates], set_null)
+        outcome, self.batch_handoffs = {}, {}
+        for (zone, records), success in zip(updates, results):
+            for record_name, token, fqdn in records:
+                outcome[(fqdn, token)] = success
+                if success is True and set_null is False:
+                    self.batch_handoffs[(fqdn, token)] = self._build_handoff(record_name, zone=zone, token=token)
+        return outcome
+
+    # OVERRIDE.
+    # Adds this hook's challenge value to the record (alongside any others on the name), or with set_null, removes
+    #  just this value. A cleanup with handoff state from the auth hook targets the exact zone and name written.
+    def add_or_update_record(self, set_null=False):
+        if set_null is True and self.handoff is not None:
+            zone, record_name = self.handoff['zone'], self.handoff['record_name']
+        else:
+            zone, record_name = self.base_domain, relative_challenge_name(self.subdomain)
+        success = self._send_updates([(zone, [(record_name, self.certbot_token)])], set_null)[0]
+        if success is True and set_null is False:
+            self.handoff = self._build_handoff(record_name)
+        return success
 
 
 
@@ -315,4 +1034,5 @@ class CloudFlareAPIClient(BaseAPIClient):
 DNS_API_CLIENT = {
     'godaddy': GoDaddyAPIClient,
     'cloudflare' : CloudFlareAPIClient,
+    'rfc2136' : RFC2136APIClient,
 }
@@ -0,0 +1,175 @@
+#!/bin/python3
+#
+# dns_bulk.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" DNS_BULK.PY - An asyncio engine for adding or deleting many _acme-challenge records at once.
+
+    Usage: dns_bulk.py {add|delete} <provider> <file>
+      The file holds one 'fqdn token' pair per line. Exits non-zero if any record failed.
+"""
+import sys, asyncio, datetime, threading
+from concurrent.futures import ThreadPoolExecutor
+from dns_apis import DNS_API_CLIENT
+from log_writer import HookLog
+from settings import *
+
+
+""" The outcome of one record operation in a bulk run. """
+class BulkResult:
+    def __init__(self, fqdn, token, success, handoff=None):
+        self.fqdn = fqdn
+        self.token = token
+        self.success = success
+        self.handoff = handoff
+
+
+""" Runs record operations for many (fqdn, token) pairs concurrently.
+     Zone-level lookups happen once per zone up front (concurrently across zones); the per-record writes and deletes
+     then fan out, with at most 'concurrency' in flight. Each operation is the provider client's own synchronous
+     method run on a worker thread, so the retry, rate-limiting and caching behavior is exactly the hooks'. """
+class AsyncDNSEngine:
+    def __init__(self, provider, keychain=None, concurrency=None, logger=None):
+        self.provider = provider
+        self.keychain = keychain if keychain is not None else DNS_API_KEYCHAIN[provider]
+        self.concurrency = concurrency or DNS_BULK_CONCURRENCY
+        self.logger = logger or self._default_logger
+        self.log_lock = threading.Lock()
+        self.log = HookLog(LOGGING_DIR + '/certbot-bulk.log', provider=provider)
+
+    # Log to STDOUT in DEBUG mode, and otherwise to a bulk-operations logfile in LOGGING_DIR.
+    def _default_logger(self, message, debug_only=False):
+        with self.log_lock:
+            if DEBUG is True:
+                print("[DEBUG] {} ::: {}".format(datetime.datetime.now(), message))
+            elif debug_only is False:
+                self.log.write(message)
+
+    # Build a provider client for one record.
+    def _client(self, fqdn, token):
+        return DNS_API_CLIENT[self.provider](self.keychain, fqdn, token, self.logger)
+
+    # Build the clients of many records on the executor. Constructing a client resolves its zone (a zone listing on a
+    #  cold cache, or an SOA query for rfc2136), so they're built concurrently rather than one by one on the event loop.
+    async def _clients(self, pairs):
+        return await asyncio.gather(*[self._run(self._client, fqdn, token) for fqdn, token in pairs])
+
+    # Run a blocking call on the engine's executor, bounded by the semaphore.
+    async def _run(self, func, *args):
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    # Resolve each distinct zone once. Returns the set of base domains that could not be resolved.
+    async def _prepare_zones(self, clients):
+        representatives = {}
+        for client in clients:
+            representatives.setdefault(client.base_domain.lower(), client)
+        zones = list(representatives.keys())
+        results = await asyncio.gather(*[self._run(representatives[zone].prepare_zone) for zone in zones])
+        failed = set(zone for zone, ok in zip(zones, results) if ok is not True)
+        for zone in failed:
+            self.logger("Could not resolve the zone '{}'; skipping its records.".format(zone))
+        return failed
+
+    # Do one record operation, turning any exception into a failed result.
+    async def _operate(self, client, set_null, failed_zones):
+        if client.base_domain.lower() in failed_zones:
+            return BulkResult(client.domain, client.certbot_token, False)
+        try:
+            success = await self._run(client.add_or_update_record, set_null)
+        except Exception as e:
+            self.logger("Bulk operation failed for '{}': {}".format(client.domain, e))
+            success = False
+        return BulkResult(client.domain, client.certbot_token, success is True, client.handoff)
+
+    # For providers with batched writes: one write_challenges call per zone, with the zones handled concurrently.
+    async def _process_batched(self, pairs, set_null):
+        zones = {}
+        for (fqdn, token), client in zip(pairs, await self._clients(pairs)):
+            zones.setdefault(client.base_domain.lower(), (client, []))[1].append((fqdn, token))
+        async def write_zone(client, zone_pairs):
+            try:
+                results = await self._run(client.write_challenges, zone_pairs, set_null)
+            except Exception as e:
+                self.logger("Bulk operation failed for the zone of '{}': {}".format(zone_pairs[0][0], e))
+                return dict((pair, (False, None)) for pair in zone_pairs)
+            handoffs = getattr(client, 'batch_handoffs', {})
+            return dict((pair, (results.get(pair) is True, handoffs.get(pair))) for pair in zone_pairs)
+        outcomes = {}
+        for zone_outcomes in await asyncio.gather(*[write_zone(client, zone_pairs) for client, zone_pairs in zones.values()]):
+            outcomes.update(zone_outcomes)
+        return [BulkResult(fqdn, token, *outcomes[(fqdn, token)]) for fqdn, token in pairs]
+
+    # Run the add (set_null=False) or delete (set_null=True) for every pair. Results come back in input order.
+    async def _process(self, pairs, set_null, handoffs=None):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as self.executor:
+            if DNS_API_CLIENT[self.provider].BATCHED_WRITES is True:
+                return await self._process_batched(pairs, set_null)
+            clients = await self._clients(pairs)
+            # Deletions can skip their lookups entirely when the add's handoff state is available.
+            if set_null is True and handoffs is not None:
+                for (fqdn, token), client in zip(pairs, clients):
+                    client.handoff = handoffs.get((fqdn, token))
+            failed_zones = await self._prepare_zones(clients)
+            return await asyncio.gather(*[self._operate(client, set_null, failed_zones) for client in clients])
+
+    # Add a TXT record for every (fqdn, token) pair.
+    async def add_records(self, pairs):
+        return await self._process(pairs, False)
+
+    # Delete the TXT record for every (fqdn, token) pair. 'handoffs' optionally maps pairs to the handoff state
+    #  returned by add_records, so each delete is a single request.
+    async def delete_records(self, pairs, handoffs=None):
+        return await self._process(pairs, True, handoffs)
+
+
+# Synchronous conveniences around the engine.
+def bulk_add(provider, pairs, **kwargs):
+    return asyncio.run(AsyncDNSEngine(provider, **kwargs).add_records(pairs))
+def bulk_delete(provider, pairs, handoffs=None, **kwargs):
+    return asyncio.run(AsyncDNSEngine(provider, **kwargs).delete_records(pairs, handoffs))
+
+
+""" Read 'fqdn token' pairs from a file and add or delete them all. """
+def main():
+    if len(sys.argv) != 4 or sys.argv[1] not in ('add', 'delete') or sys.argv[2] not in DNS_API_CLIENT:
+        sys.exit("Usage: dns_bulk.py {add|delete} {%s} <file>" % '|'.join(DNS_API_CLIENT.keys()))
+    with open(sys.argv[3], 'r') as pairs_file:
+        pairs = [tuple(line.split()[:2]) for line in pairs_file if len(line.split()) >= 2 and not line.startswith('#')]
+    operation = bulk_add if sys.argv[1] == 'add' else bulk_delete
+    results = operation(sys.argv[2], pairs)
+    for result in results:
+        print("{:<7} {} {}".format('OK' if result.success else 'FAILED', result.fqdn, result.token))
+    sys.exit(0 if all(result.success for result in results) else 1)
+
+
+
+""" Only run the bulk operation if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+#!/bin/python3
+#
+# dns_propagation.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" DNS_PROPAGATION.PY - Polls a zone's authoritative nameservers until the ACME challenge records are live. """
+import socket, time
+import dns_wire
+
+
+""" Checks every authoritative nameserver of a zone for a set of expected TXT records. """
+class PropagationChecker:
+    # Construct a checker.
+    #  zone: the DNS zone holding the records (used to discover the authoritative nameservers).
+    #  records: a list of (record_name, expected_value) tuples, e.g. ('_acme-challenge.www.example.com', 'token').
+    #  nameservers: an optional list of (host, port) tuples to poll directly, skipping discovery (useful with a stub server).
+    #  resolvers: an optional list of recursive resolvers used for discovery (defaults to /etc/resolv.conf).
+    def __init__(self, zone, records, logger, nameservers=None, resolvers=None, port=53, query_timeout=3.0):
+        self.zone = zone.rstrip('.')
+        self.records = [(name.rstrip('.').lower(), value) for name, value in records]
+        self.logger = logger
+        self.nameservers = list(nameservers) if nameservers else None
+        self.resolvers = list(resolvers) if resolvers else dns_wire.system_resolvers()
+        self.port = port
+        self.query_timeout = query_timeout
+
+    # Wrapper to call back up to the worker's logging method.
+    def _write_to_log(self, message, debug_only=False):
+        self.logger(message, debug_only)
+
+    # Send a query to the recursive resolvers in order, returning the first usable response (or None).
+    def _resolve(self, qname, qtype):
+        for resolver in self.resolvers:
+            try:
+                return dns_wire.query(resolver, qname, qtype, timeout=self.query_timeout)
+            except (OSError, ValueError) as e:
+                self._write_to_log("Resolver {} failed for {}: {}".format(resolver, qname, e), debug_only=True)
+        return None
+
+    # Discover the (address, port) pairs of every authoritative nameserver for the zone.
+    #  Walks up the labels of the zone until an NS RRset is found, then resolves each NS host (preferring glue).
+    def discover_nameservers(self):
+        if self.nameservers is not None:
+            return self.nameservers
+        labels = self.zone.split('.')
+        ns_hosts, glue = [], {}
+        for i in range(len(labels) - 1):
+            candidate = '.'.join(labels[i:])
+            response = self._resolve(candidate, dns_wire.TYPE_NS)
+            if response is None:
+                continue
+            ns_hosts = [rr.value for rr in response.answers if rr.rtype == dns_wire.TYPE_NS]
+            for rr in response.additional:
+                if rr.rtype in (dns_wire.TYPE_A, dns_wire.TYPE_AAAA):
+                    glue.setdefault(rr.name.lower(), []).append(rr.value)
+            if ns_hosts:
+                break
+        addresses = []
+        for host in ns_hosts:
+            host_addresses = glue.get(host.lower())
+            if not host_addresses:
+                response = self._resolve(host, dns_wire.TYPE_A)
+                host_addresses = [rr.value for rr in response.answers if rr.rtype == dns_wire.TYPE_A] if response else []
+            if not host_addresses:
+                # Last resort: ask the operating system.
+                try:
+                    host_addresses = [socket.gethostbyname(host)]
+                except OSError:
+                    self._write_to_log("Could not resolve authoritative nameserver '{}'.".format(host))
+                    continue
+            # One address per nameserver host is enough; each host serves the same zone data.
+            addresses.append((host_addresses[0], self.port))
+        self.nameservers = addresses
+        self._write_to_log("Authoritative nameservers for '{}': {}".format(self.zone,
+            ', '.join("{}:{}".format(*ns) for ns in addresses) or '(none found)'))
+        return addresses
+
+    # Ask a single authoritative nameserver (non-recursively) which TXT values it serves for a record name.
+    def _served_values(self, nameserver, record_name):
+        host, port = nameserver
+        try:
+            response = dns_wire.query(host, record_name, dns_wire.TYPE_TXT, port=port,
+                timeout=self.query_timeout, recursion_desired=False)
+        except (OSError, ValueError) as e:
+            self._write_to_log("Nameserver {}:{} did not answer for {}: {}".format(host, port, record_name, e), debug_only=True)
+            return set()
+        return set(rr.value for rr in response.answers if rr.rtype == dns_wire.TYPE_TXT)
+
+    # Poll until every nameserver serves every expected record, or until the timeout elapses.
+    #  Returns True when fully propagated, False on timeout, and None if no nameservers could be discovered.
+    def wait(self, timeout, interval=2.0, backoff=1.5, max_interval=15.0):
+        deadline = time.monotonic() + timeout
+        nameservers = self.discover_nameservers()
+        if not nameservers:
+            return None
+        pending = set((ns, record) for ns in nameservers for record in self.records)
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=min(len(pending), 32)) as pool:
+            while True:
+                # Query every outstanding (nameserver, record) pair in parallel.
+                checks = list(pending)
+                results = pool.map(lambda check: check[1][1] in self._served_values(check[0], check[1][0]), checks)
+                for check, served in zip(checks, results):
+                    if served:
+                        pending.discard(check)
+                if not pending:
+                    self._write_to_log("All {} nameserver(s) are serving the challenge record(s).".format(len(nameservers)))
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._write_to_log("Timed out waiting on {} nameserver/record pair(s) to propagate.".format(len(pending)))
+                    return False
+                self._write_to_log("Waiting on {} nameserver/record pair(s); polling again in {:.1f}s.".format(
+                    len(pending), min(interval, remaining)), debug_only=True)
+                time.sleep(min(interval, remaining))
+                interval = min(interval * backoff, max_interval)
@@ -0,0 +1,361 @@
+#!/bin/python3
+#
+# dns_wire.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" DNS_WIRE.PY - A minimal DNS wire-format encoder/decoder, so the hooks can talk to nameservers directly. """
+import hmac, random, socket, struct, time
+
+
+# Resource record types and classes used by the hooks. Only the handful actually needed are defined.
+TYPE_A = 1
+TYPE_NS = 2
+TYPE_SOA = 6
+TYPE_TXT = 16
+TYPE_AAAA = 28
+TYPE_TSIG = 250
+TYPE_ANY = 255
+CLASS_IN = 1
+CLASS_NONE = 254
+CLASS_ANY = 255
+# Response codes worth naming.
+RCODE_NOERROR = 0
+RCODE_NXDOMAIN = 3
+# The opcode of an RFC 2136 dynamic update.
+OPCODE_UPDATE = 5
+# The largest UDP payload accepted before retrying a query over TCP.
+UDP_PAYLOAD_SIZE = 4096
+# TSIG (RFC 8945) algorithm names, and the hashlib digests behind them.
+TSIG_ALGORITHMS = {
+    'hmac-md5.sig-alg.reg.int': 'md5',
+    'hmac-sha1': 'sha1',
+    'hmac-sha224': 'sha224',
+    'hmac-sha256': 'sha256',
+    'hmac-sha384': 'sha384',
+    'hmac-sha512': 'sha512',
+}
+# The clock skew (in seconds) allowed between signer and verifier of a TSIG signature.
+TSIG_FUDGE = 300
+# TSIG error codes, as reported in a rejected message's TSIG record.
+TSIG_ERRORS = {16: 'BADSIG', 17: 'BADKEY', 18: 'BADTIME', 22: 'BADTRUNC'}
+
+
+""" A simple container for a single resource record parsed out of a DNS message.
+     The offset is where the record starts in the message (a TSIG signature covers everything before its record). """
+class ResourceRecord:
+    def __init__(self, name, rtype, rclass, ttl, rdata, value=None, offset=None):
+        self.name = name
+        self.rtype = rtype
+        self.rclass = rclass
+        self.ttl = ttl
+        self.rdata = rdata
+        self.value = value
+        self.offset = offset
+    def __repr__(self):
+        return "ResourceRecord({}, {}, {})".format(self.name, self.rtype, self.value)
+
+
+""" A parsed DNS message: the header fields plus each record section. """
+class DNSMessage:
+    def __init__(self, msg_id, flags, questions, answers, authority, additional):
+        self.id = msg_id
+        self.flags = flags
+        self.questions = questions
+        self.answers = answers
+        self.authority = authority
+        self.additional = additional
+    # The response code, from the low four bits of the header flags.
+    @property
+    def rcode(self):
+        return self.flags & 0x000F
+    # Whether the TC (truncated) bit is set and the query should be retried over TCP.
+    @property
+    def truncated(self):
+        return bool(self.flags & 0x0200)
+
+
+
+""" ENCODING HELPERS """
+# Encode a dotted domain name into its uncompressed wire form.
+def encode_name(name):
+    name = name.rstrip('.')
+    encoded = b''
+    if name:
+        for label in name.split('.'):
+            raw = label.encode('idna') if not label.isascii() else label.encode('ascii')
+            if len(raw) > 63:
+                raise ValueError("DNS label '{}' exceeds 63 octets.".format(label))
+            encoded += struct.pack('!B', len(raw)) + raw
+    return encoded + b'\x00'
+
+# Encode a list of strings as TXT rdata (each string becomes one or more <=255-octet character-strings).
+def encode_txt(*values):
+    rdata = b''
+    for value in values:
+        raw = value.encode('utf-8') if isinstance(value, str) else value
+        for i in range(0, max(len(raw), 1), 255):
+            chunk = raw[i:i+255]
+            rdata += struct.pack('!B', len(chunk)) + chunk
+    return rdata
+
+# Encode a full resource record (owner name, type, class, TTL and pre-encoded rdata).
+def encode_record(name, rtype, rclass, ttl, rdata=b''):
+    return encode_name(name) + struct.pack('!HHIH', rtype, rclass, ttl, len(rdata)) + rdata
+
+# Build a standard query packet. Returns the message ID along with the packet so the response can be matched.
+def build_query(qname, qtype, recursion_desired=True):
+    msg_id = random.randint(0, 0xFFFF)
+    flags = 0x0100 if recursion_desired else 0x0000
+    header = struct.pack('!HHHHHH', msg_id, flags, 1, 0, 0, 0)
+    return msg_id, header + encode_name(qname) + struct.pack('!HH', qtype, CLASS_IN)
+
+# Build an RFC 2136 UPDATE message for a zone, without prerequisites. additions and deletions are lists of
+#  (name, rtype, ttl, rdata); a deletion removes only the record with that exact rdata. Returns (msg_id, packet).
+def build_update(zone, additions=(), deletions=()):
+    msg_id = random.randint(0, 0xFFFF)
+    header = struct.pack('!HHHHHH', msg_id, OPCODE_UPDATE << 11, 1, 0, len(additions) + len(deletions), 0)
+    packet = header + encode_name(zone) + struct.pack('!HH', TYPE_SOA, CLASS_IN)
+    for name, rtype, ttl, rdata in additions:
+        packet += encode_record(name, rtype, CLASS_IN, ttl, rdata)
+    for name, rtype, ttl, rdata in deletions:
+        packet += encode_record(name, rtype, CLASS_NONE, 0, rdata)
+    return msg_id, packet
+
+
+
+""" DECODING HELPERS """
+# Decode a (possibly compressed) domain name starting at the given offset. Returns (name, offset_after_name).
+def decode_name(message, offset):
+    labels = []
+    end_offset = None
+    jumps = 0
+    while True:
+        if offset >= len(message):
+            raise ValueError("DNS name runs past the end of the message.")
+        length = message[offset]
+        if length & 0xC0 == 0xC0:
+            # A compression pointer: the rest of the name lives elsewhere in the message.
+            if offset + 1 >= len(message):
+                raise ValueError("DNS name runs past the end of the message.")
+            if end_offset is None:
+                end_offset = offset + 2
+            offset = ((length & 0x3F) << 8) | message[offset + 1]
+            jumps += 1
+            if jumps > 64:
+                raise ValueError("Too many compression pointers in DNS name.")
+            continue
+        offset += 1
+        if length == 0:
+            break
+        labels.append(message[offset:offset+length].decode('ascii', errors='replace'))
+        offset += length
+    return '.'.join(labels), (end_offset if end_offset is not None else offset)
+
+# Decode TXT rdata into a single joined string (multiple character-strings are concatenated, as resolvers do).
+def decode_txt(rdata):
+    parts = []
+    offset = 0
+    while offset < len(rdata):
+        length = rdata[offset]
+        parts.append(rdata[offset+1:offset+1+length].decode('utf-8', errors='replace'))
+        offset += 1 + length
+    return ''.join(parts)
+
+# Parse a raw DNS message into a DNSMessage object. A truncated or malformed message raises a ValueError, whatever part
+#  of it is broken.
+def parse_message(message):
+    try:
+        return _parse_message(message)
+    except (struct.error, IndexError) as e:
+        raise ValueError("Malformed DNS message: {}".format(e))
+
+# The parser behind parse_message, which lets truncated fields raise whatever struct or indexing raises.
+def _parse_message(message):
+    if len(message) < 12:
+        raise ValueError("DNS message is shorter than its header.")
+    msg_id, flags, qdcount, ancount, nscount, arcount = struct.unpack('!HHHHHH', message[:12])
+    offset = 12
+    questions = []
+    for _ in range(qdcount):
+        qname, offset = decode_name(message, offset)
+        qtype, qclass = struct.unpack('!HH', message[offset:offset+4])
+        offset += 4
+        questions.append((qname, qtype, qclass))
+    sections = []
+    for count in (ancount, nscount, arcount):
+        records = []
+        for _ in range(count):
+            record_offset = offset
+            name, offset = decode_name(message, offset)
+            rtype, rclass, ttl, rdlength = struct.unpack('!HHIH', message[offset:offset+10])
+            offset += 10
+            rdata_offset = offset
+            rdata = message[offset:offset+rdlength]
+            offset += rdlength
+            # Interpret the record types the hooks care about; anything else just keeps its raw rdata.
+            if rtype == TYPE_A and rdlength == 4:
+                value = socket.inet_ntop(socket.AF_INET, rdata)
+            elif rtype == TYPE_AAAA and rdlength == 16:
+                value = socket.inet_ntop(socket.AF_INET6, rdata)
+            elif rtype == TYPE_NS:
+                value = decode_name(message, rdata_offset)[0]
+            elif rtype == TYPE_TXT:
+                value = decode_txt(rdata)
+            else:
+                value = None
+            records.append(ResourceRecord(name, rtype, rclass, ttl, rdata, value, record_offset))
+        sections.append(records)
+    return DNSMessage(msg_id, flags, questions, *sections)
+
+
+
+""" TSIG (RFC 8945) """
+# The TSIG variables a MAC covers after the message itself. Names are in canonical (lowercase, uncompressed) form.
+def _tsig_variables(key_name, algorithm, time_signed, fudge, error=0, other=b''):
+    return encode_name(key_name.lower()) + struct.pack('!HI', CLASS_ANY, 0) + encode_name(algorithm.lower()) \
+        + struct.pack('!HIHHH', time_signed >> 32, time_signed & 0xFFFFFFFF, fudge, error, len(other)) + other
+
+# Compute a TSIG MAC.
+def _tsig_mac(secret, algorithm, data):
+    try:
+        digest = TSIG_ALGORITHMS[algorithm.lower().rstrip('.')]
+    except KeyError:
+        raise ValueError("Unsupported TSIG algorithm '{}'.".format(algorithm))
+    return hmac.new(secret, data, digest).digest()
+
+# Sign a message with a TSIG key (the secret as raw bytes), appending the TSIG record. Returns (signed_packet, mac);
+#  the MAC is needed to verify the response.
+def sign_tsig(packet, key_name, algorithm, secret, time_signed=None, fudge=TSIG_FUDGE):
+    time_signed = int(time.time()) if time_signed is None else time_signed
+    mac = _tsig_mac(secret, algorithm, packet + _tsig_variables(key_name, algorithm, time_signed, fudge))
+    rdata = encode_name(algorithm.lower()) + struct.pack('!HIHH', time_signed >> 32, time_signed & 0xFFFFFFFF, fudge,
+        len(mac)) + mac + packet[:2] + struct.pack('!HH', 0, 0)
+    arcount = struct.unpack('!H', packet[10:12])[0]
+    signed = packet[:10] + struct.pack('!H', arcount + 1) + packet[12:] \
+        + encode_record(key_name.lower(), TYPE_TSIG, CLASS_ANY, 0, rdata)
+    return signed, mac
+
+# Get the fields of a message's TSIG record (always the last additional record) as a dict, or None if it's unsigned.
+def parse_tsig(message):
+    if not message.additional or message.additional[-1].rtype != TYPE_TSIG:
+        return None
+    record = message.additional[-1]
+    rdata = record.rdata
+    # The algorithm name is never compressed, so it can be decoded from the rdata alone.
+    algorithm, offset = decode_name(rdata, 0)
+    time_high, time_low, fudge, mac_size = struct.unpack('!HIHH', rdata[offset:offset+10])
+    offset += 10
+    mac = rdata[offset:offset+mac_size]
+    offset += mac_size
+    original_id, error, other_size = struct.unpack('!HHH', rdata[offset:offset+6])
+    return {
+        'key_name': record.name, 'algorithm': algorithm, 'time_signed': (time_high << 32) | time_low, 'fudge': fudge,
+        'mac': mac, 'original_id': original_id, 'error': error, 'other': rdata[offset+6:offset+6+other_size],
+        'offset': record.offset,
+    }
+
+# Verify the TSIG signature of a response to a request signed with request_mac. Returns the parsed message, or raises
+#  ValueError if the response is unsigned, was rejected with a TSIG error, or its signature doesn't match.
+def verify_tsig(response, key_name, algorithm, secret, request_mac):
+    message = parse_message(response)
+    tsig = parse_tsig(message)
+    if tsig is None:
+        raise ValueError("The response is not TSIG-signed.")
+    if tsig['error'] != 0:
+        raise ValueError("The server rejected the TSIG signature ({}).".format(
+            TSIG_ERRORS.get(tsig['error'], tsig['error'])))
+    if tsig['key_name'].lower().rstrip('.') != key_name.lower().rstrip('.'):
+        raise ValueError("The response is signed with another TSIG key ('{}').".format(tsig['key_name']))
+    # The MAC covers the response as it was before its TSIG record was added: with the original ID, and without
+    #  counting the TSIG record.
+    unsigned = struct.pack('!H', tsig['original_id']) + response[2:10] + struct.pack('!H', len(message.additional) - 1) \
+        + response[12:tsig['offset']]
+    expected = _tsig_mac(secret, algorithm, struct.pack('!H', len(request_mac)) + request_mac + unsigned
+        + _tsig_variables(key_name, tsig['algorithm'], tsig['time_signed'], tsig['fudge'], tsig['error'], tsig['other']))
+    if not hmac.compare_digest(tsig['mac'], expected):
+        raise ValueError("The response's TSIG signature does not match.")
+    if abs(time.time() - tsig['time_signed']) > tsig['fudge']:
+        raise ValueError("The response's TSIG signature is outside the allowed clock skew.")
+    return message
+
+
+
+""" TRANSPORT """
+# Send a raw DNS packet over TCP (length-prefixed). An already-connected socket may be given to reuse it.
+def send_tcp(packet, server, port=53, timeout=3.0, sock=None):
+    own_socket = sock is None
+    if own_socket:
+        sock = socket.create_connection((server, port), timeout=timeout)
+    try:
+        sock.settimeout(timeout)
+        sock.sendall(struct.pack('!H', len(packet)) + packet)
+        length = struct.unpack('!H', _recv_exactly(sock, 2))[0]
+        return _recv_exactly(sock, length)
+    finally:
+        if own_socket:
+            sock.close()
+
+# Read exactly 'count' bytes from a stream socket.
+def _recv_exactly(sock, count):
+    data = b''
+    while len(data) < count:
+        chunk = sock.recv(count - len(data))
+        if not chunk:
+            raise ConnectionError("The DNS server closed the TCP connection early.")
+        data += chunk
+    return data
+
+# Send a query to a single server and return the parsed response. Falls back to TCP when the UDP answer is truncated.
+def query(server, qname, qtype, port=53, timeout=3.0, recursion_desired=True):
+    msg_id, packet = build_query(qname, qtype, recursion_desired)
+    family = socket.AF_INET6 if ':' in server else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(packet, (server, port))
+        while True:
+            data, _ = sock.recvfrom(UDP_PAYLOAD_SIZE)
+            response = parse_message(data)
+            # Ignore any stray datagrams that don't belong to this query.
+            if response.id == msg_id:
+                break
+    if response.truncated:
+        response = parse_message(send_tcp(packet, server, port, timeout))
+    return response
+
+# Read the system's recursive resolvers out of /etc/resolv.conf.
+def system_resolvers(resolv_conf='/etc/resolv.conf'):
+    resolvers = []
+    try:
+        with open(resolv_conf, 'r') as conf:
+            for line in conf:
+                fields = line.split()
+                if len(fields) >= 2 and fields[0] == 'nameserver':
+                    resolvers.append(fields[1])
+    except OSError:
+        pass
+    return resolvers or ['127.0.0.1']
@@ -0,0 +1,152 @@
+#!/bin/python3
+#
+# hook_daemon.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" HOOK_DAEMON.PY - An optional long-lived process that runs the hooks on behalf of the thin cb-*.sh clients.
+
+    Protocol (one request per connection, UTF-8 text over a Unix stream socket):
+      The client sends 'KEY=VALUE' lines, terminated by an empty line. HOOK (auth|cleanup) and CERTBOT_DOMAIN,
+      CERTBOT_VALIDATION and (optionally) CERTBOT_TOKEN are expected; any other CERTBOT_* variables are passed along.
+      The daemon replies with everything the hook printed, followed by a final 'EXIT <code>' line.
+"""
+import os, sys, io, signal, socketserver, threading, argparse
+import metrics
+from main import parse_certbot_info, run_hook
+from settings import *
+
+
+""" A stdout stand-in which sends writes to a per-thread buffer while a hook is being handled on that thread. """
+class _ThreadLocalStdout(io.TextIOBase):
+    def __init__(self, fallback):
+        self.fallback = fallback
+        self.local = threading.local()
+    # Start capturing this thread's output into a new buffer.
+    def capture(self):
+        self.local.buffer = io.StringIO()
+        return self.local.buffer
+    # Stop capturing this thread's output.
+    def release(self):
+        self.local.buffer = None
+    def write(self, text):
+        buffer = getattr(self.local, 'buffer', None)
+        return (buffer if buffer is not None else self.fallback).write(text)
+    def flush(self):
+        if getattr(self.local, 'buffer', None) is None:
+            self.fallback.flush()
+
+
+""" Handles a single hook request from a cb-*.sh client. """
+class HookRequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        # Read the request's KEY=VALUE lines up to the terminating blank line.
+        request = {}
+        for raw_line in self.rfile:
+            line = raw_line.decode('utf-8', errors='replace').rstrip('\r\n')
+            if line == '':
+                break
+            key, _, value = line.partition('=')
+            request[key.strip()] = value.strip()
+        output = sys.stdout.capture()
+        exit_code = 0
+        # The daemon is already running, so a hook's timing starts when its request arrives.
+        recorder = metrics.HookRecorder().activate()
+        success = None
+        try:
+            with metrics.span('argument_parsing'):
+                certbot_info = "{} {} {} {}".format(request.get('CERTBOT_DOMAIN', ''),
+                    request.get('CERTBOT_VALIDATION', ''), request.get('HOOK', ''), request.get('CERTBOT_TOKEN', ''))
+                cb_pms = parse_certbot_info(certbot_info)
+            success = run_hook(cb_pms, env=request)
+        except ValueError as e:
+            print(str(e))
+            exit_code = 1
+        except Exception as e:
+            print("The hook daemon failed to run the hook: {}".format(e))
+            exit_code = 1
+        finally:
+            recorder.finish(False if exit_code != 0 else success)
+            sys.stdout.release()
+        try:
+            self.wfile.write(output.getvalue().encode('utf-8'))
+            self.wfile.write("EXIT {}\n".format(exit_code).encode('utf-8'))
+        except OSError:
+            # The client went away; nothing else to do.
+            pass
+
+
+""" The threaded Unix-socket server. Each connection is handled on its own thread. """
+class HookDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        # Clean up a stale socket left over from a previous (crashed) daemon.
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        socket_dir = os.path.dirname(socket_path)
+        if socket_dir:
+            os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        super().__init__(socket_path, HookRequestHandler)
+        # Only the owner (root, normally) may ask the daemon to change DNS records.
+        os.chmod(socket_path, 0o600)
+    def server_close(self):
+        super().server_close()
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+
+# Signal handler that turns SIGTERM into a KeyboardInterrupt for the serving loop.
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+""" Run the daemon in the foreground until it is interrupted. """
+def main():
+    parser = argparse.ArgumentParser(description="Serve certbot auth/cleanup hooks from a long-lived process.")
+    parser.add_argument('--socket', default=os.environ.get('CERTBOT_HOOK_SOCKET', HOOK_DAEMON_SOCKET),
+        help="Path of the Unix socket to listen on (default: %(default)s).")
+    args = parser.parse_args()
+    sys.stdout = _ThreadLocalStdout(sys.stdout)
+    server = HookDaemon(args.socket)
+    # Treat SIGTERM like Ctrl+C so the socket file is removed on a service stop.
+    signal.signal(signal.SIGTERM, _interrupt)
+    print("Certbot hook daemon listening on '{}'.".format(args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+
+""" Only start the daemon if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/bin/python3
+#
+# http_responder.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" HTTP_RESPONDER.PY - Serves HTTP-01 challenge responses from memory, for certbot's HTTP validation.
+
+    Run it where LetsEncrypt reaches the domain on port 80, or behind the existing web server with
+     '/.well-known/acme-challenge/' proxied to it. The auth and cleanup hooks add and remove tokens over a control
+     socket, so nothing is written to a webroot and no web server has to be reloaded.
+
+    Control protocol (UTF-8 lines over a Unix stream socket, any number of them per connection):
+      'ADD <token> <key-authorization>', 'REMOVE <token>' or 'PING', each answered with 'OK' or 'ERROR <reason>'.
+"""
+import os, re, sys, time, signal, socket, asyncio, argparse
+from settings import *
+
+
+# The path prefix LetsEncrypt requests challenge responses from.
+ACME_CHALLENGE_PATH = '/.well-known/acme-challenge/'
+# Tokens and key authorizations are base64url (a key authorization is 'token.thumbprint').
+TOKEN_PATTERN = re.compile(r'[A-Za-z0-9_-]+')
+KEY_AUTHORIZATION_PATTERN = re.compile(r'[A-Za-z0-9_.-]+')
+# Seconds a client may take to send each line of its request before it's disconnected.
+READ_TIMEOUT = 10.0
+# How often (in seconds) expired tokens are swept from the table.
+PRUNE_INTERVAL = 60
+
+
+""" The challenge tokens being served, as {token: (key_authorization, expiry)}. Only touched from the event loop. """
+class TokenTable:
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.tokens = {}
+        self.pruned = time.monotonic()
+
+    # Add (or refresh) a token.
+    def add(self, token, key_authorization):
+        now = time.monotonic()
+        if now - self.pruned > PRUNE_INTERVAL:
+            self.tokens = {t: entry for t, entry in self.tokens.items() if entry[1] > now}
+            self.pruned = now
+        self.tokens[token] = (key_authorization, now + self.ttl)
+
+    # Remove a token. Removing one that isn't there is fine, so cleanup hooks can be repeated.
+    def remove(self, token):
+        self.tokens.pop(token, None)
+
+    # Get the key authorization for a token, or None if it's unknown or expired.
+    def get(self, token):
+        entry = self.tokens.get(token)
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+
+""" The HTTP-01 server and its control socket, both on one asyncio event loop. """
+class HTTPResponder:
+    def __init__(self, address, port, socket_path, token_ttl=None):
+        self.address = address
+        self.port = port
+        self.socket_path = socket_path
+        self.table = TokenTable(token_ttl or HTTP_RESPONDER_TOKEN_TTL)
+        self.servers = []
+
+    # Start listening on the HTTP port and the control socket.
+    async def start(self):
+        self.servers.append(await asyncio.start_server(self._serve_http, self.address or None, self.port))
+        # Clean up a stale socket left over from a previous (crashed) responder.
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        socket_dir = os.path.dirname(self.socket_path)
+        if socket_dir:
+            os.makedirs(socket_dir, mode=0o700, exist_ok=True)
+        self.servers.append(await asyncio.start_unix_server(self._serve_control, self.socket_path))
+        # Only the owner (root, normally) may change what's served.
+        os.chmod(self.socket_path, 0o600)
+
+    # Stop both servers and remove the control socket.
+    async def stop(self):
+        for server in self.servers:
+            server.close()
+            await server.wait_closed()
+        self.servers = []
+        try:
+            os.unlink(self.socket_path)
+        except OSError:
+            pass
+
+    # Work out the response to a request line: (status, body).
+    def _respond(self, parts):
+        if len(parts) != 3 or not parts[2].startswith('HTTP/'):
+            return '400 Bad Request', b''
+        if parts[0] not in ('GET', 'HEAD'):
+            return '405 Method Not Allowed', b''
+        path = parts[1].partition('?')[0]
+        if not path.startswith(ACME_CHALLENGE_PATH):
+            return '404 Not Found', b''
+        token = path[len(ACME_CHALLENGE_PATH):]
+        key_authorization = self.table.get(token) if TOKEN_PATTERN.fullmatch(token) else None
+        if key_authorization is None:
+            return '404 Not Found', b''
+        return '200 OK', key_authorization.encode('ascii')
+
+    # Serve one HTTP connection, with keep-alive. Requests with a body aren't expected, so they close the connection.
+    async def _serve_http(self, reader, writer):
+        try:
+            while True:
+                request_line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await asyncio.wait_for(reader.readline(), READ_TIMEOUT)
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                parts = request_line.decode('latin-1').split()
+                status, body = self._respond(parts)
+                keep_alive = len(parts) == 3 and parts[2] == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close' \
+                    and 'content-length' not in headers and 'transfer-encoding' not in headers
+                head = "HTTP/1.1 {}\r\nContent-Type: text/plain\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+                    status, len(body), 'keep-alive' if keep_alive else 'close')
+                writer.write(head.encode('latin-1') + (body if parts[:1] != ['HEAD'] else b''))
+                await writer.drain()
+                if keep_alive is False:
+                    break
+        except (asyncio.TimeoutError, ConnectionError, ValueError):
+            # Timed out, went away, or sent a line longer than the stream limit.
+            pass
+        finally:
+            writer.close()
+
+    # Carry out one control command, returning the reply line.
+    def _control(self, words):
+        if words == ['PING']:
+            return 'OK'
+        if len(words) == 3 and words[0] == 'ADD':
+            if not TOKEN_PATTERN.fullmatch(words[1]) or not KEY_AUTHORIZATION_PATTERN.fullmatch(words[2]):
+                return 'ERROR malformed token or key authorization'
+            self.table.add(words[1], words[2])
+            return 'OK'
+        if len(words) == 2 and words[0] == 'REMOVE':
+            self.table.remove(words[1])
+            return 'OK'
+        return 'ERROR unknown command'
+
+    # Serve one control connection.
+    async def _serve_control(self, reader, writer):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                reply = self._control(line.decode('utf-8', errors='replace').split())
+                writer.write((reply + '\n').encode('utf-8'))
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+
+""" CLIENT SIDE, USED BY THE HOOKS """
+# Send one command to the responder's control socket. Raises OSError if the responder can't be reached, and ValueError
+#  if it rejects the command.
+def _control_request(command, socket_path=None):
+    socket_path = socket_path or os.environ.get('CERTBOT_HTTP_RESPONDER_SOCKET', HTTP_RESPONDER_SOCKET)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(5)
+        sock.connect(socket_path)
+        sock.sendall((command + '\n').encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as replies:
+            reply = replies.readline().strip()
+    if reply != 'OK':
+        raise ValueError(reply or "no reply from the HTTP-01 responder")
+
+# Start serving a challenge token.
+def add_token(token, key_authorization, socket_path=None):
+    _control_request("ADD {} {}".format(token, key_authorization), socket_path)
+
+# Stop serving a challenge token.
+def remove_token(token, socket_path=None):
+    _control_request("REMOVE {}".format(token), socket_path)
+
+
+# Run the responder until SIGINT or SIGTERM.
+async def _serve(responder):
+    await responder.start()
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+    print("HTTP-01 responder listening on port {} (control socket '{}').".format(responder.port, responder.socket_path))
+    try:
+        await stopping.wait()
+    finally:
+        await responder.stop()
+
+
+""" Run the responder in the foreground until it is stopped. """
+def main():
+    parser = argparse.ArgumentParser(description="Serve HTTP-01 challenge responses for the certbot hooks.")
+    parser.add_argument('--address', default=HTTP_RESPONDER_ADDRESS,
+        help="Address to listen on (default: every address).")
+    parser.add_argument('--port', type=int, default=HTTP_RESPONDER_PORT, help="Port to listen on (default: %(default)s).")
+    parser.add_argument('--socket', default=os.environ.get('CERTBOT_HTTP_RESPONDER_SOCKET', HTTP_RESPONDER_SOCKET),
+        help="Path of the control socket (default: %(default)s).")
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(HTTPResponder(args.address, args.port, args.socket)))
+    except OSError as e:
+        sys.exit("Could not start the HTTP-01 responder: {}".format(e))
+
+
+
+""" Only start the responder if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/bin/python3
+#
+# log_writer.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" LOG_WRITER.PY - Buffered logfile writing for the hooks, from a single background thread.
+
+    Each log record is formatted in full by the caller and queued; the writer thread appends it to its logfile with a
+     single write() on an O_APPEND descriptor, so records from concurrent hooks (threads or processes) never interleave.
+     Logfiles are rotated by size (LOG_MAX_BYTES), keeping LOG_BACKUP_COUNT old copies, gzipped when LOG_COMPRESS is set.
+"""
+import os, sys, json, gzip, fcntl, queue, shutil, atexit, datetime, threading
+from settings import *
+
+
+# The writer closes its logfile descriptors after this many seconds without a record, so idle long-lived processes
+#  (like the hook daemon) don't hold them open.
+IDLE_CLOSE_INTERVAL = 1.0
+# How long (in seconds) a flush waits on the writer before giving up.
+FLUSH_TIMEOUT = 5.0
+
+
+# Format one log record: a 'TIME ::: MESSAGE' line, or a JSON object (with the log's fields) when LOG_FORMAT is 'json'.
+def format_record(timestamp, message, fields=None):
+    if LOG_FORMAT == 'json':
+        record = dict(fields or {}, time=timestamp.isoformat(), pid=os.getpid(), message=message)
+        return json.dumps(record, separators=(',', ':')) + '\n'
+    return "{} ::: {}\n".format(timestamp, message)
+
+
+""" The background thread which owns every logfile descriptor in the process, fed through a queue. """
+class LogWriter:
+    def __init__(self):
+        self.queue = queue.Queue()
+        # Open logfiles, as {path: (descriptor, inode)}.
+        self.handles = {}
+        self.thread = None
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+
+    # Start the writer thread, if it isn't running yet.
+    def _start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+                self.thread.start()
+
+    # Queue a formatted record to be appended to the logfile at path.
+    def submit(self, path, record):
+        self._start()
+        self.queue.put((path, record.encode('utf-8')))
+
+    # Wait until every record queued so far has been written (or FLUSH_TIMEOUT passes).
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        if self.thread is None or not self.thread.is_alive():
+            return
+        written = threading.Event()
+        self.queue.put((None, written))
+        written.wait(timeout)
+
+    # The writer thread's loop.
+    def _run(self):
+        while True:
+            try:
+                path, data = self.queue.get(timeout=IDLE_CLOSE_INTERVAL)
+            except queue.Empty:
+                for path in list(self.handles.keys()):
+                    self._close(path)
+                continue
+            if path is None:
+                data.set()
+                continue
+            try:
+                self._append(path, data)
+            except OSError as e:
+                print("Could not write to the logfile '{}': {}".format(path, e), file=sys.stderr)
+
+    # Open a logfile for appending.
+    def _open(self, path):
+        descriptor = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT | os.O_CLOEXEC, 0o644)
+        self.handles[path] = (descriptor, os.fstat(descriptor).st_ino)
+        return self.handles[path]
+
+    # Close a logfile, if it's open.
+    def _close(self, path):
+        handle = self.handles.pop(path, None)
+        if handle is not None:
+            os.close(handle[0])
+
+    # Append one record. The path is checked against the open descriptor each time, since another process may have
+    #  rotated the logfile in the meantime; that same stat gives the size to decide on rotating it here.
+    def _append(self, path, data):
+        handle = self.handles.get(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        if handle is None or stat is None or stat.st_ino != handle[1]:
+            self._close(path)
+            handle = self._open(path)
+            stat = os.fstat(handle[0])
+        if LOG_MAX_BYTES > 0 and stat.st_size > 0 and stat.st_size + len(data) > LOG_MAX_BYTES:
+            self._rotate(path, handle)
+            self._close(path)
+            handle = self._open(path)
+        os.write(handle[0], data)
+
+    # The name of the n-th old copy of a logfile. The newest copy (.1) is never compressed: a hook in another process
+    #  may still be appending its last records to it, so it's only gzipped once it's shifted to .2.
+    def _backup_name(self, path, n):
+        return "{}.{}{}".format(path, n, '.gz' if LOG_COMPRESS is True and n > 1 else '')
+
+    # Rotate a logfile. The rotation holds a lock on the file being rotated, and the process which loses the race for
+    #  it sees the file already replaced and leaves it alone.
+    def _rotate(self, path, handle):
+        fcntl.flock(handle[0], fcntl.LOCK_EX)
+        try:
+            if os.stat(path).st_ino != handle[1]:
+                return
+            if LOG_BACKUP_COUNT < 1:
+                os.unlink(path)
+                return
+            for n in range(LOG_BACKUP_COUNT - 1, 1, -1):
+                if os.path.exists(self._backup_name(path, n)):
+                    os.replace(self._backup_name(path, n), self._backup_name(path, n + 1))
+            newest = self._backup_name(path, 1)
+            if LOG_BACKUP_COUNT > 1 and os.path.exists(newest):
+                if LOG_COMPRESS is True:
+                    with open(newest, 'rb') as plain, gzip.open(self._backup_name(path, 2), 'wb') as compressed:
+                        shutil.copyfileobj(plain, compressed)
+                    os.unlink(newest)
+                else:
+                    os.replace(newest, self._backup_name(path, 2))
+            os.replace(path, newest)
+        except FileNotFoundError:
+            pass
+        finally:
+            fcntl.flock(handle[0], fcntl.LOCK_UN)
+
+
+# The process's writer.
+_WRITER = LogWriter()
+
+
+""" A logfile written through the background writer. The fields are added to every record in the JSON format. """
+class HookLog:
+    def __init__(self, path, **fields):
+        self.path = path
+        self.fields = fields
+
+    # Queue a record. The timestamp defaults to now; pass one to log a message held back from earlier.
+    def write(self, message, timestamp=None):
+        _WRITER.submit(self.path, format_record(timestamp or datetime.datetime.now(), message, self.fields))
+
+    # Wait until this process's queued records have been written.
+    def flush(self, timeout=FLUSH_TIMEOUT):
+        _WRITER.flush(timeout)
@@ -29,39 +29,76 @@
 #
 #
 """ MAIN.PY - The main file to run directly from the python interpreter with the appropriate parameters. """
-import sys, re
+import sys, re, os, time
+import metrics
 from certbot_worker import CertbotWorker
 
 
-""" Define the main function used to run the auth/cleanup hooks. """
-def main():
-    # Check to ensure the provided command-line parameters include the self-referential ($0) and the Certbot info.
-    if len(sys.argv) != 2:
-        sys.exit("The manual hook didn't receive the appropriate parameters. Aborting.")
+# The expected Certbot parameter format: "F.Q.D.N. acme-token {auth|cleanup} [token]". Only the domain needs a pattern;
+#  the rest is checked once split. (Both letter cases are spelled out: re.IGNORECASE makes compiling, which every
+#  hook process pays for, several times slower.)
+CERTBOT_DOMAIN_PATTERN = re.compile(r'([-\w]+\.)*[a-zA-Z0-9\-]+\.[a-zA-Z0-9]{2,}')
+HOOK_TYPES = ('auth', 'cleanup')
 
-    certbot_info = sys.argv[1].strip()
-    # The expected Certbot parameter should be in this format: "F.Q.D.N. acme-token {auth|cleanup} [token]"
-    if not bool(re.fullmatch(r'\s*(([-\w]+\.)*([a-z0-9\-]+)\.[a-z0-9]{2,})\s+([^\s]+\s+(auth|cleanup))\s*(\s+[^\s]+\s*)?', certbot_info, flags=re.IGNORECASE)):
-        sys.exit("The manual hook didn't receive the appropriate parameters. Aborting.")
 
-    # Split the params on the whitespace characters, and instantiate a CertbotWorker class based on the length of the new array.
+""" Validate and split the Certbot hook parameter string. Raises a ValueError with a user-facing message if it's invalid. """
+def parse_certbot_info(certbot_info):
+    # Split the params on the whitespace characters.
     cb_pms = certbot_info.split()
-    if len(cb_pms) == 0 or len(cb_pms) > 4:
-        sys.exit("Could not parse the certbot worker parameters. Aborting.")
+    if len(cb_pms) not in (3, 4) or cb_pms[2].lower() not in HOOK_TYPES or not CERTBOT_DOMAIN_PATTERN.fullmatch(cb_pms[0]):
+        raise ValueError("The manual hook didn't receive the appropriate parameters. Aborting.")
+    return cb_pms
+
+
+""" Build a CertbotWorker from the parsed parameters and run its validation. Shared by main() and the hook daemon.
+    The other CERTBOT_* variables are read from env (the process environment, unless the daemon passes them along). """
+def run_hook(cb_pms, env=None):
+    env = os.environ if env is None else env
+    try:
+        remaining_challenges = int(env['CERTBOT_REMAINING_CHALLENGES'])
+    except (KeyError, ValueError):
+        remaining_challenges = None
+    metrics.set_labels(hook=cb_pms[2], domain=cb_pms[0].lower())
+    # Instantiate a CertbotWorker class based on the length of the parameter array.
     try:
-        cb_obj = CertbotWorker(cb_pms[0], cb_pms[1], hook_type=cb_pms[2], 
-            auth_type='dns' if len(cb_pms) == 3 else 'http', http_token=None if len(cb_pms) == 3 else cb_pms[3])
+        cb_obj = CertbotWorker(cb_pms[0], cb_pms[1], hook_type=cb_pms[2],
+            auth_type='dns' if len(cb_pms) == 3 else 'http', http_token=None if len(cb_pms) == 3 else cb_pms[3],
+            remaining_challenges=remaining_challenges, all_domains=env.get('CERTBOT_ALL_DOMAINS'),
+            provider=env.get('CERTBOT_HOOK_PROVIDER'))
     except:
         import logging, traceback
         logging.error(traceback.format_exc())
-        sys.exit("Could not construct the certbot worker: the given paramters are NOT valid!")
+        raise ValueError("Could not construct the certbot worker: the given paramters are NOT valid!")
 
     # Perform the validation.
-    print("Using python '%s' certbot hook for domain '%s'..." % (cb_pms[2], cb_obj.api.base_domain))
-    if cb_obj.type == 'dns':
-        worker_result = cb_obj.dns_validation()
-    else:
-        cb_obj.http_validation()
+    try:
+        print("Using python '%s' certbot hook for domain '%s'..." % (cb_pms[2], cb_obj.base_domain))
+        if cb_obj.type == 'dns':
+            return cb_obj.dns_validation()
+        else:
+            return cb_obj.http_validation()
+    finally:
+        cb_obj.close()
+
+
+""" Define the main function used to run the auth/cleanup hooks. """
+def main():
+    # Check to ensure the provided command-line parameters include the self-referential ($0) and the Certbot info.
+    if len(sys.argv) != 2:
+        sys.exit("The manual hook didn't receive the appropriate parameters. Aborting.")
+    # Time the run from the moment the interpreter started, so start-up and imports show up as the 'process_start' span.
+    recorder = metrics.HookRecorder(started=metrics.process_start_time()).activate()
+    recorder.record('process_start', recorder.started, time.time())
+    success = None
+    try:
+        with metrics.span('argument_parsing'):
+            cb_pms = parse_certbot_info(sys.argv[1])
+        success = run_hook(cb_pms)
+    except ValueError as e:
+        success = False
+        sys.exit(str(e))
+    finally:
+        recorder.finish(success)
 
 
 
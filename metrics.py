@@ -0,0 +1,208 @@
+#!/bin/python3
+#
+# metrics.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" METRICS.PY - Per-phase timing of hook runs, written as JSON-lines events and Prometheus textfile histograms.
+
+    The hook's entry point (main.py, or the hook daemon) starts a HookRecorder for the run; code anywhere below it
+     times its phases with 'with metrics.span(...)', which does nothing when no recorder is active on the thread.
+"""
+import os, sys, json, time, tempfile, threading
+from contextlib import contextmanager
+from state_store import StateStore, MISSING
+from settings import *
+
+
+# The recorder of the hook running on each thread (the hook daemon runs several hooks at once, one per thread).
+_ACTIVE = threading.local()
+
+
+""" Collects the timing spans of one hook run, then writes them out when the run finishes. """
+class HookRecorder:
+    def __init__(self, started=None):
+        self.started = started if started is not None else time.time()
+        self.labels = {'hook': '', 'domain': '', 'provider': ''}
+        self.spans = []
+        self.open_spans = []
+        self.success = None
+
+    # Make this the recorder of the current thread.
+    def activate(self):
+        _ACTIVE.recorder = self
+        return self
+
+    # Record a finished span. Times are unix timestamps; attributes (provider, status, retries, ...) ride along.
+    def record(self, name, start, end, **attributes):
+        span = {'name': name, 'start': round(start - self.started, 6), 'duration': round(max(end - start, 0.0), 6)}
+        span.update(attributes)
+        self.spans.append(span)
+
+    # Close the run: add the 'total' span, write the event and histograms, and deactivate. Never raises, since metrics
+    #  must not be what fails a hook.
+    def finish(self, success=None):
+        if getattr(_ACTIVE, 'recorder', None) is self:
+            _ACTIVE.recorder = None
+        if success is not None:
+            self.success = success
+        if METRICS_ENABLED is not True:
+            return
+        # Metrics must never affect a hook, so nothing that goes wrong here is raised (finish runs in main()'s finally).
+        try:
+            self.record('total', self.started, time.time())
+            self._write_event()
+            self._update_histograms()
+        except Exception as e:
+            print("Could not write the hook metrics: {!r}".format(e), file=sys.stderr)
+
+    # Append the run to the JSON-lines event log, as a single write so concurrent hooks' lines never interleave.
+    def _write_event(self):
+        if not METRICS_EVENT_LOG:
+            return
+        event = dict(self.labels, time=round(self.started, 3), pid=os.getpid(), success=self.success, spans=self.spans)
+        with open(METRICS_EVENT_LOG, 'a') as event_log:
+            event_log.write(json.dumps(event, separators=(',', ':')) + '\n')
+
+    # Add this run's spans to the histograms shared by every run, then rewrite the Prometheus textfile from them.
+    #  Each histogram keeps the bucket bounds it was counted with; any counted with other bounds than METRICS_BUCKETS
+    #  (the setting has changed since) start over, since their counts no longer fit the buckets.
+    def _update_histograms(self):
+        if not METRICS_TEXTFILE:
+            return
+        store = StateStore(os.path.join(STATE_DIR, 'metrics-histograms.json'))
+        def add_run(state):
+            state = state if state is not MISSING else {'histograms': {}, 'runs': {}}
+            bounds = list(METRICS_BUCKETS)
+            for key, histogram in list(state['histograms'].items()):
+                if histogram.get('bounds') != bounds:
+                    del state['histograms'][key]
+            for span in self.spans:
+                key = '|'.join((span['name'], self.labels['provider'], self.labels['hook']))
+                histogram = state['histograms'].setdefault(key,
+                    {'bounds': bounds, 'buckets': [0] * len(bounds), 'sum': 0.0, 'count': 0})
+                for index, bound in enumerate(histogram['bounds']):
+                    if span['duration'] <= bound:
+                        histogram['buckets'][index] += 1
+                histogram['sum'] += span['duration']
+                histogram['count'] += 1
+            outcome = 'unknown' if self.success is None else ('success' if self.success else 'failure')
+            key = '|'.join((self.labels['provider'], self.labels['hook'], outcome))
+            state['runs'][key] = state['runs'].get(key, 0) + 1
+            # Written while the store is still locked, so the textfile always reflects the latest state.
+            write_textfile(state)
+            return state
+        store.update('state', add_run, ttl=None)
+
+
+# Format a label set for the Prometheus exposition format.
+def _format_labels(**labels):
+    return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in sorted(labels.items())) + '}'
+
+# Atomically rewrite METRICS_TEXTFILE from the aggregated histogram state, for node_exporter's textfile collector.
+def write_textfile(state):
+    lines = [
+        '# HELP certbot_hook_phase_duration_seconds Time spent in each phase of a certbot hook run.',
+        '# TYPE certbot_hook_phase_duration_seconds histogram',
+    ]
+    for key, histogram in sorted(state['histograms'].items()):
+        phase, provider, hook = key.split('|')
+        for bound, count in zip(histogram['bounds'], histogram['buckets']):
+            lines.append('certbot_hook_phase_duration_seconds_bucket{} {}'.format(
+                _format_labels(phase=phase, provider=provider, hook=hook, le=bound), count))
+        lines.append('certbot_hook_phase_duration_seconds_bucket{} {}'.format(
+            _format_labels(phase=phase, provider=provider, hook=hook, le='+Inf'), histogram['count']))
+        lines.append('certbot_hook_phase_duration_seconds_sum{} {}'.format(
+            _format_labels(phase=phase, provider=provider, hook=hook), round(histogram['sum'], 6)))
+        lines.append('certbot_hook_phase_duration_seconds_count{} {}'.format(
+            _format_labels(phase=phase, provider=provider, hook=hook), histogram['count']))
+    lines.append('# HELP certbot_hook_runs_total Hook runs, by outcome.')
+    lines.append('# TYPE certbot_hook_runs_total counter')
+    for key, count in sorted(state['runs'].items()):
+        provider, hook, outcome = key.split('|')
+        lines.append('certbot_hook_runs_total{} {}'.format(_format_labels(provider=provider, hook=hook, outcome=outcome), count))
+    directory = os.path.dirname(METRICS_TEXTFILE) or '.'
+    fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as temp_file:
+            temp_file.write('\n'.join(lines) + '\n')
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, METRICS_TEXTFILE)
+    except:
+        os.unlink(temp_path)
+        raise
+
+
+""" HELPERS USED BY THE INSTRUMENTED CODE """
+# Get the recorder of the hook running on this thread, or None.
+def current():
+    return getattr(_ACTIVE, 'recorder', None)
+
+# Set labels (hook, domain, provider) on the current hook run.
+def set_labels(**labels):
+    recorder = current()
+    if recorder is not None:
+        recorder.labels.update(labels)
+
+# Time the enclosed block as a span of the current hook run. Yields the span's attribute dict, so the block can add to
+#  it; requests made inside the block add their HTTP status and retry count automatically (see note_request).
+@contextmanager
+def span(name, **attributes):
+    recorder = current()
+    if recorder is None:
+        yield attributes
+        return
+    recorder.open_spans.append(attributes)
+    start = time.time()
+    try:
+        yield attributes
+    finally:
+        recorder.open_spans.pop()
+        recorder.record(name, start, time.time(), **attributes)
+
+# Note an HTTP request on the innermost open span: its (last) status code, and the retries it needed.
+def note_request(status, retries):
+    recorder = current()
+    if recorder is None or not recorder.open_spans:
+        return
+    attributes = recorder.open_spans[-1]
+    attributes['status'] = status
+    attributes['requests'] = attributes.get('requests', 0) + 1
+    attributes['retries'] = attributes.get('retries', 0) + retries
+
+# Get the unix time this process was started, from /proc (so interpreter start-up and imports count), or None.
+def process_start_time():
+    try:
+        with open('/proc/self/stat', 'r') as stat_file:
+            # The command name (field 2) may contain spaces, so count fields from the closing parenthesis.
+            start_ticks = int(stat_file.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
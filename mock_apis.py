@@ -0,0 +1,342 @@
+#!/bin/python3
+#
+# mock_apis.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" MOCK_APIS.PY - Local stand-ins for the GoDaddy v1 and CloudFlare v4 endpoints used by dns_apis.py, plus an
+     authoritative DNS responder serving the TXT records written through them. Used by benchmark.py.
+
+    Usage: mock_apis.py [--zones N] [--latency SECONDS] [--rate-429 P] [--rate-5xx P]
+      Serves until interrupted, and prints the keychain 'API_BASE' entries and the DNS port to use.
+"""
+import json, time, random, socket, struct, datetime, threading, argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import dns_wire
+
+
+""" The shared record state behind both mock APIs and the DNS responder, with the fault-injection knobs. """
+class MockDNSState:
+    def __init__(self, zones, latency=0.0, rate_429=0.0, rate_5xx=0.0, retry_after=0, propagation_delay=0.0, seed=None):
+        self.zones = sorted(zone.lower() for zone in zones)
+        self.zone_ids = dict((zone, 'zone{:06d}'.format(index)) for index, zone in enumerate(self.zones))
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.retry_after = retry_after
+        self.propagation_delay = propagation_delay
+        self.random = random.Random(seed)
+        # CloudFlare-style records: {record_id: {'name', 'content', 'zone', 'written'}}. GoDaddy writes land here too.
+        self.records = {}
+        self.next_id = 1
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    # Count a request under the given label ('godaddy GET records', ...).
+    def count(self, label):
+        with self.lock:
+            self.counts[label] = self.counts.get(label, 0) + 1
+
+    # Get and reset the request counts.
+    def take_counts(self):
+        with self.lock:
+            counts, self.counts = self.counts, {}
+        return counts
+
+    # Pick an injected failure for a request: None, or an (HTTP status, headers) pair.
+    def injected_failure(self):
+        with self.lock:
+            roll = self.random.random()
+        if roll < self.rate_429:
+            return 429, {'Retry-After': str(self.retry_after)}
+        if roll < self.rate_429 + self.rate_5xx:
+            return 503, {}
+        return None
+
+    # Add a TXT value, returning its record ID.
+    def add_record(self, zone, name, content):
+        with self.lock:
+            record_id = 'rec{:08d}'.format(self.next_id)
+            self.next_id += 1
+            self.records[record_id] = {'zone': zone, 'name': name.lower(), 'content': content, 'written': time.time()}
+            return record_id
+
+    # Get [(record_id, record)] for a fully-qualified name (and, optionally, one value).
+    def find_records(self, name, content=None):
+        with self.lock:
+            return [(record_id, dict(record)) for record_id, record in self.records.items()
+                if record['name'] == name.lower() and (content is None or record['content'] == content)]
+
+    # Get every record in a zone.
+    def zone_records(self, zone):
+        with self.lock:
+            return [dict(record) for record in self.records.values() if record['zone'] == zone]
+
+    # Replace every value of a fully-qualified name (GoDaddy's PUT semantics).
+    def replace_records(self, zone, name, values):
+        with self.lock:
+            for record_id in [rid for rid, record in self.records.items() if record['name'] == name.lower()]:
+                del self.records[record_id]
+        for value in values:
+            self.add_record(zone, name, value)
+
+    # The TXT values the authoritative nameservers serve for a name: only those older than the propagation delay.
+    def served_values(self, name):
+        cutoff = time.time() - self.propagation_delay
+        return [record['content'] for _, record in self.find_records(name) if record['written'] <= cutoff]
+
+
+""" Answers GoDaddy v1 and CloudFlare v4 API requests from a MockDNSState. The provider is told apart by path. """
+class MockAPIHandler(BaseHTTPRequestHandler):
+    # Keep-alive, so the clients' connection pooling behaves as it would against the real APIs.
+    protocol_version = 'HTTP/1.1'
+
+    # Quiet the default per-request logging.
+    def log_message(self, format, *args):
+        pass
+
+    # Send a JSON (or empty) response.
+    def _reply(self, status, body=None, headers=None):
+        payload = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Route every method through one place: latency, fault injection and counting, then the provider handler.
+    def _handle(self):
+        state = self.server.state
+        url = urlsplit(self.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length).decode('utf-8')) if length else None
+        provider = 'cloudflare' if url.path.startswith('/client/v4/') else 'godaddy'
+        if state.latency > 0:
+            time.sleep(state.latency)
+        failure = state.injected_failure()
+        if failure is not None:
+            state.count('{} injected {}'.format(provider, failure[0]))
+            return self._reply(failure[0], {'message': 'injected failure'}, failure[1])
+        query = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+        if provider == 'cloudflare':
+            return self._cloudflare(state, url.path[len('/client/v4/'):].strip('/').split('/'), query, body)
+        return self._godaddy(state, url.path.strip('/').split('/'), query, body)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _handle
+
+    # GoDaddy: v1/domains (listing, paged by 'marker'), and v1/domains/{zone}/records/TXT[/{name}] (GET, paged by
+    #  'offset', PUT and DELETE).
+    def _godaddy(self, state, parts, query, body):
+        if parts == ['v1', 'domains']:
+            state.count('godaddy GET domains')
+            limit = int(query.get('limit', 1000))
+            marker = query.get('marker')
+            zones = [zone for zone in state.zones if marker is None or zone > marker][:limit]
+            return self._reply(200, [{'domain': zone, 'domainId': index, 'status': 'ACTIVE'} for index, zone in enumerate(zones)])
+        if len(parts) < 5 or parts[:2] != ['v1', 'domains'] or parts[3:5] != ['records', 'TXT']:
+            return self._reply(404, {'code': 'NOT_FOUND'})
+        zone = parts[2].lower()
+        if zone not in state.zone_ids:
+            return self._reply(404, {'code': 'UNKNOWN_DOMAIN'})
+        # Relative names map to absolute ones with the zone appended ('@' is the apex).
+        absolute = lambda name: zone if name == '@' else "{}.{}".format(name.lower(), zone)
+        relative = lambda name: '@' if name == zone else name[:-len(zone) - 1]
+        if self.command == 'GET':
+            state.count('godaddy GET records')
+            if len(parts) > 5:
+                records = [record for _, record in state.find_records(absolute(parts[5]))]
+            else:
+                records = state.zone_records(zone)
+                offset = int(query.get('offset', 0))
+                records = records[offset:offset + int(query['limit'])] if 'limit' in query else records[offset:]
+            return self._reply(200, [{'data': record['content'], 'name': relative(record['name']), 'ttl': 600, 'type': 'TXT'}
+                for record in records])
+        if self.command == 'PUT' and len(parts) > 5:
+            state.count('godaddy PUT records')
+            state.replace_records(zone, absolute(parts[5]), [entry['data'] for entry in body or []])
+            return self._reply(200)
+        if self.command == 'DELETE' and len(parts) > 5:
+            state.count('godaddy DELETE records')
+            if not state.find_records(absolute(parts[5])):
+                return self._reply(404, {'code': 'NOT_FOUND'})
+            state.replace_records(zone, absolute(parts[5]), [])
+            return self._reply(204)
+        return self._reply(405, {'code': 'METHOD_NOT_ALLOWED'})
+
+    # CloudFlare: zones (listing and ?name=), zones/{id}/dns_records[/{record_id}] (GET, by name or paged by
+    #  'name.startswith', POST, PUT and DELETE), and zones/{id}/dns_records/batch (deletes only).
+    def _cloudflare(self, state, parts, query, body):
+        zone_names = dict((zone_id, zone) for zone, zone_id in state.zone_ids.items())
+        if parts == ['zones']:
+            if 'name' in query:
+                state.count('cloudflare GET zones?name')
+                zone = query['name'].lower()
+                result = [{'id': state.zone_ids[zone], 'name': zone}] if zone in state.zone_ids else []
+                return self._reply(200, {'success': True, 'result': result})
+            state.count('cloudflare GET zones')
+            page, per_page = int(query.get('page', 1)), min(int(query.get('per_page', 20)), 50)
+            zones = state.zones[(page - 1) * per_page:page * per_page]
+            total_pages = max((len(state.zones) + per_page - 1) // per_page, 1)
+            return self._reply(200, {'success': True, 'result': [{'id': state.zone_ids[zone], 'name': zone} for zone in zones],
+                'result_info': {'page': page, 'per_page': per_page, 'total_pages': total_pages, 'total_count': len(state.zones)}})
+        if len(parts) < 3 or parts[0] != 'zones' or parts[2] != 'dns_records' or parts[1] not in zone_names:
+            return self._reply(404, {'success': False, 'errors': [{'code': 7003, 'message': 'Could not route'}]})
+        zone = zone_names[parts[1]]
+        record_json = lambda record_id, record: {'id': record_id, 'type': 'TXT', 'name': record['name'], 'content': record['content'],
+            'modified_on': datetime.datetime.fromtimestamp(record['written'], datetime.timezone.utc).isoformat().replace('+00:00', 'Z')}
+        if self.command == 'GET' and len(parts) == 3 and 'name.startswith' in query:
+            state.count('cloudflare GET dns_records?name.startswith')
+            with state.lock:
+                records = sorted((rid, dict(record)) for rid, record in state.records.items()
+                    if record['zone'] == zone and record['name'].startswith(query['name.startswith'].lower()))
+            page, per_page = int(query.get('page', 1)), min(int(query.get('per_page', 100)), 5000)
+            total_pages = max((len(records) + per_page - 1) // per_page, 1)
+            return self._reply(200, {'success': True,
+                'result': [record_json(rid, record) for rid, record in records[(page - 1) * per_page:page * per_page]],
+                'result_info': {'page': page, 'per_page': per_page, 'total_pages': total_pages, 'total_count': len(records)}})
+        if self.command == 'GET' and len(parts) == 3:
+            state.count('cloudflare GET dns_records')
+            records = state.find_records(query.get('name', ''), query.get('content'))
+            return self._reply(200, {'success': True, 'result': [record_json(rid, record) for rid, record in records]})
+        if self.command == 'POST' and parts[3:] == ['batch']:
+            state.count('cloudflare POST dns_records/batch')
+            record_ids = [entry['id'] for entry in (body or {}).get('deletes', [])]
+            with state.lock:
+                # The batch is all or nothing, like CloudFlare's own.
+                if any(record_id not in state.records for record_id in record_ids):
+                    return self._reply(404, {'success': False, 'errors': [{'code': 81044, 'message': 'Record does not exist.'}]})
+                for record_id in record_ids:
+                    del state.records[record_id]
+            return self._reply(200, {'success': True, 'result': {'deletes': [{'id': rid} for rid in record_ids]}})
+        if self.command == 'POST' and len(parts) == 3:
+            state.count('cloudflare POST dns_records')
+            record_id = state.add_record(zone, body['name'], body['content'])
+            return self._reply(200, {'success': True, 'result': {'id': record_id}})
+        record_id = parts[3] if len(parts) > 3 else None
+        if record_id not in state.records:
+            return self._reply(404, {'success': False, 'errors': [{'code': 81044, 'message': 'Record does not exist.'}]})
+        if self.command == 'PUT':
+            state.count('cloudflare PUT dns_records')
+            with state.lock:
+                state.records[record_id].update({'name': body['name'].lower(), 'content': body['content'], 'written': time.time()})
+            return self._reply(200, {'success': True, 'result': {'id': record_id}})
+        if self.command == 'DELETE':
+            state.count('cloudflare DELETE dns_records')
+            with state.lock:
+                state.records.pop(record_id, None)
+            return self._reply(200, {'success': True, 'result': {'id': record_id}})
+        return self._reply(405, {'success': False})
+
+
+""" The threaded HTTP server for both mock APIs. """
+class MockAPIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    def __init__(self, state, address=('127.0.0.1', 0)):
+        self.state = state
+        super().__init__(address, MockAPIHandler)
+
+
+""" A UDP responder acting as the authoritative nameserver of every mock zone, serving the TXT values written so far. """
+class MockNameserver:
+    def __init__(self, state, address=('127.0.0.1', 0)):
+        self.state = state
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(address)
+        self.port = self.sock.getsockname()[1]
+
+    # Answer queries until the socket is closed.
+    def serve_forever(self):
+        while True:
+            try:
+                data, client = self.sock.recvfrom(dns_wire.UDP_PAYLOAD_SIZE)
+            except OSError:
+                return
+            try:
+                message = dns_wire.parse_message(data)
+                qname, qtype, qclass = message.questions[0]
+            except (ValueError, IndexError, struct.error):
+                continue
+            values = self.state.served_values(qname) if qtype == dns_wire.TYPE_TXT else []
+            answers = b''.join(dns_wire.encode_record(qname, dns_wire.TYPE_TXT, dns_wire.CLASS_IN, 60, dns_wire.encode_txt(value))
+                for value in values)
+            # Flags: a response (QR), authoritative (AA), NOERROR.
+            header = struct.pack('!HHHHHH', message.id, 0x8400, 1, len(values), 0, 0)
+            question = dns_wire.encode_name(qname) + struct.pack('!HH', qtype, qclass)
+            self.sock.sendto(header + question + answers, client)
+
+    # Stop serving.
+    def close(self):
+        self.sock.close()
+
+
+# Start the API server and nameserver on background threads. Returns (api_server, nameserver).
+def start_mocks(state):
+    api_server = MockAPIServer(state)
+    nameserver = MockNameserver(state)
+    threading.Thread(target=api_server.serve_forever, daemon=True).start()
+    threading.Thread(target=nameserver.serve_forever, daemon=True).start()
+    return api_server, nameserver
+
+# The keychain 'API_BASE' entries pointing the API clients at a running mock server.
+def api_bases(api_server):
+    base = "http://127.0.0.1:{}/".format(api_server.server_address[1])
+    return {'godaddy': base, 'cloudflare': base + 'client/v4/'}
+
+# Generate zone names for the mocks: the given real-looking zones, padded with filler zones to exercise pagination.
+def mock_zones(zones, total):
+    return list(zones) + ['filler{:05d}.example.net'.format(index) for index in range(max(total - len(zones), 0))]
+
+
+
+""" Run the mocks standalone, for trying the hooks against them by hand. """
+def main():
+    parser = argparse.ArgumentParser(description="Serve mock GoDaddy/CloudFlare APIs and a matching nameserver.")
+    parser.add_argument('--zones', type=int, default=100, help="How many zones the mock accounts hold.")
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to every API response.")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Fraction of API requests answered with a 429.")
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help="Fraction of API requests answered with a 503.")
+    parser.add_argument('--propagation-delay', type=float, default=0.0, help="Seconds before the nameserver serves new values.")
+    args = parser.parse_args()
+    state = MockDNSState(mock_zones(['example.com', 'example.co.uk'], args.zones), latency=args.latency,
+        rate_429=args.rate_429, rate_5xx=args.rate_5xx, propagation_delay=args.propagation_delay)
+    api_server, nameserver = start_mocks(state)
+    print("API_BASE entries: {}".format(json.dumps(api_bases(api_server))))
+    print("Nameserver: ('127.0.0.1', {})".format(nameserver.port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+
+
+
+""" Only serve the mocks if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
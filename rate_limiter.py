@@ -0,0 +1,153 @@
+#!/bin/python3
+#
+# rate_limiter.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" RATE_LIMITER.PY - A token bucket shared by every hook process that uses the same DNS provider account.
+
+    Run directly to print the queue depth and wait-time statistics of every limiter in STATE_DIR.
+"""
+import os, json, time, glob, fcntl, threading
+from state_store import check_private
+from settings import *
+
+
+""" A token bucket whose state lives in a small file, so all processes using the same key share one budget.
+     Holds at most 'requests' tokens and refills at 'requests' per 'window' seconds. """
+class TokenBucketLimiter:
+    def __init__(self, key, requests, window, state_dir=None):
+        self.key = key
+        self.capacity = float(requests)
+        self.rate = float(requests) / float(window)
+        state_dir = state_dir or STATE_DIR
+        os.makedirs(state_dir, mode=0o700, exist_ok=True)
+        self.path = os.path.join(state_dir, 'ratelimit-{}.json'.format(key))
+
+    # Read, modify and write the bucket's state under an exclusive lock. 'func' gets the state dict and returns a result.
+    def _with_state(self, func):
+        with open(os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600), 'r+') as state_file:
+            check_private(state_file, self.path)
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                state_file.seek(0)
+                try:
+                    state = json.loads(state_file.read() or '{}')
+                except ValueError:
+                    state = {}
+                result = func(state)
+                state_file.seek(0)
+                state_file.truncate()
+                state_file.write(json.dumps(state, separators=(',', ':')))
+                state_file.flush()
+                return result
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    # Refill the bucket for the time since it was last touched, and forget waiters whose process has died.
+    def _refill(self, state, now):
+        tokens = state.get('tokens', self.capacity)
+        updated = state.get('updated', now)
+        state['tokens'] = min(self.capacity, tokens + max(now - updated, 0) * self.rate)
+        state['updated'] = now
+        waiting = state.setdefault('waiting', {})
+        for waiter in list(waiting.keys()):
+            try:
+                os.kill(int(waiter.split(':')[0]), 0)
+            except ProcessLookupError:
+                del waiting[waiter]
+            except (PermissionError, ValueError):
+                pass
+
+    # Take one token, sleeping (outside the lock) until one is available. Returns the number of seconds waited.
+    def acquire(self):
+        started = time.time()
+        # Waiters are tracked per process and thread, since the hook daemon runs many hooks in one process.
+        waiter = "{}:{}".format(os.getpid(), threading.get_ident())
+        while True:
+            # Either take a token now, or register as waiting and find out how long until one accrues.
+            def attempt(state):
+                now = time.time()
+                self._refill(state, now)
+                waiting = state['waiting']
+                stats = state.setdefault('stats', {})
+                if state['tokens'] >= 1.0:
+                    state['tokens'] -= 1.0
+                    waiting.pop(waiter, None)
+                    waited = now - started
+                    stats['requests'] = stats.get('requests', 0) + 1
+                    if waited > 0.001:
+                        stats['delayed_requests'] = stats.get('delayed_requests', 0) + 1
+                        stats['total_wait'] = stats.get('total_wait', 0.0) + waited
+                        stats['max_wait'] = max(stats.get('max_wait', 0.0), waited)
+                    return None
+                waiting.setdefault(waiter, started)
+                stats['max_queue_depth'] = max(stats.get('max_queue_depth', 0), len(waiting))
+                return (1.0 - state['tokens']) / self.rate
+            delay = self._with_state(attempt)
+            if delay is None:
+                return time.time() - started
+            time.sleep(delay)
+
+    # Get a snapshot of the limiter: current tokens and queue depth, plus the accumulated wait statistics.
+    def stats(self):
+        def snapshot(state):
+            self._refill(state, time.time())
+            stats = dict(state.get('stats', {}))
+            stats['tokens'] = round(state['tokens'], 2)
+            stats['queue_depth'] = len(state['waiting'])
+            stats['average_wait'] = stats.get('total_wait', 0.0) / stats['delayed_requests'] if stats.get('delayed_requests') else 0.0
+            return stats
+        return self._with_state(snapshot)
+
+
+# Build the limiter for a provider account from DNS_API_RATE_LIMITS, or None if the provider has no configured limit.
+def limiter_for(provider, account_key):
+    limit = DNS_API_RATE_LIMITS.get(provider)
+    if not limit:
+        return None
+    requests, window = limit
+    return TokenBucketLimiter("{}-{}".format(provider, account_key), requests, window)
+
+
+""" Print the statistics of every rate limiter found in STATE_DIR. """
+def main():
+    paths = sorted(glob.glob(os.path.join(STATE_DIR, 'ratelimit-*.json')))
+    if not paths:
+        print("No rate limiter state found in '{}'.".format(STATE_DIR))
+        return
+    for path in paths:
+        key = os.path.basename(path)[len('ratelimit-'):-len('.json')]
+        limit = DNS_API_RATE_LIMITS.get(key.split('-')[0], (1, 1))
+        stats = TokenBucketLimiter(key, limit[0], limit[1]).stats()
+        print("{}: {}".format(key, json.dumps(stats, sort_keys=True)))
+
+
+
+""" Only print the statistics if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
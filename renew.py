@@ -0,0 +1,257 @@
+#!/bin/python3
+#
+# renew.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" RENEW.PY - Renews the certificates listed in renewals.txt which are close to expiry, several at a time.
+
+    Usage: renew.py AUTO <days>
+      Renews every listed domain whose certificate expires within <days> days (or which has no certificate yet).
+      The renewed certificates are then deployed per DEPLOY_RULES (see deploy.py).
+      Exits non-zero if any renewal or deploy step failed.
+"""
+import os, sys, time, shutil, datetime, subprocess, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from cert_inventory import CertificateInventory
+from deploy import DeployEngine, print_results
+from settings import *
+
+
+# The directory holding this script and the hook scripts (which must stay together).
+PROJDIR = os.path.dirname(os.path.abspath(__file__))
+# Certbot's default configuration directory, used when RENEWAL_CERTBOT_DIR_TEMPLATE is not set (and otherwise the source
+#  of the ACME account copied into each domain's own directory).
+CERTBOT_DEFAULT_CONFIG_DIR = '/etc/letsencrypt'
+
+
+""" A single renewals.txt entry: the domain to certify and the DNS provider handling it. """
+class RenewalTarget:
+    def __init__(self, domain, provider):
+        self.domain = domain
+        self.provider = provider
+    # Certbot's config, work and logs directories for this domain, or None to use certbot's defaults.
+    def certbot_dirs(self):
+        if not RENEWAL_CERTBOT_DIR_TEMPLATE:
+            return None
+        root = RENEWAL_CERTBOT_DIR_TEMPLATE.format(domain=self.domain)
+        return {'config': root, 'work': os.path.join(root, 'work'), 'logs': os.path.join(root, 'logs')}
+    # Give this domain's own config directory the ACME account from certbot's default one, if it has no account yet.
+    #  Without one, certbot would have to register a new account (see RENEWAL_CERTBOT_ACCOUNT_OPTIONS).
+    def prepare_certbot_dirs(self):
+        dirs = self.certbot_dirs()
+        if dirs is None:
+            return
+        accounts = os.path.join(dirs['config'], 'accounts')
+        default_accounts = os.path.join(CERTBOT_DEFAULT_CONFIG_DIR, 'accounts')
+        if not os.path.isdir(accounts) and os.path.isdir(default_accounts):
+            os.makedirs(dirs['config'], mode=0o700, exist_ok=True)
+            shutil.copytree(default_accounts, accounts)
+    # Where certbot keeps this domain's current certificate chain.
+    def certificate_path(self):
+        dirs = self.certbot_dirs()
+        config_dir = dirs['config'] if dirs is not None else CERTBOT_DEFAULT_CONFIG_DIR
+        return os.path.join(config_dir, 'live', self.domain, 'fullchain.pem')
+    # The certbot command line for renewing this domain with the manual DNS hooks.
+    def certbot_command(self):
+        command = ['certbot', 'certonly', '--non-interactive', '--force-renewal',
+            '--manual', '--preferred-challenges=dns', '--manual-public-ip-logging-ok',
+            '--manual-auth-hook', os.path.join(PROJDIR, 'cb-auth.sh'),
+            '--manual-cleanup-hook', os.path.join(PROJDIR, 'cb-cleanup.sh'),
+            '-d', self.domain]
+        dirs = self.certbot_dirs()
+        if dirs is not None:
+            command += ['--config-dir', dirs['config'], '--work-dir', dirs['work'], '--logs-dir', dirs['logs']]
+            command += RENEWAL_CERTBOT_ACCOUNT_OPTIONS
+        return command
+
+
+""" The outcome of one domain's renewal check/attempt, for the end-of-run summary. """
+class RenewalResult:
+    def __init__(self, target, status, detail='', duration=0.0):
+        self.target = target
+        self.status = status   #one of: 'renewed', 'skipped', 'failed'
+        self.detail = detail
+        self.duration = duration
+
+
+# Read the renewal targets from the given file. Entries are separated by commas (or newlines), and each one may name
+#  its DNS provider as 'domain:provider'; entries without one use DNS_API_TARGET.
+def read_renewals(path):
+    targets = []
+    with open(path, 'r') as renewals_file:
+        for entry in renewals_file.read().replace('\n', ',').split(','):
+            entry = entry.strip()
+            if not entry or entry.startswith('#'):
+                continue
+            domain, _, provider = entry.partition(':')
+            targets.append(RenewalTarget(domain.strip(), provider.strip() or DNS_API_TARGET))
+    return targets
+
+
+
+""" Runs certbot for every due target, with an overall concurrency limit and a per-provider limit. """
+class RenewalOrchestrator:
+    def __init__(self, targets, concurrency=1, provider_concurrency=None):
+        self.targets = targets
+        # Certbot locks its config/work/logs directories, so runs can only overlap when each domain has its own.
+        self.concurrency = max(concurrency, 1) if RENEWAL_CERTBOT_DIR_TEMPLATE else 1
+        self.provider_limits = {}
+        for target in targets:
+            if target.provider not in self.provider_limits:
+                limit = (provider_concurrency or {}).get(target.provider, self.concurrency)
+                self.provider_limits[target.provider] = max(limit, 1)
+        self.output_lock = threading.Lock()
+        self.inventory = CertificateInventory()
+        # Deployments of the renewed certificates, run together once every renewal is done.
+        self.deployer = DeployEngine()
+        self.deploy_results = []
+
+    # Check (and, when due, renew) every target, then deploy the renewed certificates. Returns a RenewalResult per
+    #  target, in the original order; the deployment's results are left in self.deploy_results. With min_days None,
+    #  every target is renewed whatever its expiry (the scheduler has already decided they're due).
+    def run(self, min_days):
+        cutoff = None if min_days is None else datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=min_days)
+        # Index every target's live directory up front; only certificates changed since the last run are parsed.
+        self.inventory.refresh(sorted(set(os.path.dirname(os.path.dirname(target.certificate_path()))
+            for target in self.targets)))
+        results = [None] * len(self.targets)
+        queues = {}
+        for index, target in enumerate(self.targets):
+            results[index] = self._skip(target, cutoff)
+            if results[index] is None:
+                queues.setdefault(target.provider, deque()).append((index, target))
+        self._dispatch(queues, results)
+        self.deploy_results = self.deployer.run()
+        return results
+
+    # Run certbot for every queued target ({provider: deque of (index, target)}), storing each result at its index.
+    #  A target is only handed to a worker once its provider has a free slot, so a provider at its limit never holds
+    #  workers that others could use; the providers with a free slot take turns at the free workers.
+    def _dispatch(self, queues, results):
+        running = {}
+        active = dict((provider, 0) for provider in queues)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            while queues or running:
+                # Fill the free workers, a target per provider in turn, until no provider with work has a free slot.
+                startable = True
+                while startable and len(running) < self.concurrency:
+                    startable = False
+                    for provider in list(queues):
+                        if len(running) >= self.concurrency:
+                            break
+                        if active[provider] < self.provider_limits[provider]:
+                            index, target = queues[provider].popleft()
+                            if not queues[provider]:
+                                del queues[provider]
+                            running[pool.submit(self._renew, target)] = (index, provider)
+                            active[provider] += 1
+                            startable = True
+                done = wait(list(running), return_when=FIRST_COMPLETED)[0]
+                for future in done:
+                    index, provider = running.pop(future)
+                    active[provider] -= 1
+                    results[index] = future.result()
+
+    # Skip a target whose certificate isn't due yet, returning its result; None means it's due.
+    def _skip(self, target, cutoff):
+        record = self.inventory.get(target.certificate_path())
+        expiry = record.expiry if record is not None else None
+        if cutoff is not None and expiry is not None and expiry > cutoff:
+            self._print("+ Domain '{}' doesn't need to be renewed at this time (expires {}).".format(
+                target.domain, expiry.strftime('%Y-%m-%d')))
+            return RenewalResult(target, 'skipped', "expires {}".format(expiry.strftime('%Y-%m-%d')))
+        return None
+
+    # Run certbot for a single target.
+    def _renew(self, target):
+        started = time.monotonic()
+        env = dict(os.environ, CERTBOT_HOOK_PROVIDER=target.provider)
+        try:
+            target.prepare_certbot_dirs()
+            completed = subprocess.run(target.certbot_command(), env=env, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, universal_newlines=True)
+            output, returncode = completed.stdout, completed.returncode
+        except OSError as e:
+            output, returncode = "Could not set up or run certbot: {}\n".format(e), -1
+        duration = time.monotonic() - started
+        # Print each domain's certbot output as one block, so concurrent runs don't interleave.
+        self._print("\n+ Renewal attempt for: {}\n{}\n====================================\n".format(target.domain, output))
+        if returncode == 0:
+            self.deployer.add(os.path.dirname(target.certificate_path()))
+            return RenewalResult(target, 'renewed', '', duration)
+        return RenewalResult(target, 'failed', "certbot exited with code {}".format(returncode), duration)
+
+    # Print a message without interleaving it with other threads' output.
+    def _print(self, message):
+        with self.output_lock:
+            print(message, flush=True)
+
+
+""" Print the per-domain results and the deployment's, and return the exit status: 3 if anything failed, else 0. """
+def print_summary(results, deploy_results):
+    print("\n=== SUMMARY ===")
+    for result in results:
+        print("{:<8} {:<40} {:<12} {:>7.1f}s  {}".format(result.status.upper(), result.target.domain,
+            result.target.provider, result.duration, result.detail))
+    failures = [result for result in results if result.status == 'failed']
+    if deploy_results:
+        print("\n=== DEPLOY ===")
+        print_results(deploy_results)
+    deploy_failures = [result for result in deploy_results if not result.success]
+    print("\n=== COMPLETE ({} renewed, {} skipped, {} failed, {} deploy step(s) failed) ===".format(
+        len([r for r in results if r.status == 'renewed']), len([r for r in results if r.status == 'skipped']), len(failures),
+        len(deploy_failures)))
+    return 3 if failures or deploy_failures else 0
+
+
+""" Parse the command line, run the renewals and print a summary. """
+def main():
+    print("\n\n========== {} ==========".format(datetime.datetime.now().strftime('%c')))
+    if len(sys.argv) < 2 or sys.argv[1].upper() != 'AUTO':
+        print("+ AUTO not supplied as param 1. Quitting.")
+        sys.exit(1)
+    if len(sys.argv) != 3:
+        print("Two parameters only were expected. Quitting.")
+        sys.exit(1)
+    if not sys.argv[2].isdigit():
+        print("Param 2 wasn't a number. Expected minimum days difference to start auto-renew. Quitting.")
+        sys.exit(2)
+
+    orchestrator = RenewalOrchestrator(read_renewals(RENEWALS_FILE or os.path.join(PROJDIR, 'renewals.txt')),
+        concurrency=RENEWAL_CONCURRENCY, provider_concurrency=RENEWAL_PROVIDER_CONCURRENCY)
+    results = orchestrator.run(int(sys.argv[2]))
+
+    # Summarize every domain, then exit non-zero if anything failed.
+    sys.exit(print_summary(results, orchestrator.deploy_results))
+
+
+
+""" Only run the renewals if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
@@ -8,43 +8,21 @@
 #         For example, if this param is 20 days, the script will only attempt a
 #         renewal if the target domain's cert expires within 20 days of RIGHT NOW.
 #
-# Required binaries: certbot, openssl
+# The work itself is done by the "renew.py" orchestrator, which reads certificate expiry
+#   in-process and runs the due renewals concurrently (see the RENEWAL_* settings).
+#
+# With the keyword "SCHEDULED" instead of "AUTO", the renewals are spread out over time by
+#   "scheduler.py" (see the SCHEDULE_* settings). Run it hourly rather than daily in that case:
+#   each run only renews the domains whose slot in the renewal plan has come.
+#
+# Required binaries: certbot, python3
 #
 #
 
 # Directory where the certbot DNS API utility resides.
-CERTBOT_AUTO="/root/certbot_auto"
-# Full path to the text file to parse for comma-delimited certifying domains.
-DOMAINS_FILE="${CERTBOT_AUTO}/renewals.txt"
+CERTBOT_AUTO="$(cd "$(dirname "${BASH_SOURCE[0]}")" &>/dev/null && pwd)"
 
-echo -e "\n\n========== $(date) =========="
-if [[ "${1^^}" == "AUTO" ]]; then
-    [[ $# -ne 2 ]] && echo "Two parameters only were expected. Quitting." && exit 1
-    [[ -z "$(echo "$2" | grep -Po '^[0-9]+$')" ]] \
-        && echo "Param 2 wasn't a number. Expected minimum days difference to start auto-renew. Quitting." \
-        && exit 2
-    MIN_SEC_DIFF=$(( $2 *24 *60 *60  ))   #minimum seconds of difference between now and the cert expiry at which renewals should trigger
-    NOW_TIME=$(date -d'now' +%s)   #current unix timestamp
-    IFS=','; for i in `cat $DOMAINS_FILE`; do
-        #target cert's expiry unix timestamp
-        THEN_TIME="$(date -d "$(openssl x509 -noout -in /etc/letsencrypt/live/$i/fullchain.pem -dates 2>/dev/null | grep notAfter | cut -d'=' -f2)" +%s)"
-        # If the difference between now and then is less that the noted trigger difference, try renewing.
-        if [[ $(( $THEN_TIME - $NOW_TIME )) -le $MIN_DAYS ]]; then
-            echo -e "\n+ Renewal attempt for: ${i}"
-            certbot certonly --manual --preferred-challenges=dns --manual-public-ip-logging-ok \
-                --manual-auth-hook $CERTBOT_AUTO/cb-auth.sh \
-                --manual-cleanup-hook $CERTBOT_AUTO/cb-cleanup.sh \
-                -d "$i"
-                echo -e "\n====================================\n"
-        else
-            echo "+ Domain '${i}' doesn't need to be renewed at this time."
-        fi
-    done
-else
-    echo "+ AUTO not supplied as param 1. Quitting."
-    exit 1
+if [[ "${1^^}" == "SCHEDULED" ]]; then
+    exec python3 "${CERTBOT_AUTO}/scheduler.py" run "${@:2}"
 fi
-
-echo -e "\n=== COMPLETE ==="
-exit 0
-
+exec python3 "${CERTBOT_AUTO}/renew.py" "$@"
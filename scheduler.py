@@ -0,0 +1,287 @@
+#!/bin/python3
+#
+# scheduler.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" SCHEDULER.PY - Spreads the renewals in renewals.txt out over time, instead of renewing everything due at once.
+
+    Usage: scheduler.py {plan|run} <days>
+      plan: brings the renewal plan up to date and prints it.
+      run:  brings the plan up to date, then renews the domains whose slot has come. Meant to be run hourly by cron.
+    Each domain becomes due <days> days before its certificate expires, and gets an hourly slot within the next
+    SCHEDULE_SPREAD_HOURS, picked by a hash of its name and expiry (the same inputs always give the same plan). Slots are
+    capped per hour, in total and per DNS provider, and per registered domain per day; a domain whose slot is full
+    moves to the nearest free one. The plan is kept in STATE_DIR, so each run only renews what its slot holds.
+    Exits non-zero if any renewal or deploy step failed.
+"""
+import os, sys, time, hashlib, datetime
+from renew import RenewalOrchestrator, read_renewals, print_summary, PROJDIR
+from cert_inventory import CertificateInventory
+from dns_apis import DNS_API_CLIENT, split_domain
+from log_writer import HookLog
+from state_store import StateStore, MISSING
+from settings import *
+
+
+HOUR = 3600
+DAY = 86400
+# The state-store key holding the plan: {domain: entry}.
+PLAN_KEY = 'plan'
+
+
+# A fraction in [0, 1) derived from a domain and its certificate's expiry. The same inputs always give the same slot,
+#  while domains issued together still land at different points of their window.
+def jitter_fraction(domain, expiry):
+    digest = hashlib.sha256("{}|{}".format(domain.lower(), expiry).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') / float(1 << 64)
+
+# Round a unix time down to the start of its hour.
+def hour_of(timestamp):
+    return int(timestamp // HOUR) * HOUR
+
+
+# Find the registered domain (the provider's zone) of a domain, for the per-registered-domain cap. Providers which can
+#  list their zones answer from the shared zone list; for the others (or if the client can't be built) it's guessed.
+def registered_domain(domain, provider, logger):
+    name = domain[2:] if domain.startswith('*.') else domain
+    try:
+        return DNS_API_CLIENT[provider](DNS_API_KEYCHAIN[provider], None, None, logger).resolve_zone(name)[0].lower()
+    except Exception:
+        return split_domain(name)[0].lower()
+
+
+""" Counts the renewals in each hour (in total and per provider) and per registered domain per day, against the caps.
+     A cap of 0, or a provider without one, is unlimited. """
+class SlotCapacity:
+    def __init__(self, max_per_hour=None, provider_max_per_hour=None, zone_max_per_day=None):
+        self.max_per_hour = SCHEDULE_MAX_PER_HOUR if max_per_hour is None else max_per_hour
+        self.provider_max_per_hour = SCHEDULE_PROVIDER_MAX_PER_HOUR if provider_max_per_hour is None else provider_max_per_hour
+        self.zone_max_per_day = SCHEDULE_ZONE_MAX_PER_DAY if zone_max_per_day is None else zone_max_per_day
+        self.counts = {}
+
+    # The counters a renewal in the given slot takes up, with their caps.
+    def _counters(self, entry, slot):
+        return [(('hour', slot), self.max_per_hour),
+            (('provider', entry['provider'], slot), self.provider_max_per_hour.get(entry['provider'], 0)),
+            (('zone', entry['zone'], slot // DAY), self.zone_max_per_day)]
+
+    # Whether the slot has room for the renewal.
+    def fits(self, entry, slot):
+        return all(not limit or self.counts.get(key, 0) < limit for key, limit in self._counters(entry, slot))
+
+    # Count the renewal against the slot.
+    def take(self, entry, slot):
+        for key, _ in self._counters(entry, slot):
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+
+""" Keeps the renewal plan: an hourly slot for every renewals.txt domain, persisted in STATE_DIR.
+     Entries are {'provider', 'zone', 'expiry', 'days', 'slot', 'over_cap', 'status', 'claimed', 'attempts', 'retry_at'},
+     where status is 'planned', 'running' (claimed by a run) or 'renewed' (until the new certificate shows up). """
+class RenewalScheduler:
+    def __init__(self, targets, days, store=None, inventory=None, logger=None):
+        self.targets = dict((target.domain, target) for target in targets)
+        self.days = days
+        self.store = store or StateStore(os.path.join(STATE_DIR, 'renewal-plan.json'))
+        self.inventory = inventory or CertificateInventory()
+        self.logger = logger or self._default_logger
+        self.log = HookLog(LOGGING_DIR + '/certbot-schedule.log')
+
+    # Log to STDOUT in DEBUG mode, and otherwise to a scheduler logfile in LOGGING_DIR.
+    def _default_logger(self, message, debug_only=False):
+        if DEBUG is True:
+            print("[DEBUG] {} ::: {}".format(datetime.datetime.now(), message))
+        elif debug_only is False:
+            self.log.write(message)
+
+    # The hours a certificate should be renewed in, as (opens, closes, deadline). The window opens 'days' days before
+    #  expiry (or now, if that has passed) and spans SCHEDULE_SPREAD_HOURS; when it's full, renewals may overflow up to
+    #  SCHEDULE_DEADLINE_DAYS before expiry. Domains without a certificate are due at once, and failed renewals at
+    #  their retry time, overflowing for up to SCHEDULE_SPREAD_HOURS (or to the deadline, if that's later).
+    def window(self, expiry, now, retry_at=None):
+        opens = max(hour_of(now), hour_of(retry_at or 0))
+        if expiry is not None:
+            opens = max(hour_of(expiry - self.days * DAY), opens)
+        if expiry is None or retry_at is not None:
+            overflow = opens + SCHEDULE_SPREAD_HOURS * HOUR
+            return opens, opens, overflow if expiry is None else max(hour_of(expiry - SCHEDULE_DEADLINE_DAYS * DAY), overflow)
+        deadline = max(hour_of(expiry - SCHEDULE_DEADLINE_DAYS * DAY), opens)
+        return opens, min(opens + SCHEDULE_SPREAD_HOURS * HOUR, deadline), deadline
+
+    # Place a new (or changed) entry in the first slot with room: its jittered preferred slot through the window's end,
+    #  then the earlier part of the window (nearest first), then the overflow up to the deadline. If every slot is
+    #  full, it goes in the preferred one anyway and is flagged as over the caps.
+    def _place(self, domain, entry, capacity, now):
+        opens, closes, deadline = self.window(entry['expiry'], now, entry.get('retry_at'))
+        preferred = opens + int(jitter_fraction(domain, entry['expiry']) * ((closes - opens) // HOUR + 1)) * HOUR
+        candidates = list(range(preferred, closes + 1, HOUR)) + list(range(preferred - HOUR, opens - 1, -HOUR)) \
+            + list(range(closes + HOUR, deadline + 1, HOUR))
+        slot = next((slot for slot in candidates if capacity.fits(entry, slot)), None)
+        entry.update({'slot': preferred if slot is None else slot, 'over_cap': slot is None})
+        capacity.take(entry, entry['slot'])
+
+    # Rebuild the plan from the previous one. Entries whose provider, expiry and lead time are unchanged keep their
+    #  slots, and take up their capacity first; new and changed domains are then placed, the most urgent first.
+    #  Domains no longer in renewals.txt are dropped.
+    def _replan(self, plan, expiries, zones, now):
+        capacity = SlotCapacity()
+        replanned, pending = {}, []
+        for domain, target in self.targets.items():
+            entry = plan.get(domain)
+            if entry is not None and entry['status'] == 'running' and entry['claimed'] > now - SCHEDULE_CLAIM_TIMEOUT:
+                # The certificate may be changing under a run in progress, so its entry is left alone until it reports.
+                replanned[domain] = entry
+                continue
+            if entry is not None and (entry['provider'], entry['expiry'], entry['days']) == (target.provider, expiries[domain], self.days):
+                if entry['status'] == 'running':
+                    self.logger("The run renewing '{}' never reported back; it's due again.".format(domain))
+                    entry['status'] = 'planned'
+                replanned[domain] = entry
+                if entry['status'] == 'planned' and entry['slot'] is not None:
+                    capacity.take(entry, entry['slot'])
+                elif entry['status'] == 'planned':
+                    pending.append((domain, entry))
+                continue
+            pending.append((domain, {'provider': target.provider, 'zone': zones[domain], 'expiry': expiries[domain],
+                'days': self.days, 'slot': None, 'over_cap': False, 'status': 'planned', 'claimed': None,
+                'attempts': 0, 'retry_at': None}))
+        # The most urgent first: the earliest deadline, then the earliest window.
+        pending.sort(key=lambda item: (self.window(item[1]['expiry'], now, item[1]['retry_at'])[2],
+            self.window(item[1]['expiry'], now, item[1]['retry_at'])[0], item[0]))
+        for domain, entry in pending:
+            self._place(domain, entry, capacity, now)
+            replanned[domain] = entry
+            self.logger("Planned '{}' for {}{}.".format(domain, format_slot(entry['slot']),
+                " (over the caps)" if entry['over_cap'] else ''))
+        return replanned
+
+    # Bring the plan up to date with renewals.txt and the certificates' current expiry, save it, and return it.
+    def refresh(self, now=None):
+        now = time.time() if now is None else now
+        self.inventory.refresh(sorted(set(os.path.dirname(os.path.dirname(target.certificate_path()))
+            for target in self.targets.values())))
+        expiries = {}
+        for domain, target in self.targets.items():
+            record = self.inventory.get(target.certificate_path())
+            expiries[domain] = record.not_after if record is not None else None
+        # Finding a zone may take API requests, so it's done before taking the plan's lock, and only for new domains.
+        previous = self.store.get(PLAN_KEY, {})
+        zones = dict((domain, previous[domain]['zone'] if domain in previous and previous[domain]['provider'] == target.provider
+            else registered_domain(domain, target.provider, self.logger)) for domain, target in self.targets.items())
+        return self.store.update(PLAN_KEY, lambda plan: self._replan({} if plan is MISSING else plan, expiries, zones, now),
+            ttl=None)
+
+    # Claim the planned renewals whose slot has come, earliest slot first, within a single hour's caps: a backlog left
+    #  by missed runs is worked off an hour at a time instead of all at once. Returns the claimed domains.
+    def claim_due(self, now=None):
+        now = time.time() if now is None else now
+        claimed = []
+        def claim(plan):
+            plan = {} if plan is MISSING else plan
+            capacity = SlotCapacity()
+            for slot, domain in sorted((entry['slot'], domain) for domain, entry in plan.items()
+                    if entry['status'] == 'planned' and entry['slot'] is not None and entry['slot'] <= now):
+                # Per-registered-domain caps are per day, so today's claims count against them as well.
+                if capacity.fits(plan[domain], hour_of(now)):
+                    capacity.take(plan[domain], hour_of(now))
+                    plan[domain].update({'status': 'running', 'claimed': now})
+                    claimed.append(domain)
+            return plan
+        self.store.update(PLAN_KEY, claim, ttl=None)
+        return claimed
+
+    # Record the outcome of claimed renewals. Renewed entries stay 'renewed' until the new certificate's expiry shows
+    #  up (and replans them); failed ones are retried SCHEDULE_RETRY_HOURS later, doubling with each further failure.
+    def record_results(self, results, now=None):
+        now = time.time() if now is None else now
+        def record(plan):
+            plan = {} if plan is MISSING else plan
+            for result in results:
+                entry = plan.get(result.target.domain)
+                if entry is None:
+                    continue
+                if result.status == 'renewed':
+                    entry.update({'status': 'renewed', 'attempts': 0, 'retry_at': None})
+                    continue
+                entry['attempts'] += 1
+                entry.update({'status': 'planned', 'slot': None,
+                    'retry_at': hour_of(now) + SCHEDULE_RETRY_HOURS * HOUR * 2 ** min(entry['attempts'] - 1, 5)})
+                self.logger("Renewing '{}' failed (attempt {}); retrying from {}.".format(result.target.domain,
+                    entry['attempts'], format_slot(entry['retry_at'])))
+            return plan
+        self.store.update(PLAN_KEY, record, ttl=None)
+
+
+# Format a slot (unix time) for display, in UTC.
+def format_slot(slot):
+    if slot is None:
+        return '-'
+    return datetime.datetime.fromtimestamp(slot, datetime.timezone.utc).strftime('%Y-%m-%d %H:00Z')
+
+
+""" Print the plan, earliest slot first. """
+def print_plan(plan):
+    print("{:<18} {:<40} {:<12} {:<24} {:<11} {}".format('SLOT', 'DOMAIN', 'PROVIDER', 'REGISTERED DOMAIN', 'EXPIRES', 'STATUS'))
+    for domain, entry in sorted(plan.items(), key=lambda item: (item[1]['slot'] is not None, item[1]['slot'] or 0, item[0])):
+        expires = datetime.datetime.fromtimestamp(entry['expiry'], datetime.timezone.utc).strftime('%Y-%m-%d') \
+            if entry['expiry'] is not None else 'none'
+        status = entry['status'] + (' (over caps)' if entry['over_cap'] else '') \
+            + (' (attempt {})'.format(entry['attempts'] + 1) if entry['attempts'] else '')
+        print("{:<18} {:<40} {:<12} {:<24} {:<11} {}".format(format_slot(entry['slot']), domain, entry['provider'],
+            entry['zone'], expires, status))
+
+
+""" Parse the command line, then print the plan or run this slot's renewals. """
+def main():
+    print("\n\n========== {} ==========".format(datetime.datetime.now().strftime('%c')))
+    if len(sys.argv) != 3 or sys.argv[1] not in ('plan', 'run') or not sys.argv[2].isdigit():
+        sys.exit("Usage: scheduler.py {plan|run} <days>")
+    targets = read_renewals(RENEWALS_FILE or os.path.join(PROJDIR, 'renewals.txt'))
+    scheduler = RenewalScheduler(targets, int(sys.argv[2]))
+    plan = scheduler.refresh()
+    if sys.argv[1] == 'plan':
+        print_plan(plan)
+        sys.exit(0)
+
+    claimed = scheduler.claim_due()
+    if not claimed:
+        print("+ No renewals are due in this slot.")
+        sys.exit(0)
+    print("+ Renewing in this slot: {}".format(', '.join(claimed)))
+    orchestrator = RenewalOrchestrator([target for target in targets if target.domain in claimed],
+        concurrency=RENEWAL_CONCURRENCY, provider_concurrency=RENEWAL_PROVIDER_CONCURRENCY)
+    results = orchestrator.run(None)
+    scheduler.record_results(results)
+    scheduler.refresh()
+    sys.exit(print_summary(results, orchestrator.deploy_results))
+
+
+
+""" Only run the scheduler if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
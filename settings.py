@@ -33,6 +33,7 @@
 
 # Manual API access information. DO NOT SHARE THIS INFORMATION WITH ANYONE ELSE.
 #  This information is available from your DNS provider. Please see the README file.
+#  Each provider's entry may also set 'API_BASE' to send its requests to another URL (the benchmark's mock APIs use this).
 DNS_API_KEYCHAIN = {
     'godaddy' : {
         'API_KEY': '',
@@ -42,6 +43,17 @@ DNS_API_KEYCHAIN = {
         'API_EMAIL': '',
         'API_KEY': '',
     },
+    # For zones on your own authoritative nameservers (BIND, Knot, PowerDNS, ...), updated with TSIG-signed RFC 2136
+    #  DNS UPDATE messages. SERVER is the primary nameserver's address; KEY_SECRET is the base64 TSIG secret, and
+    #  KEY_ALGORITHM one of hmac-sha256 (the default), hmac-sha512, hmac-sha384, hmac-sha224, hmac-sha1 or
+    #  hmac-md5.sig-alg.reg.int. The server's update policy must let the key change TXT records under _acme-challenge.
+    'rfc2136' : {
+        'SERVER': '',
+        'PORT': 53,
+        'KEY_NAME': '',
+        'KEY_ALGORITHM': 'hmac-sha256',
+        'KEY_SECRET': '',
+    },
 }
 
 
@@ -49,7 +61,7 @@ DNS_API_KEYCHAIN = {
 # TODO: Find a way to automate this on a per-domain basis, or pass it in somehow.
 #        An easy idea to toy with could be K:V pairs of DOMAIN:PROVIDER in the `renewals.txt` file.
 # Options:
-#   godaddy, cloudflare
+#   godaddy, cloudflare, rfc2136
 DNS_API_TARGET = ''
 
 
@@ -60,3 +72,184 @@ DEBUG = False
 # How long (in seconds) to wait for DNS records to update before handing control back to certbot.
 #  This field has a maximum value of 600 seconds and a minimum value of 30.
 DNS_UPDATE_TIMER = 30
+
+
+# Poll the zone's authoritative nameservers for the challenge record instead of always sleeping DNS_UPDATE_TIMER?
+#  When enabled, the hook returns as soon as every authoritative nameserver serves the token, and DNS_UPDATE_TIMER
+#  becomes the upper bound on the wait. If the nameservers cannot be discovered, the full timer is slept instead.
+DNS_PROPAGATION_CHECK = True
+# Seconds between the first polls, the multiplier applied after each unsuccessful poll, and the longest allowed gap.
+DNS_PROPAGATION_INTERVAL = 2
+DNS_PROPAGATION_BACKOFF = 1.5
+DNS_PROPAGATION_MAX_INTERVAL = 15
+# Recursive resolvers used to discover the authoritative nameservers. Leave empty to use /etc/resolv.conf.
+DNS_PROPAGATION_RESOLVERS = []
+# Optional list of ('host', port) nameservers to poll directly, skipping discovery (e.g. a local stub DNS server).
+DNS_PROPAGATION_NAMESERVERS = []
+# The port authoritative nameservers are queried on after discovery.
+DNS_PROPAGATION_PORT = 53
+
+
+# The Unix socket the optional hook daemon (hook_daemon.py) listens on. The cb-*.sh hooks use the same default path,
+#  which can be overridden for both with the CERTBOT_HOOK_SOCKET environment variable.
+HOOK_DAEMON_SOCKET = '/run/certbot-hooks/daemon.sock'
+
+
+# HTTP-01 challenges (certbot --preferred-challenges http) are served from memory by http_responder.py, which the hooks
+#  hand the tokens to over its control socket. Run it where LetsEncrypt reaches the domains on port 80, or proxy
+#  '/.well-known/acme-challenge/' to it from the existing web server. An empty address listens on every address.
+HTTP_RESPONDER_ADDRESS = ''
+HTTP_RESPONDER_PORT = 80
+# The responder's control socket. The CERTBOT_HTTP_RESPONDER_SOCKET environment variable overrides it for both sides.
+HTTP_RESPONDER_SOCKET = '/run/certbot-hooks/http01.sock'
+# How long (in seconds) a token is served if its cleanup hook never runs.
+HTTP_RESPONDER_TOKEN_TTL = 3600
+
+
+# Where the hooks keep state shared between processes (API ID caches, auth-to-cleanup handoffs and the like). Created
+#  (readable only by its owner) if it doesn't exist. The hooks act on this state, so it must not be somewhere other users
+#  can write, like /tmp: state files not owned by the hooks' user, or writable by anyone else, are refused.
+STATE_DIR = '/var/lib/certbot-hooks'
+# How long (in seconds) CloudFlare zone and record IDs are cached on disk before being looked up again.
+CLOUDFLARE_CACHE_TTL = 86400
+# How long (in seconds) the auth hook's record details are kept for the cleanup hook before they're considered stale.
+HANDOFF_TTL = 86400
+
+
+# Coalesce the propagation wait for certificates with several names (including wildcard plus apex)?
+#  Certbot runs the auth hook once per challenge. With this enabled, every hook but the certificate's last one writes
+#  its record and returns immediately, and the last hook waits once for all of them. Needs a certbot that sets
+#  CERTBOT_REMAINING_CHALLENGES and CERTBOT_ALL_DOMAINS; otherwise each hook waits on its own record as before.
+DNS_COALESCE_WAIT = True
+
+
+# The list of domains renewed by renew.py (and run.sh). Leave empty to use the renewals.txt file next to renew.py.
+#  Entries are comma-delimited, and each may pick its DNS provider as 'domain:provider' (e.g. 'example.org:cloudflare').
+RENEWALS_FILE = ''
+# How many certbot runs renew.py may have going at once, in total and per DNS provider.
+RENEWAL_CONCURRENCY = 4
+RENEWAL_PROVIDER_CONCURRENCY = {
+    'godaddy': 2,
+    'cloudflare': 4,
+}
+# Certbot locks its config, work and logs directories, so only one certbot may use them at a time. To renew
+#  concurrently, give each domain its own certbot directories here ('{domain}' is replaced with the renewals.txt entry),
+#  e.g. '/etc/letsencrypt/domains/{domain}'. When empty, certbot's defaults are used and renewals run one at a time.
+RENEWAL_CERTBOT_DIR_TEMPLATE = ''
+# The per-domain directories above start out without an ACME account. renew.py copies the account from certbot's
+#  default directory (/etc/letsencrypt/accounts) into each one that has none; where there is no account to copy, certbot
+#  registers a new one with these options (e.g. ['--agree-tos', '-m', 'admin@mydomain.com'] to register with an email).
+RENEWAL_CERTBOT_ACCOUNT_OPTIONS = ['--agree-tos', '--register-unsafely-without-email']
+
+# The renewal scheduler (scheduler.py, run hourly as 'run.sh SCHEDULED <days>') spreads renewals out over time instead of
+#  renewing everything due at once. Each domain gets an hourly slot within SCHEDULE_SPREAD_HOURS of becoming due, and
+#  renewals may be pushed back by the caps to no later than SCHEDULE_DEADLINE_DAYS before their certificate expires.
+SCHEDULE_SPREAD_HOURS = 72
+SCHEDULE_DEADLINE_DAYS = 3
+# The most renewals in any hour, in total and per DNS provider (0, or a provider left out, is unlimited), and the most
+#  per registered domain (the provider's zone) in any day, which keeps LetsEncrypt's per-domain rate limits at bay.
+SCHEDULE_MAX_PER_HOUR = 6
+SCHEDULE_PROVIDER_MAX_PER_HOUR = {
+    'godaddy': 2,
+    'cloudflare': 6,
+}
+SCHEDULE_ZONE_MAX_PER_DAY = 10
+# A failed renewal is retried this many hours later, doubling with each further failure.
+SCHEDULE_RETRY_HOURS = 4
+# A renewal claimed by a run which never reported back (say, a killed cron job) is due again after this many seconds.
+SCHEDULE_CLAIM_TIMEOUT = 21600
+
+
+# Deployment of renewed certificates (see deploy.py). Each rule maps certificate names to files to install, permissions
+#  to set and services to reload. renew.py collects the rules of every certificate it renewed and runs them once at the
+#  end of the run, so each service is reloaded once however many of its certificates were renewed. For certificates
+#  issued by hand, pass '--deploy-hook "python3 /path/to/deploy.py"' to certbot. For example:
+#    {
+#        'domains': ['imap.sampledomain.net'],
+#        'files': [
+#            {'source': 'fullchain.pem', 'target': '/etc/dovecot/fullchain.pem', 'link': True, 'group': 'dovecot'},
+#            {'source': 'privkey.pem', 'target': '/etc/dovecot/privkey.pem', 'link': True, 'group': 'dovecot', 'mode': 0o640},
+#        ],
+#        'services': {'dovecot': 'reload', 'postfix': 'reload'},
+#    },
+DEPLOY_RULES = [
+]
+# Services to act on only after others have been, as {service: [services it waits for]}. Everything else runs in parallel.
+DEPLOY_SERVICE_DEPENDENCIES = {}
+# The commands behind each service action. 'reload' restarts only services which can't reload.
+DEPLOY_SERVICE_COMMANDS = {
+    'reload': ['systemctl', 'reload-or-restart', '{service}'],
+    'restart': ['systemctl', 'restart', '{service}'],
+}
+# How many certificates' files, or services, are deployed at once.
+DEPLOY_CONCURRENCY = 4
+
+
+# HTTP behavior of the DNS API clients. Timeouts are in seconds: how long to wait for a connection, and for a response.
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+# Rate-limited (429) and failed (5xx) requests are retried up to HTTP_MAX_RETRIES times. A Retry-After header from
+#  the provider is honored; otherwise the wait doubles from HTTP_BACKOFF_BASE (capped at HTTP_BACKOFF_MAX), with jitter.
+HTTP_MAX_RETRIES = 4
+HTTP_BACKOFF_BASE = 1
+HTTP_BACKOFF_MAX = 30
+# The most time (in seconds) a single request may spend in retries before giving up.
+HTTP_RETRY_BUDGET = 120
+# How many keep-alive connections to pool per provider.
+HTTP_POOL_SIZE = 10
+
+
+# Request budgets shared by every hook process using the same provider account, as (requests, per-seconds).
+#  Processes wait for their turn instead of tripping the provider's own rate limiting. Remove a provider to disable.
+#  The defaults follow the providers' published limits: GoDaddy allows 60 requests a minute; CloudFlare 1200 per 5 minutes.
+DNS_API_RATE_LIMITS = {
+    'godaddy': (60, 60),
+    'cloudflare': (1200, 300),
+}
+
+
+# How many record operations dns_bulk.py (and the tools built on it) may have in flight at once.
+DNS_BULK_CONCURRENCY = 16
+
+
+# The TTL (in seconds) of the TXT records written through the GoDaddy API. GoDaddy doesn't accept values below 600.
+GODADDY_TXT_TTL = 600
+# The TTL (in seconds) of the challenge TXT records added through RFC 2136 dynamic updates.
+RFC2136_TXT_TTL = 60
+
+
+# The certbot 'live' directories indexed by cert_inventory.py when none are given on its command line.
+#  renew.py indexes the live directories of its own renewal targets instead.
+CERT_INVENTORY_LIVE_DIRS = ['/etc/letsencrypt/live']
+
+
+# How long (in seconds) the list of zones in each DNS provider account is cached before being fetched again. The hooks
+#  find each domain's zone in this list, which also gets multi-label suffixes like 'example.co.uk' right.
+ZONE_LIST_TTL = 86400
+
+
+# The stale challenge record sweeper (sweeper.py) leaves records changed less than this many seconds ago alone, where the
+#  provider reports record ages (CloudFlare does, GoDaddy doesn't). Records of issuances in progress are always kept.
+SWEEP_MIN_AGE = 3600
+
+
+# Record how long each phase of every hook run takes (see metrics.py)?
+METRICS_ENABLED = True
+# Where each hook run is appended as one JSON line with its timing spans. Leave empty to skip the event log.
+METRICS_EVENT_LOG = LOGGING_DIR + '/hook-events.jsonl'
+# The Prometheus textfile (for node_exporter's textfile collector) holding the phase-duration histograms of every run so
+#  far. Point this into the collector's directory, e.g. '/var/lib/node_exporter/textfile/certbot_hooks.prom'.
+#  Leave empty to skip the histograms.
+METRICS_TEXTFILE = STATE_DIR + '/certbot_hooks.prom'
+# The histogram bucket bounds, in seconds. Changing them starts the histograms over.
+METRICS_BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600]
+
+
+# The format of the hook logfiles in LOGGING_DIR: 'text' ('TIME ::: MESSAGE' lines) or 'json' (one JSON object per
+#  record, with the domain and hook type). See log_writer.py.
+LOG_FORMAT = 'text'
+# Rotate a logfile once it would grow past this many bytes (0 never rotates), keeping LOG_BACKUP_COUNT old copies.
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# Gzip the old copies of rotated logfiles? The newest copy stays uncompressed until the next rotation.
+LOG_COMPRESS = True
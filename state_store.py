@@ -0,0 +1,154 @@
+#!/bin/python3
+#
+# state_store.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" STATE_STORE.PY - A small JSON key/value store on disk, shared safely between concurrent hook processes. """
+import os, json, time, fcntl, tempfile
+from contextlib import contextmanager
+
+
+# Returned by StateStore.get when a key isn't present (or has expired), so that a stored None can be told apart.
+MISSING = object()
+
+
+# Refuse a state file that anyone but this user could have written. The hooks act on what their state says (which
+#  record to overwrite or delete), so a file another local user planted, or can still modify, must never be trusted.
+def check_private(state_file, path):
+    stat = os.fstat(state_file.fileno())
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+        raise PermissionError("Refusing to use the state file '{}': it must belong to uid {} and be writable by no one "
+            "else. Check STATE_DIR in settings.py.".format(path, os.getuid()))
+
+
+""" A JSON file of {key: {'value': ..., 'expires': unix-time}} entries.
+     Every read-modify-write happens under an exclusive flock on a companion '.lock' file, and the data file is only
+     ever replaced atomically (write to a temporary file, then rename), so readers never see a partial file. """
+class StateStore:
+    def __init__(self, path, default_ttl=None):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.default_ttl = default_ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+
+    # Hold the store's exclusive lock for the duration of a 'with' block.
+    @contextmanager
+    def _locked(self):
+        with open(self.lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # Load the raw entries from disk. A missing or corrupt file is treated as empty; one that fails check_private raises
+    #  a PermissionError.
+    def _load(self):
+        try:
+            store_file = open(self.path, 'r')
+        except OSError:
+            return {}
+        with store_file:
+            check_private(store_file, self.path)
+            try:
+                entries = json.load(store_file)
+            except ValueError:
+                return {}
+        return entries if isinstance(entries, dict) else {}
+
+    # Atomically replace the data file with the given entries, dropping anything that has expired.
+    def _save(self, entries):
+        now = time.time()
+        entries = dict((k, v) for k, v in entries.items() if v.get('expires') is None or v['expires'] > now)
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=os.path.dirname(self.path) or '.')
+        try:
+            with os.fdopen(fd, 'w') as temp_file:
+                json.dump(entries, temp_file, separators=(',', ':'))
+            os.chmod(temp_path, 0o600)
+            os.replace(temp_path, self.path)
+        except:
+            os.unlink(temp_path)
+            raise
+
+    # Get the value for a key, or the default (MISSING unless given) if it's absent or expired.
+    def get(self, key, default=MISSING):
+        entry = self._load().get(key)
+        if entry is None or (entry.get('expires') is not None and entry['expires'] <= time.time()):
+            return default
+        return entry.get('value')
+
+    # Set a key's value. The ttl (seconds) falls back to the store default; None means it never expires.
+    def set(self, key, value, ttl=MISSING):
+        ttl = self.default_ttl if ttl is MISSING else ttl
+        with self._locked():
+            entries = self._load()
+            entries[key] = {'value': value, 'expires': time.time() + ttl if ttl is not None else None}
+            self._save(entries)
+
+    # Atomically replace a key's value with func(current_value), where current_value is MISSING if absent or expired.
+    #  Returns the new value.
+    def update(self, key, func, ttl=MISSING):
+        ttl = self.default_ttl if ttl is MISSING else ttl
+        with self._locked():
+            entries = self._load()
+            entry = entries.get(key)
+            current = MISSING
+            if entry is not None and (entry.get('expires') is None or entry['expires'] > time.time()):
+                current = entry.get('value')
+            value = func(current)
+            entries[key] = {'value': value, 'expires': time.time() + ttl if ttl is not None else None}
+            self._save(entries)
+            return value
+
+    # Remove a key (or several), if present.
+    def delete(self, *keys):
+        with self._locked():
+            entries = self._load()
+            if any(key in entries for key in keys):
+                for key in keys:
+                    entries.pop(key, None)
+                self._save(entries)
+
+    # Remove and return a key's value in one locked step (MISSING if it wasn't there).
+    def pop(self, key, default=MISSING):
+        with self._locked():
+            entries = self._load()
+            entry = entries.pop(key, None)
+            if entry is not None:
+                self._save(entries)
+                if entry.get('expires') is None or entry['expires'] > time.time():
+                    return entry.get('value')
+            return default
+
+    # Get every unexpired {key: value} in the store.
+    def items(self):
+        now = time.time()
+        return dict((k, v.get('value')) for k, v in self._load().items()
+            if v.get('expires') is None or v['expires'] > now)
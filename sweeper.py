@@ -0,0 +1,159 @@
+#!/bin/python3
+#
+# sweeper.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" SWEEPER.PY - Finds and deletes the stale _acme-challenge TXT records left behind in a DNS provider account.
+
+    Usage: sweeper.py {godaddy|cloudflare} [--dry-run] [--min-age SECONDS] [--zone ZONE ...]
+      Lists every zone of the account (or just the given zones) and each zone's challenge records, following the
+      provider's pagination, then deletes the records which no issuance in progress refers to. Zones are swept
+      concurrently, up to DNS_BULK_CONCURRENCY at once. With --dry-run, the stale records are only reported.
+"""
+import os, sys, asyncio, argparse
+from concurrent.futures import ThreadPoolExecutor
+from dns_bulk import AsyncDNSEngine
+from dns_apis import DNS_API_CLIENT
+from log_writer import HookLog
+from state_store import StateStore
+from settings import *
+
+
+# The state stores in which the hooks keep the challenge values of issuances still in progress (see CertbotWorker):
+#  written values awaiting their cleanup hook, queued batched writes and writes in progress, and batched propagation
+#  waits. An auth hook's value is in at least one of them from before its record is written until its cleanup.
+IN_FLIGHT_STORES = ('handoff.json', 'pending-writes.json', 'propagation-batches.json')
+
+
+# Collect the challenge values (tokens) of every issuance in progress.
+def in_flight_tokens():
+    tokens = set()
+    for store_name in IN_FLIGHT_STORES:
+        for value in StateStore(os.path.join(STATE_DIR, store_name)).items().values():
+            # Handoffs are dicts with a 'token'; queued writes and waits are lists of tuples ending with the token.
+            if isinstance(value, dict):
+                tokens.add(value.get('token'))
+            elif isinstance(value, list):
+                tokens.update(entry[-1] for entry in value if isinstance(entry, list) and entry)
+    return tokens
+
+
+""" The outcome of sweeping one zone. """
+class ZoneSweep:
+    def __init__(self, zone, listed=0, stale=None, deleted=0, error=None):
+        self.zone = zone
+        self.listed = listed
+        self.stale = stale or []
+        self.deleted = deleted
+        self.error = error
+
+
+""" Sweeps the stale challenge records out of every zone of a provider account, on the bulk engine's executor.
+     Each zone's work is the provider client's own synchronous listing and deletion, run on a worker thread. """
+class ChallengeSweeper(AsyncDNSEngine):
+    def __init__(self, provider, keychain=None, concurrency=None, min_age=None, logger=None):
+        super().__init__(provider, keychain, concurrency, logger)
+        self.min_age = SWEEP_MIN_AGE if min_age is None else min_age
+        self.log = HookLog(LOGGING_DIR + '/certbot-sweep.log', provider=provider)
+
+    # Whether a listed record is stale: its value isn't in flight, and (where the provider gives ages) it's old enough
+    #  not to belong to a hook which has just written it but not yet recorded it.
+    def _is_stale(self, record, keep):
+        return record['value'] not in keep and (record['age'] is None or record['age'] >= self.min_age)
+
+    # List, then (unless dry_run) delete, one zone's stale records. The in-flight values are read after the listing,
+    #  so an issuance started during the sweep keeps its records.
+    def _sweep_zone(self, zone, zone_id, dry_run):
+        client = self._client(None, None)
+        try:
+            listed = client.list_challenge_records(zone, zone_id)
+            if listed is None:
+                return ZoneSweep(zone, error="could not list its records")
+            keep = in_flight_tokens()
+            stale = [record for record in listed if self._is_stale(record, keep)]
+            deleted = 0
+            if stale and dry_run is False:
+                deleted = client.delete_challenge_records(zone, zone_id, stale, listed, in_flight_tokens)
+                self.logger("Deleted {} of {} stale challenge record(s) in '{}'.".format(deleted, len(stale), zone))
+            return ZoneSweep(zone, len(listed), stale, deleted)
+        except NotImplementedError:
+            raise
+        except Exception as e:
+            self.logger("Sweeping '{}' failed: {}".format(zone, e))
+            return ZoneSweep(zone, error=str(e))
+
+    # Sweep the given zones ({zone: zone_id or None}), or every zone in the account. Returns a ZoneSweep per zone,
+    #  or None if the account's zones couldn't be listed.
+    async def sweep(self, zones=None, dry_run=False):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        with ThreadPoolExecutor(max_workers=self.concurrency) as self.executor:
+            if zones is None:
+                zones = await self._run(self._client(None, None).list_zones)
+                if zones is None:
+                    return None
+            return await asyncio.gather(*[self._run(self._sweep_zone, zone, zone_id, dry_run)
+                for zone, zone_id in sorted(zones.items())])
+
+
+# Synchronous convenience around the sweeper.
+def sweep(provider, zones=None, dry_run=False, **kwargs):
+    return asyncio.run(ChallengeSweeper(provider, **kwargs).sweep(zones, dry_run))
+
+
+""" Sweep a provider account and report what was (or would be) deleted. """
+def main():
+    parser = argparse.ArgumentParser(description="Delete stale _acme-challenge TXT records from a DNS provider account.")
+    parser.add_argument('provider', choices=sorted(DNS_API_CLIENT.keys()), help="The DNS provider (keychain) to sweep.")
+    parser.add_argument('--dry-run', action='store_true', help="Only report the stale records.")
+    parser.add_argument('--min-age', type=float, default=None,
+        help="Keep records changed less than this many seconds ago (default: SWEEP_MIN_AGE).")
+    parser.add_argument('--zone', action='append', help="Only sweep this zone (may be repeated).")
+    args = parser.parse_args()
+    zones = dict((zone.lower(), None) for zone in args.zone) if args.zone else None
+    try:
+        results = sweep(args.provider, zones, args.dry_run, min_age=args.min_age)
+    except NotImplementedError:
+        sys.exit("The '{}' client can't list records, so its zones can't be swept.".format(args.provider))
+    if results is None:
+        sys.exit("Could not list the zones of the '{}' account.".format(args.provider))
+    for result in results:
+        if result.error is not None:
+            print("{:<8} {:<40} {}".format('FAILED', result.zone, result.error))
+        for record in result.stale:
+            age = "{:.0f}s".format(record['age']) if record['age'] is not None else '-'
+            print("{:<8} {:<60} {:>10}  {}".format('STALE' if args.dry_run else 'DELETED', record['name'], age, record['value']))
+    print("# {} zone(s): {} challenge record(s), {} stale, {} deleted, {} zone(s) failed.".format(len(results),
+        sum(r.listed for r in results), sum(len(r.stale) for r in results), sum(r.deleted for r in results),
+        len([r for r in results if r.error is not None])))
+    sys.exit(1 if any(r.error is not None or (not args.dry_run and r.deleted < len(r.stale)) for r in results) else 0)
+
+
+
+""" Only sweep if this script is being directly executed by the interpreter. """
+if __name__ == '__main__':
+    main()
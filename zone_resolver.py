@@ -0,0 +1,137 @@
+#!/bin/python3
+#
+# zone_resolver.py
+#
+#   Contributors:
+#       Notsoano Nimus <github@xmit.xyz>
+#   Repo:
+#       https://github.com/NotsoanoNimus/certbot-manual-python-hooks
+#   Description:
+#       Automatically set up Certbot authorizations for new and renewing SSL certificates from LetsEncrypt.
+#       Parameters in the accompanying settings.py file are required to be set before running these hooks.
+#
+######################################################################################
+# Copyright (C) 2021 @NotsoanoNimus on GitHub, as a free software project
+#  licensed under GNU GPLv3.
+#
+# This program is free software: you can redistribute it and/or modify it under
+#  the terms of the GNU General Public License as published by the Free Software
+#  Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+#  ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+#  FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along with
+#  this program. If not, see https://www.gnu.org/licenses/.
+######################################################################################
+#
+#
+#
+""" ZONE_RESOLVER.PY - Maps FQDNs to the DNS zones a provider account actually owns. """
+import os, time, threading
+from state_store import StateStore, MISSING
+from settings import *
+
+
+# An FQDN that matches no known zone triggers a fresh zone listing, but not more often than this (in seconds).
+#  A listing that failed isn't attempted again for as long either.
+MISS_RELIST_INTERVAL = 300
+
+
+""" A suffix trie over zone names, keyed by labels from the right (com -> example -> www), so the zone of any FQDN is
+     found with a single walk down its labels. Multi-label public suffixes (co.uk) need no special handling. """
+class ZoneTrie:
+    # The key holding a node's zone; it can't collide with a label, since DNS labels are never empty.
+    TERMINAL = ''
+
+    def __init__(self, zones=None):
+        self.root = {}
+        for zone, zone_id in (zones or {}).items():
+            self.insert(zone, zone_id)
+
+    # Add a zone (with its provider ID, if any).
+    def insert(self, zone, zone_id=None):
+        zone = zone.lower().rstrip('.')
+        node = self.root
+        for label in reversed(zone.split('.')):
+            node = node.setdefault(label, {})
+        node[self.TERMINAL] = (zone, zone_id)
+
+    # Find the longest (most specific) zone containing the FQDN. Returns (zone, zone_id), or None if none does.
+    def lookup(self, fqdn):
+        node, match = self.root, None
+        for label in reversed(fqdn.lower().rstrip('.').split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            match = node.get(self.TERMINAL, match)
+        return match
+
+
+""" Resolves FQDNs against the full list of zones in one provider account.
+     The zone list is fetched once (through a callable supplied by the API client), kept in memory for the life of the
+     process and on disk in STATE_DIR for ZONE_LIST_TTL seconds, so every hook process shares a single listing. """
+class ZoneResolver:
+    def __init__(self, key, store=None):
+        self.key = key
+        self.store = store or StateStore(os.path.join(STATE_DIR, 'zones.json'), default_ttl=ZONE_LIST_TTL)
+        self.trie = None
+        self.listed = 0
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    # Fetch the zone list with list_zones() and persist it. Returns False if the listing failed (or recently failed).
+    def _relist(self, list_zones):
+        if time.time() - self.failed < MISS_RELIST_INTERVAL:
+            return False
+        self.failed = time.time()
+        zones = list_zones()
+        if zones is None:
+            return False
+        self.failed = 0
+        self.trie = ZoneTrie(zones)
+        self.listed = time.time()
+        self.store.set(self.key, {'zones': zones, 'listed': self.listed})
+        return True
+
+    # Load the zone list from disk, or fetch it when there's no (unexpired) copy.
+    def _ensure_loaded(self, list_zones):
+        if self.trie is not None and time.time() - self.listed < ZONE_LIST_TTL:
+            return True
+        cached = self.store.get(self.key)
+        if cached is not MISSING:
+            self.trie = ZoneTrie(cached['zones'])
+            self.listed = cached['listed']
+            return True
+        return self._relist(list_zones)
+
+    # Resolve an FQDN to (zone, subdomain, zone_id), where subdomain is the FQDN relative to the zone (None at the apex).
+    #  list_zones is called (at most once) if the zone list has to be fetched; it returns {zone_name: zone_id}, or None
+    #  on failure. Returns None if the FQDN isn't in any of the account's zones, or the zones couldn't be listed.
+    def resolve(self, fqdn, list_zones):
+        fqdn = fqdn.lower().rstrip('.')
+        with self.lock:
+            if self._ensure_loaded(list_zones) is False:
+                return None
+            match = self.trie.lookup(fqdn)
+            # The zone may have been added to the account since the list was fetched.
+            if match is None and time.time() - self.listed > MISS_RELIST_INTERVAL and self._relist(list_zones):
+                match = self.trie.lookup(fqdn)
+        if match is None:
+            return None
+        zone, zone_id = match
+        return zone, (fqdn[:-len(zone) - 1] or None), zone_id
+
+
+# Resolvers shared by every API client of the same provider account within this process.
+_RESOLVERS = {}
+_RESOLVERS_LOCK = threading.Lock()
+
+# Get (or create) the shared resolver for a provider account.
+def resolver_for(provider, account_key):
+    key = "{}/{}".format(provider, account_key)
+    with _RESOLVERS_LOCK:
+        if key not in _RESOLVERS:
+            _RESOLVERS[key] = ZoneResolver(key)
+        return _RESOLVERS[key]